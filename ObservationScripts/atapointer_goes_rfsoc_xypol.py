@@ -1,5 +1,5 @@
 #!/home/obsuser/miniconda3/envs/ATAobs/bin/python
-from ATATools import ata_control, logger_defaults, ata_sources, ata_pointing
+from ATATools import ata_control, logger_defaults, ata_sources, ata_pointing, ata_ephem
 import atexit
 from SNAPobs import snap_dada, snap_if
 from sigpyproc.Readers import FilReader
@@ -137,8 +137,7 @@ def get_ephem_az_el(ephem, t1, t2):
     ephem is the ephemeris file (as a numpy array)
     return average az, el
     """
-    ephem_sub = ephem[(ephem[:,0] > t1) & (ephem[:,0] < t2)]
-    return np.mean(ephem_sub[:,1]), np.mean(ephem_sub[:,2])
+    return ata_ephem.mean_az_el(ephem, t1, t2)
 
 
 
@@ -207,7 +206,7 @@ def main():
     antlo_list = [ant+lo for ant in ant_list]
 
     #ant_list = ["2a", "2b", "5c"]
-    pms = {ant:ata_pointing.PointingModel(ant) for ant in ant_list}
+    pms = ata_pointing.PointingModelSet(ant_list)
     #pm = ata_pointing.PointingModel('3c')
 
     ata_control.reserve_antennas(ant_list)
@@ -286,9 +285,8 @@ def main():
     for sat_name in sats:
         name = sat_name
 
-        ephem = ata_control.create_ephem(name, 
+        ephem = ata_control.create_ephem_points(name, 
                 **{'duration': 2, 'interval': 1})
-        ephem = np.array(ephem)
 
         # offsets = az/el
         for i in range(nRepeats):
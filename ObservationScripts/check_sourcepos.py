@@ -1,5 +1,5 @@
 from ATATools import ata_control, logger_defaults
-from ATATools import ata_sources
+from ATATools import ata_catalog
 import numpy as np
 import sys
 import time
@@ -33,21 +33,25 @@ def main():
     ra_lst=[]
     dec_lst=[]
 
+    #elevations of all the sources now
+    az_now, el_now = ata_catalog.source_azel(source_names)
+
     #loop through source list
     for i, source in enumerate(source_names):
         
         #make sure source is not observed
         if is_observed(csv_name, source, freqs) == 0 and\
                 is_observed(csv_name, source, freqs_c) == 0:
+            ra, dec = ata_catalog.source_radec(source)
             src_lft.append(source)
-            ra_lst.append(ata_sources.check_source(source)['ra'])
-            dec_lst.append(ata_sources.check_source(source)['dec'])
-            print(source, ata_sources.check_source(source)['ra'], ata_sources.check_source(source)['dec'])
+            ra_lst.append(ra)
+            dec_lst.append(dec)
+            print(source, ra, dec)
             
             #place elevation limits
-            if 85 > ata_sources.check_source(source)['el'] > 19:
+            if 85 > el_now[i] > 19:
                 lista.append(source)
-                listb.append(ata_sources.check_source(source)['el']) 
+                listb.append(el_now[i]) 
             else:
                 #print(str(source) + " is not high (or low) enough to observe, trying again once all others are targeted")
                 continue
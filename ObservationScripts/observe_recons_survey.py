@@ -2,7 +2,7 @@
 import atexit
 from ATATools import ata_control, logger_defaults
 from SNAPobs import snap_dada, snap_if
-from ATATools import ata_sources
+from ATATools import ata_catalog
 import numpy as np
 import sys
 import time
@@ -75,7 +75,7 @@ def main():
             if is_observed(csv_name, source, freqs[0]) == 0 and\
                     is_observed(csv_name, source, freqs_c[0]) == 0:
                 #place elevation limits
-                if 85 > ata_sources.check_source(source)['el'] > 21:
+                if 85 > ata_catalog.source_azel(source)[1][0] > 21:
                 
                     ata_control.make_and_track_ephems(source, ant_list)
                     
@@ -97,7 +97,7 @@ def main():
 
                     print("Starting new obs")
                     
-                    if 85 < ata_sources.check_source(source)['el'] < 21:
+                    if 85 < ata_catalog.source_azel(source)[1][0] < 21:
                         continue
 
                     # Start recording -- record_in does NOT block
@@ -2,7 +2,7 @@
 import atexit
 from ATATools import ata_control, logger_defaults
 from SNAPobs import snap_dada, snap_if
-from ATATools import ata_sources
+from ATATools import ata_catalog
 import numpy as np
 import sys
 import time
@@ -36,13 +36,8 @@ def main():
     
     print("Aquiring source list")
     
-    lista = []
-    
-    with open("source_radec_ant_cal.txt") as f:
-        source_list = f.readlines()[1:]
-
-        for x in source_list:
-            lista.append(x.split(' ')[0])
+    lista = [entry['name'] for entry in
+            ata_catalog.read_radec_list("source_radec_ant_cal.txt")]
 
     source_name = lista
 
@@ -54,7 +49,7 @@ def main():
         for i, source in enumerate(source_name):
             print(i, source)
 
-            if 85 > ata_sources.check_source(source)['el'] > 21:
+            if 85 > ata_catalog.source_azel(source)[1][0] > 21:
       
                 ata_control.make_and_track_ephems(source, ant_list)
 
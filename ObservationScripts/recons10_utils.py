@@ -2,8 +2,26 @@ import pandas as pd
 import numpy as np
 import os
 
+from ATATools import ata_catalog
+
 FREQ_RANGE = [3350, 4050, 4750, 5450, 6150, 6850, 7550, 8250, 8950, 9650]
 
+# csv_name -> (mtime_ns, entries indexed by Name)
+_entries_cache = {}
+
+def _read_entries(csv_name):
+    """
+    Returns the entry database indexed by source name, read again only
+    if the file changed
+    """
+    mtime = os.stat(csv_name).st_mtime_ns
+    cached = _entries_cache.get(csv_name)
+    if cached is None or cached[0] != mtime:
+        entries = pd.read_csv(csv_name).set_index('Name', drop=False)
+        cached = (mtime, entries)
+        _entries_cache[csv_name] = cached
+    return cached[1]
+
 def create_entry_csv(original_recons_csv, freq_range=FREQ_RANGE,
         output_csv="sources_observed.csv"):
     """
@@ -28,8 +46,7 @@ def get_source_names(csv_name):
     """
     returns a list of all the sources in the recons10 database
     """
-    d = pd.read_csv(csv_name)
-    return list(d['Name'])
+    return list(_read_entries(csv_name)['Name'])
 
 def is_observed(csv_name, source, freq_mhz):
     """
@@ -38,11 +55,8 @@ def is_observed(csv_name, source, freq_mhz):
     assert type(source) == str
     assert type(freq_mhz) == int
 
-    source_entries = pd.read_csv(csv_name)
     cfreq_name = "cfreq_%imhz" %freq_mhz
-
-    row = source_entries.loc[source_entries['Name'] == source]
-    return row[cfreq_name].values[0]
+    return _read_entries(csv_name).at[source, cfreq_name]
 
 def mark_as_observed(csv_name, source, freq_mhz):
     """
@@ -51,13 +65,29 @@ def mark_as_observed(csv_name, source, freq_mhz):
     assert type(source) == str
     assert type(freq_mhz) == int
 
-    source_entries = pd.read_csv(csv_name)
+    source_entries = _read_entries(csv_name)
     cfreq_name = "cfreq_%imhz" %freq_mhz
 
-    ival = source_entries.loc[source_entries['Name'] == source, cfreq_name].values[0]
+    ival = source_entries.at[source, cfreq_name]
 
     if ival == 0:
-        source_entries.loc[source_entries['Name'] == source, cfreq_name] = 1
+        source_entries.at[source, cfreq_name] = 1
         source_entries.to_csv(csv_name, index=False)
+        _entries_cache[csv_name] = (os.stat(csv_name).st_mtime_ns, source_entries)
     elif ival == 1:
         print("WARNING: has this source been observed before?")
+
+def get_observable_sources(csv_name, freqs_mhz, min_elev=21, max_elev=85):
+    """
+    Returns the sources not yet observed at any of the frequencies that
+    are between min_elev and max_elev now, as a structured array of
+    ata_catalog.SourceCatalog.above (highest flux/farthest from the Sun first)
+    """
+    entries = _read_entries(csv_name)
+    observed = np.zeros(len(entries), dtype=bool)
+    for freq_mhz in freqs_mhz:
+        observed |= entries["cfreq_%imhz" %freq_mhz].values != 0
+    todo = set(entries['Name'].values[~observed])
+
+    up = ata_catalog.get_catalog().above(min_elev, max_elev=max_elev)
+    return up[[name in todo for name in up['name']]]
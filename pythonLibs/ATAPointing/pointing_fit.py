@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+import sys,os
+import logging
+
+import argparse
+
+from ATATools import ata_pointing_fit, logger_defaults
+
+OUT_BASEDIR="./"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Fit the TPOINT pointing models of all antennas using .tpoint files')
+    parser.add_argument('in_files', nargs = '+', type=str,
+            help = 'Input .tpoint files')
+    parser.add_argument('-r', dest='robust', type=str, default='huber',
+            choices=['none', 'huber', 'mad'],
+            help = 'Outlier weighting [default=huber]')
+    parser.add_argument('-t', dest='terms', type=str,
+            default=",".join(ata_pointing_fit.DEFAULT_FIT_TERMS),
+            help = 'Comma separated TPOINT terms to fit [default=%s]'
+            %",".join(ata_pointing_fit.DEFAULT_FIT_TERMS))
+    parser.add_argument('-j', dest='workers', type=int,
+            default=ata_pointing_fit.FIT_WORKERS,
+            help = 'Number of antennas fitted in parallel [default=%i]'
+            %ata_pointing_fit.FIT_WORKERS)
+    parser.add_argument('-d', dest='out_basedir', type=str, default=None,
+            help = 'Write the fitted models as <ant><pol>.pm files to this directory')
+    args = parser.parse_args()
+
+    logger_defaults.getProgramLogger("pointing_fit", loglevel=logging.WARNING)
+
+    robust = None if args.robust == 'none' else args.robust
+    fits = ata_pointing_fit.fit_tpoint_files(args.in_files, robust=robust,
+            terms=args.terms.split(","), max_workers=args.workers)
+
+    print("%-6s %4s %7s %7s %11s %11s" %("ant", "pol", "points", "used",
+        "rms before", "rms after"))
+    for (ant, pol), fit in sorted(fits.items(), key=lambda kv: str(kv[0])):
+        print("%-6s %4s %7i %7i %10.1f\" %10.1f\"%s" %(ant, pol, fit.n_points,
+            fit.n_used, fit.rms_before, fit.rms_after,
+            "" if fit.improved else "  (no improvement)"))
+
+        if args.out_basedir:
+            os.makedirs(args.out_basedir, exist_ok=True)
+            fname = os.path.join(args.out_basedir, "%s%s.pm" %(ant, pol or ""))
+            with open(fname, "w") as f:
+                f.write(fit.to_tpoint_str())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Time-to-live caches for slow-changing control system reads
+(antenna positions, pointing models, catalogue source positions, ...)
+
+Caches are created (or fetched) by name with get_cache(), so the code
+reading a value and the code changing it (e.g. ata_control.set_freq)
+share the same cache and the setter can invalidate what it affects.
+A cache can be persisted to disk (as json, so its keys and values
+must be json types; tuples come back as lists), so a value fetched by
+one script is still valid for the next one. Changes are written at
+most every SAVE_DELAY seconds, and at exit.
+
+    cache = ata_cache.get_cache('ant_pos', ttl=86400, persist=True)
+    pos = cache.get_or_fetch('1a', lambda: fetch_position('1a'))
+    ...
+    ata_cache.stats()  # hit/miss counters of all caches
+
+Caching can be switched off globally with set_enabled(False), or by
+setting the ATA_CACHE_DISABLE environment variable.
+"""
+
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+
+from . import logger_defaults
+
+CACHE_DIR = os.environ.get('ATA_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'ATATools'))
+
+SAVE_DELAY = 1.0 #seconds between the writes of a persistent cache
+
+_CACHE_FORMAT = 1
+
+_enabled = 'ATA_CACHE_DISABLE' not in os.environ
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class TTLCache:
+    """
+    Thread-safe key/value cache in which every entry expires ttl seconds
+    after it was stored.
+
+    If persist_path is given, the entries are loaded from that json
+    file on creation and written back (atomically) SAVE_DELAY seconds
+    after a change, so a burst of set() calls costs one write; flush()
+    writes them immediately. Expiry times are stored as unix times, so
+    they stay valid across processes.
+
+    Other cache implementations can be plugged in with register_cache(),
+    they need to provide the get/set/get_or_fetch/invalidate/clear/stats
+    methods of this class.
+    """
+
+    def __init__(self, name, ttl, persist_path=None, maxsize=None):
+        self.name = name
+        self.ttl = float(ttl)
+        self.persist_path = persist_path
+        self.maxsize = maxsize
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.RLock()
+        self._data = {}
+        self._dirty = False
+        self._save_timer = None
+        if persist_path:
+            self._load()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """
+        Return the cached value for key, or default if there is no
+        valid entry. Counts a hit or a miss
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.time() and _enabled:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """
+        Store value under key, valid for ttl seconds (default: the cache ttl)
+        """
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            if self.maxsize and len(self._data) > self.maxsize:
+                self._expire(force=True)
+            self._changed()
+
+    def get_or_fetch(self, key, fetch, ttl=None):
+        """
+        Return the cached value for key. On a miss, call fetch(),
+        store and return its value. Exceptions from fetch() are
+        not cached, they propagate to the caller
+        """
+        sentinel = _MISSING
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = fetch()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, key=None):
+        """
+        Remove the entry for key, or all of the entries if key is None.
+        key can also be a function, in which case all the entries for
+        whose key it returns True are removed
+        """
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            elif callable(key):
+                for k in [k for k in self._data if key(k)]:
+                    del self._data[k]
+            else:
+                self._data.pop(key, None)
+            self._changed()
+
+    def clear(self):
+        """
+        Remove all the entries and reset the counters
+        """
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.invalidate()
+
+    def flush(self):
+        """
+        Write the pending changes of a persistent cache to its file now
+        """
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if self._dirty:
+                self._dirty = False
+                self._save()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._data), 'ttl': self.ttl,
+                    'persist_path': self.persist_path}
+
+    def _expire(self, force=False):
+        # caller holds the lock
+        now = time.time()
+        for k in [k for k, entry in self._data.items() if entry[0] <= now]:
+            del self._data[k]
+        if force and self.maxsize:
+            # drop the entries closest to expiry
+            while len(self._data) > self.maxsize:
+                oldest = min(self._data, key=lambda k: self._data[k][0])
+                del self._data[oldest]
+
+    def _changed(self):
+        # caller holds the lock
+        if not self.persist_path:
+            return
+        self._dirty = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(SAVE_DELAY, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _load(self):
+        logger = logger_defaults.getModuleLogger(__name__)
+        try:
+            with open(self.persist_path) as f:
+                content = json.load(f)
+            if content.get('format') != _CACHE_FORMAT:
+                return
+            # json has no tuples, keys need to be hashable
+            self._data = {tuple(key) if isinstance(key, list) else key:
+                    (expires, value) for key, expires, value in content['entries']}
+            self._expire()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning('ignoring unreadable cache file {:s}: {:s}'.format(
+                self.persist_path, str(e)))
+            self._data = {}
+
+    def _save(self):
+        # caller holds the lock
+        logger = logger_defaults.getModuleLogger(__name__)
+        self._expire()
+        try:
+            dirname = os.path.dirname(self.persist_path)
+            os.makedirs(dirname, exist_ok=True)
+            fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.' + self.name)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({'format': _CACHE_FORMAT, 'entries':
+                        [[key, expires, value] for key, (expires, value)
+                            in self._data.items()]}, f)
+                os.replace(tmpname, self.persist_path)
+            except Exception:
+                os.unlink(tmpname)
+                raise
+        except Exception as e:
+            # the cache still works from memory
+            logger.warning('could not write cache file {:s}: {:s}'.format(
+                self.persist_path, str(e)))
+
+
+class _Missing:
+    pass
+
+_MISSING = _Missing()
+
+
+def get_cache(name, ttl=60.0, persist=False, maxsize=None):
+    """
+    Return the cache registered under name, creating a TTLCache on first use.
+    ttl, persist and maxsize are only used when the cache is created.
+    Persistent caches are stored in CACHE_DIR/<name>.json
+    """
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None:
+            persist_path = os.path.join(CACHE_DIR, name + '.json') if persist else None
+            cache = TTLCache(name, ttl, persist_path, maxsize)
+            _caches[name] = cache
+        return cache
+
+def register_cache(name, cache):
+    """
+    Use cache (a TTLCache or an object with the same interface) for name
+    """
+    with _caches_lock:
+        _caches[name] = cache
+
+def invalidate(name, key=None):
+    """
+    Invalidate key (or everything, if key is None) in the named cache.
+    Does nothing if the cache was never used
+    """
+    with _caches_lock:
+        cache = _caches.get(name)
+    if cache is not None:
+        cache.invalidate(key)
+
+def set_enabled(enabled):
+    """
+    Globally switch caching on or off. While off, every read is a miss
+    """
+    global _enabled
+    _enabled = bool(enabled)
+
+def stats():
+    """
+    Return the hit/miss counters of all caches, e.g.
+    {'ant_pos': {'hits': 40, 'misses': 2, 'size': 42, ...}}
+    """
+    with _caches_lock:
+        caches = dict(_caches)
+    return {name: cache.stats() for name, cache in caches.items()}
+
+@atexit.register
+def flush():
+    """
+    Write the pending changes of all the persistent caches
+    """
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        if hasattr(cache, 'flush'):
+            cache.flush()
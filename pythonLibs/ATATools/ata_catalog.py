@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Local catalogue of the named sources observed with the ATA.
+
+The source lists used by the observing scripts (source_radec.txt,
+source_radec_flux.txt, source_radec_ant_cal.txt and the RECONS 10 pc
+list recons_10pc_ata_bds_no_binary.csv) are loaded once into columnar
+numpy arrays, indexed by name and by a KD-tree on the J2000 unit
+vectors, so that cone searches and "what is up now" queries don't
+need to scan the lists (or ask the control server source by source):
+
+    from ATATools import ata_catalog
+
+    cat = ata_catalog.get_catalog()
+    ra, dec = cat.radec('3c286')
+    near = cat.cone(12.5, 2.0, 5.0)        # sources within 5 deg, nearest first
+    up = cat.above(23.0, band='L')         # up now, brightest first
+    for src in up:
+        print(src['name'], src['el'], src['flux'], src['sun_dist'])
+
+The files are looked for in CATALOG_DIR (the ATA_CATALOG_DIR environment
+variable, or the ObservationScripts directory of the checkout), and
+reloaded by get_catalog() when they change. An installed package has
+no ObservationScripts directory: set ATA_CATALOG_DIR, get_catalog()
+raises FileNotFoundError if it finds none of the files.
+
+source_radec() and source_azel() fall back to the control server
+(ata_sources.check_source) for the names that are not in the catalogue:
+
+    ra, dec = ata_catalog.source_radec('casa')
+    az, el = ata_catalog.source_azel(['3c286', 'moon'])
+"""
+
+import csv
+import datetime as dt
+import math
+import os
+import threading
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from . import ata_constants as ata_const
+from . import ata_positions, logger_defaults
+
+CATALOG_DIR = os.environ.get('ATA_CATALOG_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)),
+            '..', '..', 'ObservationScripts'))
+
+# loaded in this order, a source found again only adds the missing columns
+CATALOG_FILES = ('source_radec.txt', 'source_radec_flux.txt',
+        'source_radec_ant_cal.txt', 'recons_10pc_ata_bds_no_binary.csv')
+
+FLUX_BANDS = ('L', 'C')
+
+# the elevation query preselects the sources in a cone around the zenith,
+# widened by this much for the refraction and the terms radec_to_azel
+# doesn't model
+ELEV_SEARCH_MARGIN = 1.0 #degrees
+
+_MAS_TO_DEG = 1.0 / 3600.0e3
+
+
+def _unit_vectors(ra, dec):
+    """
+    (N, 3) unit vectors of ra in hours, dec in degrees
+    """
+    ra = np.radians(np.asarray(ra, dtype=np.float64) * 15.0)
+    dec = np.radians(np.asarray(dec, dtype=np.float64))
+    return np.stack([np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra),
+        np.sin(dec)], axis=-1)
+
+def _chord(radius):
+    """
+    chord length on the unit sphere of an angular radius in degrees
+    """
+    return 2.0 * math.sin(math.radians(min(radius, 180.0)) / 2.0)
+
+def _decimal_year(d):
+    d = dt.datetime.fromtimestamp(ata_positions._to_unix(d), dt.timezone.utc)
+    start = dt.datetime(d.year, 1, 1, tzinfo=dt.timezone.utc)
+    end = dt.datetime(d.year + 1, 1, 1, tzinfo=dt.timezone.utc)
+    return d.year + (d - start).total_seconds() / (end - start).total_seconds()
+
+def _float(s):
+    try:
+        return float(s)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def read_radec_list(filename):
+    """
+    Read a "Source RA Dec [L_Flux C_Flux]" list (ra in hours, dec in degrees)
+
+    :returns list of dictionaries with the keys name, ra, dec, flux_l, flux_c
+    """
+    entries = []
+    with open(filename) as f:
+        header = f.readline().split()
+        columns = [c.lower() for c in header]
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            row = dict(zip(columns, fields))
+            entries.append({'name': row['source'],
+                'ra': float(row['ra']), 'dec': float(row['dec']),
+                'flux_l': _float(row.get('l_flux')),
+                'flux_c': _float(row.get('c_flux'))})
+    return entries
+
+def read_recons_csv(filename, epoch=None):
+    """
+    Read the RECONS csv list (ra, dec in degrees at the Epoch column,
+    proper motions in mas/yr). The positions are moved to epoch
+    (decimal year, default now) with the proper motions
+
+    :returns list of dictionaries with the keys name, ra, dec, flux_l, flux_c
+    """
+    if epoch is None:
+        epoch = _decimal_year(dt.datetime.now(dt.timezone.utc))
+    entries = []
+    with open(filename, newline='') as f:
+        for row in csv.DictReader(f):
+            ra = float(row['RA'])
+            dec = float(row['DEC'])
+            years = epoch - _float(row.get('Epoch'))
+            pm_ra = _float(row.get('pmRA'))
+            pm_dec = _float(row.get('pmDE'))
+            if np.isfinite(years) and np.isfinite(pm_ra) and np.isfinite(pm_dec):
+                # pmRA is given as pmRA * cos(dec)
+                dec_new = dec + pm_dec * years * _MAS_TO_DEG
+                ra += pm_ra * years * _MAS_TO_DEG / math.cos(math.radians(dec))
+                dec = dec_new
+            entries.append({'name': row['Name'].strip(),
+                'ra': (ra % 360.0) / 15.0, 'dec': dec,
+                'flux_l': np.nan, 'flux_c': np.nan})
+    return entries
+
+
+class SourceCatalog:
+    """
+    Columnar, indexed source catalogue
+
+    Attributes (arrays in catalogue order):
+        names: list of source names
+        ra, dec: J2000 ra in hours, dec in degrees
+        flux_l, flux_c: L and C band flux densities in Jy (nan if unknown)
+    """
+
+    def __init__(self, names, ra, dec, flux_l=None, flux_c=None):
+        nsrc = len(names)
+        self.names = list(names)
+        self.ra = np.asarray(ra, dtype=np.float64).reshape(nsrc)
+        self.dec = np.asarray(dec, dtype=np.float64).reshape(nsrc)
+        self.flux_l = (np.full(nsrc, np.nan) if flux_l is None
+                else np.asarray(flux_l, dtype=np.float64).reshape(nsrc))
+        self.flux_c = (np.full(nsrc, np.nan) if flux_c is None
+                else np.asarray(flux_c, dtype=np.float64).reshape(nsrc))
+        self._index = {name.lower(): i for i, name in enumerate(self.names)}
+        self._vectors = _unit_vectors(self.ra, self.dec).reshape(nsrc, 3)
+        self._tree = cKDTree(self._vectors) if nsrc else None
+        self._name_dtype = 'U{}'.format(max([len(n) for n in self.names] + [1]))
+
+    @classmethod
+    def from_entries(cls, entries):
+        """
+        Build the catalogue from dictionaries as returned by read_radec_list,
+        the first entry of a name gives its position, later ones can only
+        fill in the missing fluxes
+        """
+        merged = {}
+        for entry in entries:
+            key = entry['name'].lower()
+            if key not in merged:
+                merged[key] = dict(entry)
+                continue
+            for col in ('flux_l', 'flux_c'):
+                if np.isnan(merged[key][col]):
+                    merged[key][col] = entry[col]
+        rows = list(merged.values())
+        return cls([r['name'] for r in rows], [r['ra'] for r in rows],
+                [r['dec'] for r in rows], [r['flux_l'] for r in rows],
+                [r['flux_c'] for r in rows])
+
+    @classmethod
+    def from_files(cls, filenames, epoch=None):
+        """
+        Load source lists: .csv files are read as RECONS lists, the
+        others as "Source RA Dec [L_Flux C_Flux]" lists
+        """
+        entries = []
+        for filename in filenames:
+            if filename.endswith('.csv'):
+                entries.extend(read_recons_csv(filename, epoch))
+            else:
+                entries.extend(read_radec_list(filename))
+        return cls.from_entries(entries)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name.lower() in self._index
+
+    def index(self, name):
+        """
+        Row of source name (case insensitive)
+
+        :raises KeyError if the source is not in the catalogue
+        """
+        return self._index[name.lower()]
+
+    def radec(self, name):
+        """
+        Return (ra, dec) of source name, ra in hours, dec in degrees
+
+        :raises KeyError if the source is not in the catalogue
+        """
+        i = self.index(name)
+        return float(self.ra[i]), float(self.dec[i])
+
+    def flux(self, band='L'):
+        """
+        flux column of band 'L' or 'C'
+        """
+        band = band.upper()
+        if band not in FLUX_BANDS:
+            raise ValueError("unknown band {}, expected one of {}".format(band, FLUX_BANDS))
+        return self.flux_l if band == 'L' else self.flux_c
+
+    def select(self, rows, **columns):
+        """
+        Return the rows as a structured array with the fields name, ra,
+        dec, flux_l, flux_c, and the extra columns given (arrays of len(rows))
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        dtype = [('name', self._name_dtype), ('ra', '<f8'), ('dec', '<f8'),
+                ('flux_l', '<f8'), ('flux_c', '<f8')]
+        dtype += [(col, '<f8') for col in columns]
+        out = np.empty(len(rows), dtype=dtype)
+        out['name'] = [self.names[i] for i in rows]
+        out['ra'] = self.ra[rows]
+        out['dec'] = self.dec[rows]
+        out['flux_l'] = self.flux_l[rows]
+        out['flux_c'] = self.flux_c[rows]
+        for col, values in columns.items():
+            out[col] = values
+        return out
+
+    def cone_rows(self, ra, dec, radius):
+        """
+        Rows of the sources within radius degrees of ra (hours), dec
+        (degrees), nearest first
+
+        :returns rows, distances in degrees
+        """
+        if self._tree is None:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        center = _unit_vectors(ra, dec)
+        rows = np.array(self._tree.query_ball_point(center, _chord(radius)),
+                dtype=np.intp)
+        cos_d = np.clip(self._vectors[rows] @ center, -1.0, 1.0)
+        dist = np.degrees(np.arccos(cos_d))
+        order = np.argsort(dist, kind='stable')
+        return rows[order], dist[order]
+
+    def cone(self, ra, dec, radius):
+        """
+        Sources within radius degrees of ra (hours), dec (degrees),
+        nearest first, see select() (plus the field 'dist' in degrees)
+        """
+        rows, dist = self.cone_rows(ra, dec, radius)
+        return self.select(rows, dist=dist)
+
+    def nearest(self, ra, dec, k=1):
+        """
+        The k sources closest to ra (hours), dec (degrees), see cone()
+        """
+        if self._tree is None:
+            return self.select([], dist=[])
+        center = _unit_vectors(ra, dec)
+        _, rows = self._tree.query(center, k=min(k, len(self)))
+        rows = np.atleast_1d(rows)
+        cos_d = np.clip(self._vectors[rows] @ center, -1.0, 1.0)
+        return self.select(rows, dist=np.degrees(np.arccos(cos_d)))
+
+    def azel(self, names, t=None):
+        """
+        az/el in degrees of the named sources at time t (datetime,
+        naive is UTC, or unix time; default now)
+
+        :returns az, el arrays of len(names)
+        :raises KeyError if a source is not in the catalogue
+        """
+        if isinstance(names, str):
+            names = [names]
+        if t is None:
+            t = dt.datetime.now(dt.timezone.utc)
+        rows = [self.index(name) for name in names]
+        az, el = ata_positions.radec_to_azel(self.ra[rows], self.dec[rows],
+                ata_positions._times_to_unix(t)[:1])
+        return az[:, 0], el[:, 0]
+
+    def above(self, min_elev=None, t=None, band='L', min_sun_dist=0.0,
+            max_elev=90.0, skymask=None, geo=True):
+        """
+        Sources above min_elev degrees (default ata_positions.MIN_ELEV)
+        at time t (datetime, naive is UTC, or unix time; default now),
+        ranked by flux in band (brightest first, unknown fluxes last)
+        then by distance to the Sun (farthest first).
+        If an ata_skymask.SkyMask is given, the sources in its Sun/Moon
+        (and, if geo, GEO belt) exclusion zones are left out
+
+        :returns structured array, see select(), plus the fields az, el,
+            flux (of band) and sun_dist in degrees
+        """
+        if min_elev is None:
+            min_elev = ata_positions.MIN_ELEV
+        if t is None:
+            t = dt.datetime.now(dt.timezone.utc)
+        unix_times = ata_positions._times_to_unix(t)[:1]
+        flux = self.flux(band)
+        if self._tree is None:
+            return self.select([], az=[], el=[], flux=[], sun_dist=[])
+
+        # the zenith, precessed back to J2000
+        jd = unix_times / 86400.0 + ata_positions._UNIX_EPOCH_JD
+        lst = ata_positions._local_sidereal_time(jd)[0]
+        zenith = _unit_vectors(np.degrees(lst) / 15.0, ata_const.ATA_LAT)
+        zenith = ata_positions._precession_matrices(jd)[0].T @ zenith
+        rows = np.array(self._tree.query_ball_point(zenith,
+            _chord(90.0 - min_elev + ELEV_SEARCH_MARGIN)), dtype=np.intp)
+
+        az, el = ata_positions.radec_to_azel(self.ra[rows], self.dec[rows], unix_times)
+        az, el = az[:, 0], el[:, 0]
+        sun_az, sun_el = ata_positions._solar_system_azel('sun', unix_times)
+        sun_dist = ata_positions.angular_separation(az, el, sun_az[0], sun_el[0])
+
+        keep = (el > min_elev) & (el < max_elev) & (sun_dist >= min_sun_dist)
+        if skymask is not None:
+            keep &= ~skymask.excluded(self.ra[rows], self.dec[rows], unix_times,
+                    geo=geo)[:, 0]
+        rows, az, el, sun_dist = rows[keep], az[keep], el[keep], sun_dist[keep]
+        row_flux = flux[rows]
+        # lexsort: last key is the primary one
+        order = np.lexsort((-sun_dist, -np.nan_to_num(row_flux, nan=-np.inf)))
+        return self.select(rows[order], az=az[order], el=el[order],
+                flux=row_flux[order], sun_dist=sun_dist[order])
+
+
+_catalog = None
+_catalog_stamp = None
+_catalog_lock = threading.Lock()
+
+def catalog_paths(directory=None):
+    """
+    The CATALOG_FILES found in directory (default CATALOG_DIR)
+    """
+    directory = CATALOG_DIR if directory is None else directory
+    paths = [os.path.join(directory, f) for f in CATALOG_FILES]
+    return [p for p in paths if os.path.exists(p)]
+
+def get_catalog(required=True):
+    """
+    Return the process-wide SourceCatalog of the CATALOG_FILES,
+    reloaded if the files changed since the last call
+
+    :param required: if False, an empty catalogue is returned when
+        CATALOG_DIR has none of the files
+    :raises FileNotFoundError if required and CATALOG_DIR has none of
+        the CATALOG_FILES (e.g. an installed package without
+        ATA_CATALOG_DIR set)
+    """
+    global _catalog, _catalog_stamp
+    paths = catalog_paths()
+    if not paths and required:
+        raise FileNotFoundError("no source catalogue ({}) found in {}, "
+                "set ATA_CATALOG_DIR to the directory of the source "
+                "lists".format(", ".join(CATALOG_FILES),
+                    os.path.abspath(CATALOG_DIR)))
+    stamp = tuple((p, os.stat(p).st_mtime_ns) for p in paths)
+    with _catalog_lock:
+        if _catalog is None or stamp != _catalog_stamp:
+            if not paths:
+                logger = logger_defaults.getModuleLogger(__name__)
+                logger.warning('no source catalogue found in {}'.format(CATALOG_DIR))
+            _catalog = SourceCatalog.from_files(paths)
+            _catalog_stamp = stamp
+        return _catalog
+
+def source_radec(name):
+    """
+    (ra, dec) of source name, ra in hours, dec in degrees, from the
+    catalogue, or from the control server (ata_sources.check_source)
+    if the catalogue doesn't have it
+    """
+    catalog = get_catalog()
+    if name in catalog:
+        return catalog.radec(name)
+    from . import ata_sources
+    info = ata_sources.check_source(name)
+    return float(info['ra']), float(info['dec'])
+
+def source_azel(names):
+    """
+    az/el in degrees of the named sources now: the catalogue sources
+    in one vectorised pass, the others from the control server
+    (ata_sources.check_source, one call per source)
+
+    :returns az, el arrays of len(names)
+    """
+    if isinstance(names, str):
+        names = [names]
+    catalog = get_catalog()
+    az = np.empty(len(names))
+    el = np.empty(len(names))
+    known = [i for i, name in enumerate(names) if name in catalog]
+    if known:
+        az[known], el[known] = catalog.azel([names[i] for i in known])
+    unknown = [i for i, name in enumerate(names) if name not in catalog]
+    if unknown:
+        from . import ata_sources
+        for i in unknown:
+            info = ata_sources.check_source(names[i])
+            az[i], el[i] = info['az'], info['el']
+    return az, el
@@ -16,10 +16,12 @@ import re
 import ast
 import concurrent.futures
 import os
+import time
 from time import sleep
-from threading import Thread
+from threading import Lock
 
-from . import ata_remote,ata_constants,snap_array_helpers,logger_defaults
+from . import ata_remote,ata_constants,snap_array_helpers,logger_defaults,ata_cache
+from . import ata_ephem, ata_ephem_service, ata_windsock
 from .ata_rest import ATARest, ATARestException
 
 
@@ -30,6 +32,27 @@ from .ata_rest import ATARest, ATARestException
 _source_offset_table = {}
 
 
+# Caches of values that change rarely, if ever. Setters in this module
+# invalidate the entries they change (see ata_cache for the hit/miss stats)
+
+ANT_POS_CACHE_TTL = 86400.0 #seconds
+SOURCE_RADEC_CACHE_TTL = 86400.0 #seconds
+SKY_FREQ_CACHE_TTL = 30.0 #seconds
+
+
+def _is_fixed_source(source):
+    """
+    True if source has a fixed J2000 position: one of the ata_positions
+    radec sources or a source of the local catalogue. Anything else
+    resolved by /source (solar system bodies, satellites, NORAD IDs,
+    comets, asteroids) may move
+    """
+    # imported here: the catalogue pulls in scipy and astropy
+    from . import ata_catalog, ata_positions
+    key = source.lower()
+    return key in ata_positions.SOURCE_RADEC or \
+            key in ata_catalog.get_catalog(required=False)
+
 #use discouraged. Use more specific functions instead
 def get_ascii_status():
     """
@@ -141,21 +164,35 @@ def get_ant_pos(ant_list):
     """
     get the NEU position of the antenna w.r.t telescope center
     returns dictionary with 1x3 list e.g. {'1a':[-74.7315    65.9487    0.5466]}
+
+    positions are cached (on disk) for ANT_POS_CACHE_TTL seconds,
+    only the antennas missing from the cache are requested
     """
     logger = logger_defaults.getModuleLogger(__name__)
-    antstr = snap_array_helpers.input_to_string(ant_list) 
-
-    try:
-        endpoint = '/antennas/{:s}/locations'.format(antstr)
-        ant_locs = ATARest.get(endpoint)
-    except Exception as e:
-        logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
-        raise
+    cache = ata_cache.get_cache('ant_pos', ANT_POS_CACHE_TTL, persist=True)
 
     retval = {}
+    missing = []
     for antname in ant_list:
-        loc = ant_locs[antname]
-        retval[antname] = [loc['N'], loc['E'], loc['U']]
+        loc = cache.get(antname)
+        if loc is None:
+            missing.append(antname)
+        else:
+            retval[antname] = list(loc)
+
+    if missing:
+        antstr = snap_array_helpers.input_to_string(missing)
+        try:
+            endpoint = '/antennas/{:s}/locations'.format(antstr)
+            ant_locs = ATARest.get(endpoint)
+        except Exception as e:
+            logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
+            raise
+
+        for antname in missing:
+            loc = ant_locs[antname]
+            retval[antname] = [loc['N'], loc['E'], loc['U']]
+            cache.set(antname, tuple(retval[antname]))
 
     return retval
 
@@ -163,19 +200,31 @@ def get_source_ra_dec(source, deg=True):
     """
     Get the J2000 RA / DEC of `source`. Return in decimal degrees (DEC) and hours (RA)
     by default, unless `deg`=False, in which case return in sexagesimal.
+
+    positions of fixed sources (see _is_fixed_source) are cached
+    (on disk) for SOURCE_RADEC_CACHE_TTL seconds
     """
 
     logger = logger_defaults.getModuleLogger(__name__)
+    cache = ata_cache.get_cache('source_radec', SOURCE_RADEC_CACHE_TTL, persist=True)
 
-    try:
-        endpoint = '/source'
-        source_data = ATARest.get(endpoint, json={'source': source})
-    except Exception as e:
-        logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
-        raise
+    radec = None
+    fixed = _is_fixed_source(source)
+    if fixed:
+        radec = cache.get(source)
+
+    if radec is None:
+        try:
+            endpoint = '/source'
+            source_data = ATARest.get(endpoint, json={'source': source})
+        except Exception as e:
+            logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
+            raise
+        radec = (source_data['ra'], source_data['dec'])
+        if fixed:
+            cache.set(source, radec)
 
-    ra = source_data['ra']
-    dec = source_data['dec']
+    ra, dec = radec
 
     if deg:
         return ra, dec
@@ -205,6 +254,10 @@ def get_ra_dec(ant_list):
         logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
         raise
 
+    return _parse_ra_dec(ant_list, antpos)
+
+def _parse_ra_dec(ant_list, antpos):
+    logger = logger_defaults.getModuleLogger(__name__)
     retdict = {}
     for ant in ant_list:
         pos = antpos[ant]
@@ -233,6 +286,10 @@ def get_az_el(ant_list):
         logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
         raise
 
+    return _parse_az_el(ant_list, antpos)
+
+def _parse_az_el(ant_list, antpos):
+    logger = logger_defaults.getModuleLogger(__name__)
     retdict = {}
     for ant in ant_list:
         pos = antpos[ant]
@@ -279,6 +336,10 @@ def get_eph_source(antlist):
         logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
         raise
 
+    return _parse_eph_source(antlist, sources)
+
+def _parse_eph_source(antlist, sources):
+    logger = logger_defaults.getModuleLogger(__name__)
     retdict = {}
     for ant in antlist:
         pos = sources[ant]
@@ -342,8 +403,7 @@ def generate_ephemeris(**kwargs):
             raise Exception('generate_ephemeris() takes exactly one source type: ' + ephem_sources)
 
         _set_ephemeris_defaults(kwargs)
-        result = ATARest.post(endpoint, json=kwargs)
-        return result['id']
+        return ata_ephem_service.get_service().get_id(kwargs)
 
     except Exception as e:
         logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
@@ -356,13 +416,23 @@ def retrieve_ephemeris(ephemeris_id):
     :param ephemeris_id: ephemeris ID as returned by generate_ephemeris()
     :return: list of points, where each point is a list:
         [TAI_ns, az, el, inverse_range]
+        (see retrieve_ephemeris_points for a numpy array)
+    """
+    return ata_ephem.ephem_to_list(retrieve_ephemeris_points(ephemeris_id))
+
+def retrieve_ephemeris_points(ephemeris_id):
+    """
+    Retrieve specified ephemeris from the server
+
+    :param ephemeris_id: ephemeris ID as returned by generate_ephemeris()
+    :return: read-only numpy structured array of ata_ephem.EPHEM_DTYPE
+        (columns 'tai_ns', 'az', 'el', 'invr')
     """
     logger = logger_defaults.getModuleLogger(__name__)
 
     try:
         endpoint = '/ephemeris'
-        ephem_file = ATARest.get(endpoint, json={'id': ephemeris_id})
-        return ephem_file
+        return ata_ephem_service.get_service().get_points(ephem_id=ephemeris_id)
     except Exception as e:
         logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
         raise
@@ -500,11 +570,10 @@ def make_and_track_source(source, antstr, **ephem_kwargs):
         endpoint = '/ephemeris'
         ephem_kwargs['source'] = source
         _set_ephemeris_defaults(ephem_kwargs)
-        retval = ATARest.post(endpoint, json=ephem_kwargs)
+        ephem_id = ata_ephem_service.get_service().get_id(ephem_kwargs)
 
         antstr = snap_array_helpers.input_to_string(antstr)
         logger.info("Tracking source {:s} with {:s}".format(source, antstr))
-        ephem_id = retval['id']
         endpoint = '/antennas/{:s}/track'.format(antstr)
         ATARest.put(endpoint, json={'id': ephem_id, 'wait': True})
     except Exception as e:
@@ -528,10 +597,9 @@ def make_and_track_tle(tle_filename, antstr, **ephem_kwargs):
         endpoint = '/ephemeris'
         ephem_kwargs['tle'] = data
         _set_ephemeris_defaults(ephem_kwargs)
-        retval = ATARest.post(endpoint, json=ephem_kwargs)
+        ephem_id = ata_ephem_service.get_service().get_id(ephem_kwargs)
 
         antstr = snap_array_helpers.input_to_string(antstr)
-        ephem_id = retval['id']
         logger.info("Tracking source {:s} with {:s}".format(ephem_id, antstr))
         endpoint = '/antennas/{:s}/track'.format(antstr)
         ATARest.put(endpoint, json={'id': ephem_id, 'wait': True})
@@ -554,9 +622,8 @@ def make_and_track_ra_dec(ra, dec, antstr, **ephem_kwargs):
         endpoint = '/ephemeris'
         ephem_kwargs['radec'] = [float(ra), float(dec)]
         _set_ephemeris_defaults(ephem_kwargs)
-        retval = ATARest.post(endpoint, json=ephem_kwargs)
+        ephem_id = ata_ephem_service.get_service().get_id(ephem_kwargs)
 
-        ephem_id = retval['id']
         endpoint = '/antennas/{:s}/track'.format(antstr)
         ATARest.put(endpoint, json={'id': ephem_id, 'wait': True})
     except Exception as e:
@@ -603,14 +670,31 @@ def autotune(ants, power_level=-10.0, **kwargs):
 
     #raise RuntimeError("Autotune execution error")
 
-def set_pams(antdict):
+SET_PAMS_MAX_WORKERS = 8
+
+def set_pams(antdict, max_workers=SET_PAMS_MAX_WORKERS, rate_limit=None):
     """
     set PAM attenuator values for given antennas
 
     the input value is a dictionary of the form:
     {'1ax': 28.0, '1ay': 28.0, '1fx': 17.0, '1fy': 15.5}
+
+    the antennas are set in parallel (see set_pams_bulk). All antennas are
+    tried, and a RuntimeError listing the failed ones is raised at the end
     """
     logger = logger_defaults.getModuleLogger(__name__)
+    results = set_pams_bulk(antdict, max_workers, rate_limit)
+
+    failed = {ant: res['error'] for ant, res in results.items() if not res['ok']}
+    if failed:
+        logger.error("set_pams got error: {}".format(failed))
+        raise RuntimeError("set_pams failed for antennas: {}".format(failed))
+
+def _pams_by_antenna(antdict):
+    """
+    convert {'1ax': 28.0, '1ay': 28.0} to the per-antenna
+    /antenna/{ant}/pams request body {'1a': {'x': {...}, 'y': {...}}}
+    """
     antpols = list(antdict.keys())
     for antpol in antpols:
         if not (antpol.endswith("x") or antpol.endswith("y")):
@@ -623,21 +707,81 @@ def set_pams(antdict):
     # very pythonic way to get unique antennas
     ants = list(set(ants_tmp))
 
-    # this is being done sequentially, not the best
-    # but the /antennas/1a,1f,3c/pams endpoint does not
-    # seem to work
+    retdict = {}
     for ant in ants:
         json = {}
         if ant+"x" in antdict.keys():
             json["x"] = {'x': True, 'value': antdict[ant+"x"]}
         if ant+"y" in antdict.keys():
             json["y"] = {'y': True, 'value': antdict[ant+"y"]}
+        retdict[ant] = json
+    return retdict
+
+class _RateLimiter:
+    """
+    Spaces out calls to at most `rate` per second across threads
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = time.monotonic()
+        self._lock = Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            sleep(start - now)
+
+def set_pams_bulk(antdict, max_workers=SET_PAMS_MAX_WORKERS, rate_limit=None):
+    """
+    set PAM attenuator values for given antennas, in parallel
+
+    the input value is a dictionary of the form:
+    {'1ax': 28.0, '1ay': 28.0, '1fx': 17.0, '1fy': 15.5}
+
+    :param max_workers: maximum number of simultaneous requests
+    :param rate_limit: maximum number of requests per second sent to the
+        REST gateway (default: no limit)
+    :returns dictionary with a result per antenna, e.g.
+        {'1a': {'ok': True, 'error': None, 'time': 0.42},
+         '1f': {'ok': False, 'error': 'timed out', 'time': 5.0}}
+        where time is the duration of the request in seconds
 
+    Errors are not raised, check the 'ok' flag of each antenna
+    """
+    logger = logger_defaults.getModuleLogger(__name__)
+
+    # the /antennas/1a,1f,3c/pams endpoint does not seem to work,
+    # so there is one request per antenna
+    pam_requests = _pams_by_antenna(antdict)
+    if not pam_requests:
+        return {}
+    limiter = _RateLimiter(rate_limit)
+
+    def set_ant_pams(ant, json):
+        limiter.wait()
+        t_start = time.time()
         try:
-            ret = ATARest.put("/antenna/%s/pams" %ant, json=json)
+            ATARest.put("/antenna/%s/pams" %ant, json=json)
+            return {'ok': True, 'error': None, 'time': time.time() - t_start}
         except Exception as e:
-            logger.error("set_pams got error: {}".format(str(e)))
-            raise
+            logger.error("set_pams for {} got error: {}".format(ant, str(e)))
+            return {'ok': False, 'error': str(e), 'time': time.time() - t_start}
+
+    tcount = max(1, min(max_workers, len(pam_requests)))
+    logger.info("setting pams of {} antennas with {} workers".format(
+        len(pam_requests), tcount))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=tcount) as executor:
+        tlist = {ant: executor.submit(set_ant_pams, ant, json)
+                for ant, json in pam_requests.items()}
+        retdict = {ant: t.result() for ant, t in tlist.items()}
+
+    return retdict
 
 def get_pams(antlist):
     """
@@ -646,10 +790,6 @@ def get_pams(antlist):
     the return value is a dictionary:
     e.g. {'ant1ax':12.5,'ant1ay':20,'ant2ax':11,'ant2ay':13}
     """
-
-    def sum_front_back(pams):
-        return pams['front'] + pams['back']
-
     logger = logger_defaults.getModuleLogger(__name__)
     antstr = snap_array_helpers.input_to_string(antlist) 
     logger.info("getting pams: {}".format(antstr))
@@ -659,7 +799,15 @@ def get_pams(antlist):
     except Exception as e:
         logger.error("get_pams got error: {}".format(str(e)))
         raise
-    
+
+    return _parse_pams(antlist, pams)
+
+def _parse_pams(antlist, pams):
+
+    def sum_front_back(pams):
+        return pams['front'] + pams['back']
+
+    logger = logger_defaults.getModuleLogger(__name__)
     retdict = {}
     for ant in antlist:
         pams_for_ant = pams[ant]
@@ -692,6 +840,10 @@ def get_dets(antlist):
         logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
         raise
 
+    return _parse_dets(antlist, dets)
+
+def _parse_dets(antlist, dets):
+    logger = logger_defaults.getModuleLogger(__name__)
     retdict = {}
     for ant in antlist:
         dets_for_ant = dets[ant]
@@ -773,13 +925,22 @@ def try_on_lnas(ant_list):
         for t in tlist:
             retval = t.result()
 
-def get_sky_freq(lo='a'):
+def get_sky_freq(lo='a', use_cache=False):
     """
     Return the sky frequency (in MHz) currently
     tuned to the center of the ATA band
+
+    By default the control system is always asked. With use_cache=True
+    a value up to SKY_FREQ_CACHE_TTL seconds old can be returned
+    instead: set_freq invalidates it, but only in this process, so
+    only use it when no other process retunes the LO
     """
     lo = lo.lower()
-    return ATARest.get('/lo1/skyfreq/' + lo)[lo]
+    cache = ata_cache.get_cache('sky_freq', SKY_FREQ_CACHE_TTL)
+    if not use_cache:
+        cache.invalidate(lo)
+    return cache.get_or_fetch(lo,
+            lambda: ATARest.get('/lo1/skyfreq/' + lo)[lo])
 
 def set_freq_focus(freq, ants, calibrate=False):
     """
@@ -827,7 +988,10 @@ def get_freq_focus(ant_list):
     except Exception as e:
         logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
         raise
-        
+
+    return _parse_freq_focus(focus_data)
+
+def _parse_freq_focus(focus_data):
     retdict = {}
     for ant, focus in focus_data.items():
         # Return only short names like '1a'
@@ -854,6 +1018,10 @@ def set_freq(freq, antlist, lo='a', nofocus=False):
     except Exception as e:
         logger.error(str(e))
         raise
+    finally:
+        # after the PUT, so a concurrent get_sky_freq can't cache the
+        # old value; also if it failed, the LO may have been changed
+        ata_cache.invalidate('sky_freq', lo)
 
     # Set ant focus
     if not nofocus:
@@ -897,6 +1065,201 @@ def get_freq(ant_list, lo='a'):
 
     return retdict
 
+#####
+#
+# Antenna state snapshot: all the antenna status reads
+# needed e.g. to build a recording header, issued concurrently
+#
+#####
+
+SNAPSHOT_FIELDS = ('azel', 'radec', 'source', 'pams', 'dets', 'focus', 'skyfreq')
+SNAPSHOT_MAX_WORKERS = 16
+
+class AntennaSnapshot:
+    """
+    State of a single antenna, as returned by get_antenna_snapshot()
+
+    Attributes
+    ----------
+    ant : str
+        antenna name, e.g. '1a'
+    timestamp : float
+        unix time (midpoint of the REST calls) the state was read at
+    az, el : float
+        Az-El pointing in decimal degrees
+    ra, dec : float
+        Ra (decimal hours) and Dec (decimal degrees) pointing
+    source : str
+        name of the tracked ephemeris
+    pams : dict
+        PAM attenuator values, e.g. {'x': 12.5, 'y': 20.0}
+    dets : dict
+        PAM detector values, e.g. {'x': 0.23, 'y': 0.2}
+    focus : float
+        feed focus frequency in MHz
+    skyfreq : dict
+        sky frequency in MHz of the requested LOs, e.g. {'b': 1400.0}
+    errors : dict
+        error message for every field that could not be read for this
+        antenna, e.g. {'pams': 'non-operational ant'}. Fields that
+        were not read are left as None
+    """
+
+    __slots__ = ('ant', 'timestamp', 'az', 'el', 'ra', 'dec', 'source',
+            'pams', 'dets', 'focus', 'skyfreq', 'errors')
+
+    def __init__(self, ant, timestamp=None):
+        self.ant = ant
+        self.timestamp = timestamp
+        self.az = None
+        self.el = None
+        self.ra = None
+        self.dec = None
+        self.source = None
+        self.pams = None
+        self.dets = None
+        self.focus = None
+        self.skyfreq = None
+        self.errors = {}
+
+    @property
+    def ok(self):
+        """
+        True if all requested fields were read
+        """
+        return not self.errors
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __repr__(self):
+        return 'AntennaSnapshot({})'.format(', '.join(
+            '{}={!r}'.format(key, getattr(self, key)) for key in self.__slots__))
+
+
+def _snapshot_read(field, ant_list, lo=None):
+    """
+    Read one snapshot field for all antennas in ant_list.
+    returns dictionary antenna -> value (None for non-operational antennas)
+    """
+    if field == 'azel':
+        return get_az_el(ant_list)
+    elif field == 'radec':
+        return get_ra_dec(ant_list)
+    elif field == 'source':
+        return get_eph_source(ant_list)
+    elif field == 'focus':
+        focus = get_freq_focus(ant_list)
+        return {ant: focus.get(ant) for ant in ant_list}
+    elif field == 'pams' or field == 'dets':
+        antpols = get_pams(ant_list) if field == 'pams' else get_dets(ant_list)
+        retdict = {}
+        for ant in ant_list:
+            if ant + 'x' in antpols or ant + 'y' in antpols:
+                retdict[ant] = {'x': antpols.get(ant + 'x'),
+                        'y': antpols.get(ant + 'y')}
+            else:
+                retdict[ant] = None
+        return retdict
+    elif field == 'skyfreq':
+        # headers must not carry a stale tuning
+        skyfreq = get_sky_freq(lo, use_cache=False)
+        return {ant: skyfreq for ant in ant_list}
+    raise RuntimeError("unknown snapshot field {}".format(field))
+
+def _snapshot_read_safe(field, ant_list, lo=None):
+    """
+    Like _snapshot_read, but never raises.
+    returns (dictionary antenna -> (value, error string or None),
+        error string of the call or None)
+    """
+    try:
+        values = _snapshot_read(field, ant_list, lo)
+        return {ant: (values[ant], None) if values.get(ant) is not None
+                else (None, 'non-operational ant') for ant in ant_list}, None
+    except Exception as e:
+        return {ant: (None, str(e)) for ant in ant_list}, str(e)
+
+def get_antenna_snapshot(antlist, fields=SNAPSHOT_FIELDS, los=None):
+    """
+    Read the state of the antennas in one go. The REST calls for all the
+    requested fields are issued concurrently, so the call takes roughly
+    one round-trip instead of one per field.
+
+    :param antlist: list of antennas, e.g. ['1a','2c'], or string '1a,2c'
+    :param fields: subset of SNAPSHOT_FIELDS to read (default: all)
+    :param los: LOs to read the sky frequency of when 'skyfreq' is
+        requested, e.g. ['b','c']. Default is all LOs (a, b, c, d)
+    :returns dictionary of AntennaSnapshot, e.g. {'1a': AntennaSnapshot(...)}
+
+    A field whose call for all the antennas fails is read again antenna
+    by antenna, the antennas concurrently (one more round-trip).
+    Errors don't raise: fields that failed are left as None and the
+    reason is kept in the errors dictionary of each affected antenna,
+    so check AntennaSnapshot.ok (or .errors) before using the values.
+    """
+    logger = logger_defaults.getModuleLogger(__name__)
+    ant_list = snap_array_helpers.input_to_list(antlist)
+
+    fields = list(fields)
+    bad_fields = set(fields) - set(SNAPSHOT_FIELDS)
+    if bad_fields:
+        raise RuntimeError("unknown snapshot fields {}, allowed are {}".format(
+            sorted(bad_fields), SNAPSHOT_FIELDS))
+
+    reads = [(field, None) for field in fields if field != 'skyfreq']
+    if 'skyfreq' in fields:
+        los = ['a', 'b', 'c', 'd'] if los is None else [lo.lower() for lo in los]
+        reads += [('skyfreq', lo) for lo in los]
+
+    logger.info("getting snapshot of {} for {}".format(fields, ant_list))
+    t_start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=SNAPSHOT_MAX_WORKERS) as executor:
+        tlist = [executor.submit(_snapshot_read_safe, field, ant_list, lo)
+                for field, lo in reads]
+        results = [t.result() for t in tlist]
+
+        # if the call for all antennas failed, retry them one by one
+        # (all of them at once), so one broken antenna does not take
+        # the field down for the rest of them
+        retries = {}
+        for i, ((field, lo), (result, error)) in enumerate(zip(reads, results)):
+            if error is None or len(ant_list) == 1 or field == 'skyfreq':
+                continue
+            logger.warning('snapshot {} for {} failed ({}), '
+                    'retrying per antenna'.format(field, ant_list, error))
+            retries[i] = [executor.submit(_snapshot_read_safe, field, [ant], lo)
+                    for ant in ant_list]
+        results = [result for result, error in results]
+        for i, tlist in retries.items():
+            results[i] = {}
+            for t in tlist:
+                results[i].update(t.result()[0])
+    timestamp = (t_start + time.time()) / 2.
+
+    snapshots = {ant: AntennaSnapshot(ant, timestamp) for ant in ant_list}
+    for (field, lo), result in zip(reads, results):
+        for ant, (value, error) in result.items():
+            snap = snapshots[ant]
+            if field == 'skyfreq':
+                if snap.skyfreq is None:
+                    snap.skyfreq = {}
+                if error:
+                    snap.errors['skyfreq_' + lo] = error
+                else:
+                    snap.skyfreq[lo] = value
+            elif error:
+                snap.errors[field] = error
+            elif field == 'azel':
+                snap.az, snap.el = value
+            elif field == 'radec':
+                snap.ra, snap.dec = value
+            else:
+                setattr(snap, field, value)
+
+    return snapshots
+
 #####
 #
 # Next couple of functions are dedicated
@@ -1064,18 +1427,18 @@ def check_windsocking():
     logger.debug('{:s}: {:s}'.format(endpoint, str(windsocking_status)))
     return windsocking_status.get('windsocking_active', False)
 
-_notifier_callback_list = []
-_notifier_windsocking_state = False
-
 def windsocking_notifier(callback_or_callback_list):
     """
     Background windsocking event notifier.
 
-    You should start only one of these in your observation application code.
     The argument may be a callback routine, or a list [] of callback routines.
     These callback routines will be called whenever there is a change in
     windsocking status.
 
+    All the notifiers of a process share one watcher thread (see
+    ata_windsock), which polls faster while windsocking and shortly after
+    a change, so it is fine to call this from several places.
+
     Callback routines should be simple functions/methods with a single boolean
     parameter "is_windsocking", where True will indicate windsocking has
     begun, and False is windsocking is ended.
@@ -1094,30 +1457,14 @@ def windsocking_notifier(callback_or_callback_list):
     # Now my app will receive windsock event callbacks....
 
     """
-    logger = logger_defaults.getModuleLogger(__name__)
-
-    global _notifier_windsocking_state
-
-    def windsocking_watcher():
-        while True:
-            try:
-                new_status = check_windsocking()
-                logger.debug('windsocking status: ' + str(new_status))
-                global _notifier_windsocking_state
-                if new_status != _notifier_windsocking_state:
-                    _notifier_windsocking_state = new_status
-                    for callback in _notifier_callback_list:
-                        callback(new_status)
-            except:
-                pass
-            sleep(15.0)
-
     if isinstance(callback_or_callback_list, list):
-        _notifier_callback_list = callback_or_callback_list.copy()
+        callbacks = callback_or_callback_list.copy()
     else:
-        _notifier_callback_list = [callback_or_callback_list]
-    _notifier_windsocking_state = check_windsocking()
-    Thread(target=windsocking_watcher, daemon=True).start()
+        callbacks = [callback_or_callback_list]
+    watcher = ata_windsock.get_watcher()
+    for callback in callbacks:
+        watcher.subscribe(callback)
+    watcher.poll_now(timeout=ata_windsock.POLL_INTERVAL_ERROR)
 
 #####
 #
@@ -1299,6 +1646,22 @@ def set_atten(antpol_list, db_list):
 
 _create_ephem_offset_source = None
 def create_ephem(source, **ephem_kwargs):
+    """
+    Generate an ephemeris of source, for track_and_offset
+
+    :return: list of points, where each point is a list:
+        [TAI_ns, az, el, inverse_range]
+        (see create_ephem_points for a numpy array)
+    """
+    return ata_ephem.ephem_to_list(create_ephem_points(source, **ephem_kwargs))
+
+def create_ephem_points(source, **ephem_kwargs):
+    """
+    Generate an ephemeris of source, for track_and_offset
+
+    :return: read-only numpy structured array of ata_ephem.EPHEM_DTYPE
+        (columns 'tai_ns', 'az', 'el', 'invr'), see ata_ephem.mean_az_el
+    """
     logger = logger_defaults.getModuleLogger(__name__)
     endpoint = '/ephemeris'
 
@@ -1309,15 +1672,14 @@ def create_ephem(source, **ephem_kwargs):
         ephem_kwargs['source'] = source
         _set_ephemeris_defaults(ephem_kwargs)
         print(ephem_kwargs)
-        retval = ATARest.post(endpoint, json=ephem_kwargs)
-        ephem_id = retval['id']
+        ephem_id = ata_ephem_service.get_service().get_id(ephem_kwargs)
     except Exception as e:
         logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
         raise
 
     endpoint = '/ephemeris'
     try:
-        ephem_file = ATARest.get(endpoint, json={'id': ephem_id})
+        ephem_file = ata_ephem_service.get_service().get_points(ephem_id=ephem_id)
     except Exception as e:
         logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
         raise
@@ -1391,8 +1753,7 @@ def create_ephems2_radec(ra,dec,az_offset,el_offset, **ephem_kwargs):
     try:
         ephem_kwargs['radec'] = [float(ra), float(dec)]
         _set_ephemeris_defaults(ephem_kwargs)
-        retval = ATARest.post(endpoint, json=ephem_kwargs)
-        ephem_id = retval['id']
+        ephem_id = ata_ephem_service.get_service().get_id(ephem_kwargs)
     except Exception as e:
         logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
         raise
@@ -1444,8 +1805,7 @@ def create_ephems2(source, az_offset, el_offset, **ephem_kwargs):
     try:
         ephem_kwargs['source'] = source
         _set_ephemeris_defaults(ephem_kwargs)
-        retval = ATARest.post(endpoint, json=ephem_kwargs)
-        ephem_id = retval['id']
+        ephem_id = ata_ephem_service.get_service().get_id(ephem_kwargs)
     except Exception as e:
         logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
         raise
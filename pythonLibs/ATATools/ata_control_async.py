@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+
+"""
+asyncio counterparts of the ata_control read functions.
+
+The functions take the same arguments and return the same values as
+their ata_control namesakes, but they are coroutines, so many status
+reads can be issued at once, e.g.:
+
+    import asyncio
+    from ATATools import ata_control_async
+
+    async def read_status(ant_list):
+        return await asyncio.gather(
+                ata_control_async.get_az_el(ant_list),
+                ata_control_async.get_pams(ant_list),
+                ata_control_async.get_sky_freq('b'))
+
+    azel, pams, skyfreq = asyncio.run(read_status(['1a', '1c']))
+"""
+
+from . import ata_control, snap_array_helpers, logger_defaults, ata_cache
+from .ata_rest import AsyncATARest
+
+
+async def get_ra_dec(ant_list):
+    """
+    get the Ra-Dec pointings of each antenna, see ata_control.get_ra_dec
+    """
+    logger = logger_defaults.getModuleLogger(__name__)
+    antstr = snap_array_helpers.input_to_string(ant_list)
+
+    try:
+        endpoint = '/antennas/{:s}/radec'.format(antstr)
+        antpos = await AsyncATARest.get(endpoint)
+    except Exception as e:
+        logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
+        raise
+
+    return ata_control._parse_ra_dec(ant_list, antpos)
+
+async def get_az_el(ant_list):
+    """
+    get the Az-El pointings of each antenna, see ata_control.get_az_el
+    """
+    logger = logger_defaults.getModuleLogger(__name__)
+    antstr = snap_array_helpers.input_to_string(ant_list)
+
+    try:
+        endpoint = '/antennas/{:s}/azel'.format(antstr)
+        antpos = await AsyncATARest.get(endpoint)
+    except Exception as e:
+        logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
+        raise
+
+    return ata_control._parse_az_el(ant_list, antpos)
+
+async def get_eph_source(antlist):
+    """
+    get the ephemeris file name of where the antennas are pointing,
+    see ata_control.get_eph_source
+    """
+    logger = logger_defaults.getModuleLogger(__name__)
+    antstr = snap_array_helpers.input_to_string(antlist)
+    logger.info("getting sources: {}".format(antstr))
+
+    try:
+        endpoint = '/antennas/{:s}/sources'.format(antstr)
+        sources = await AsyncATARest.get(endpoint)
+    except Exception as e:
+        logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
+        raise
+
+    return ata_control._parse_eph_source(antlist, sources)
+
+async def get_pams(antlist):
+    """
+    get PAM attenuator values for given antennas, see ata_control.get_pams
+    """
+    logger = logger_defaults.getModuleLogger(__name__)
+    antstr = snap_array_helpers.input_to_string(antlist)
+    logger.info("getting pams: {}".format(antstr))
+
+    try:
+        pams = await AsyncATARest.get('/antennas/{:s}/pams'.format(antstr))
+    except Exception as e:
+        logger.error("get_pams got error: {}".format(str(e)))
+        raise
+
+    return ata_control._parse_pams(antlist, pams)
+
+async def get_dets(antlist):
+    """
+    get PAM detector values for given antennas, see ata_control.get_dets
+    """
+    logger = logger_defaults.getModuleLogger(__name__)
+    antstr = snap_array_helpers.input_to_string(antlist)
+    logger.info("getting dets: {}".format(antstr))
+
+    try:
+        endpoint = '/antennas/{:s}/det'.format(antstr)
+        dets = await AsyncATARest.get(endpoint)
+    except Exception as e:
+        logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
+        raise
+
+    return ata_control._parse_dets(antlist, dets)
+
+async def get_sky_freq(lo='a', use_cache=False):
+    """
+    Return the sky frequency (in MHz) currently
+    tuned to the center of the ATA band, see ata_control.get_sky_freq
+    (same cache)
+    """
+    lo = lo.lower()
+    cache = ata_cache.get_cache('sky_freq', ata_control.SKY_FREQ_CACHE_TTL)
+    if use_cache:
+        skyfreq = cache.get(lo)
+        if skyfreq is not None:
+            return skyfreq
+    skyfreq = await AsyncATARest.get('/lo1/skyfreq/' + lo)
+    cache.set(lo, skyfreq[lo])
+    return skyfreq[lo]
+
+async def get_freq_focus(ant_list):
+    """
+    get the antenna frequency focus (feed position),
+    see ata_control.get_freq_focus
+    """
+    logger = logger_defaults.getModuleLogger(__name__)
+    antstr = snap_array_helpers.input_to_string(ant_list)
+
+    endpoint = '/antennas/{:s}/focus'.format(antstr)
+    try:
+        focus_data = await AsyncATARest.get(endpoint)
+    except Exception as e:
+        logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
+        raise
+
+    return ata_control._parse_freq_focus(focus_data)
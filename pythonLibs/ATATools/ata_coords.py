@@ -4,16 +4,238 @@ from astropy import units as u
 from astropy.coordinates import Angle
 
 from . import ata_control, logger_defaults
+import concurrent.futures
+import json
+import numpy as np
 import threading
 import time
 
 
 _COORD_TYPES = ["azel", "radec"]
 _CADENCE = 0.5 #seconds
+
+# binary ring buffer (see CoordRingBuffer)
+RING_MAGIC = b"ATACOORD"
+RING_VERSION = 1
+RING_HEADER_SIZE = 4096 #bytes, the records start after the header
+RING_DURATION = 43200.0 #seconds of positions kept by default
+RING_FLUSH_INTERVAL = 5.0 #seconds between flushes to disk
+RING_COORDS = ["az", "el", "ra", "dec"]
+# antennas per REST request of a fetch burst
+FETCH_CHUNK = 16
+FETCH_WORKERS = 8
+
+_RING_HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u4'),
+    ('nants', '<u4'), ('capacity', '<u8'), ('count', '<u8')])
+
+
+def _ring_record_dtype(nants):
+    return np.dtype([('time', '<f8')] +
+            [(coord, '<f8', (nants,)) for coord in RING_COORDS])
+
+
+class CoordRingBuffer:
+    """
+    Preallocated, memory-mapped ring buffer of antenna positions
+
+    The file holds a header (antennas, capacity, number of records
+    written) followed by capacity records of: unix time, and the az,
+    el (degrees), ra (hours) and dec (degrees) of every antenna, NaN
+    for non-operational antennas. When full, the oldest records are
+    overwritten. The file can be read while it is being written:
+
+        buf = CoordRingBuffer.open("/mnt/buf0/obs/coords.ring")
+        pos = buf.slice(t_start, t_end)
+        az_1c = buf.interpolate(recording_times, "az", "1c")
+    """
+
+    def __init__(self, filename, mm):
+        self.filename = filename
+        self._mm = mm
+        self._header = np.ndarray((), _RING_HEADER_DTYPE, mm, 0)
+        nants = int(self._header['nants'])
+        names = bytes(mm[_RING_HEADER_DTYPE.itemsize:RING_HEADER_SIZE]).rstrip(b"\0")
+        self.antList = json.loads(names.decode()) if names else []
+        if len(self.antList) != nants:
+            raise RuntimeError("%s: corrupted header" %filename)
+        self.capacity = int(self._header['capacity'])
+        self._records = np.ndarray((self.capacity,), _ring_record_dtype(nants),
+                mm, RING_HEADER_SIZE)
+        self._ant_index = {ant: i for i, ant in enumerate(self.antList)}
+
+    @classmethod
+    def create(cls, filename, antList, capacity):
+        """
+        Create (or overwrite) a ring buffer file for antList, holding
+        capacity records
+        """
+        names = json.dumps(list(antList)).encode()
+        if len(names) > RING_HEADER_SIZE - _RING_HEADER_DTYPE.itemsize:
+            raise RuntimeError("too many antennas for the ring buffer header")
+        record_dtype = _ring_record_dtype(len(antList))
+        size = RING_HEADER_SIZE + int(capacity) * record_dtype.itemsize
+        # the file is sparse until the records are written
+        with open(filename, "wb") as f:
+            f.truncate(size)
+        mm = np.memmap(filename, dtype=np.uint8, mode="r+", shape=(size,))
+        header = np.ndarray((), _RING_HEADER_DTYPE, mm, 0)
+        header['magic'] = RING_MAGIC
+        header['version'] = RING_VERSION
+        header['nants'] = len(antList)
+        header['capacity'] = capacity
+        header['count'] = 0
+        mm[_RING_HEADER_DTYPE.itemsize:_RING_HEADER_DTYPE.itemsize + len(names)] = \
+                np.frombuffer(names, dtype=np.uint8)
+        mm.flush()
+        return cls(filename, mm)
+
+    @classmethod
+    def open(cls, filename, mode="r"):
+        """
+        Open an existing ring buffer file, read-only by default
+        """
+        mm = np.memmap(filename, dtype=np.uint8, mode=mode)
+        header = np.ndarray((), _RING_HEADER_DTYPE, mm, 0)
+        if bytes(header['magic']) != RING_MAGIC:
+            raise RuntimeError("%s is not a coordinate ring buffer" %filename)
+        if int(header['version']) != RING_VERSION:
+            raise RuntimeError("%s: unsupported ring buffer version %d"
+                    %(filename, int(header['version'])))
+        return cls(filename, mm)
+
+    @property
+    def count(self):
+        """
+        Number of records written since the creation of the file
+        """
+        return int(self._header['count'])
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, time_unix, az, el, ra, dec):
+        """
+        Write one record, the coordinates are arrays in antList order
+        """
+        count = self.count
+        record = self._records[count % self.capacity]
+        record['time'] = time_unix
+        record['az'] = az
+        record['el'] = el
+        record['ra'] = ra
+        record['dec'] = dec
+        # the record is complete before it is counted, for the readers
+        self._header['count'] = count + 1
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        if self._mm is not None:
+            if self._mm.mode != "r":
+                self._mm.flush()
+            self._mm = None
+            self._records = None
+            self._header = None
+
+    def _segments(self):
+        """
+        Views of the written records, oldest first: the ring is at most
+        two contiguous, time ordered, segments
+        """
+        count = self.count
+        if count <= self.capacity:
+            return [self._records[:count]]
+        start = count % self.capacity
+        return [self._records[start:], self._records[:start]]
+
+    def records(self):
+        """
+        Copy of the records in the buffer, in time order
+        """
+        return np.concatenate(self._segments())
+
+    def slice(self, t_start=None, t_end=None):
+        """
+        Records with t_start <= time <= t_end (unix seconds, None for
+        no limit), in time order. Only the matching records are read
+
+        :returns numpy structured array with the fields 'time', and
+            'az', 'el', 'ra', 'dec' of shape (len(antList),)
+        """
+        parts = []
+        for segment in self._segments():
+            times = segment['time']
+            i1 = 0 if t_start is None else np.searchsorted(times, t_start, side="left")
+            i2 = len(times) if t_end is None else np.searchsorted(times, t_end, side="right")
+            parts.append(segment[i1:i2])
+        return np.concatenate(parts)
+
+    def interpolate(self, times, coord, ant=None):
+        """
+        coord ('az', 'el', 'ra' or 'dec') linearly interpolated at the unix
+        times, for ant or for all the antennas (array of shape
+        (len(times), len(antList))). NaN outside of the buffer.
+        Azimuths and right ascensions are interpolated the short way around
+        """
+        if coord not in RING_COORDS:
+            raise RuntimeError("coord provided (%s) is not included in %s"
+                    %(coord, RING_COORDS))
+        times = np.asarray(times, dtype=np.float64)
+        count = self.count
+        n = min(count, self.capacity)
+        if n == 0:
+            shape = times.shape if ant else times.shape + (len(self.antList),)
+            return np.full(shape, np.nan)
+        # time order index k is in the slot (first + k) % capacity
+        first = count - n
+        t = np.concatenate([segment['time'] for segment in self._segments()])
+
+        i1 = np.clip(np.searchsorted(t, times, side="right"), 1, max(n - 1, 1))
+        i0 = i1 - 1
+        if n == 1:
+            i0 = i1 = np.zeros_like(i1)
+        dt = t[i1] - t[i0]
+        frac = np.where(dt > 0, (times - t[i0]) / np.where(dt > 0, dt, 1.), 0.)
+
+        values = self._records[coord]
+        if ant is not None:
+            values = values[:, self._ant_index[ant]]
+        else:
+            frac = frac[..., None]
+        v0 = values[(first + i0) % self.capacity]
+        dv = values[(first + i1) % self.capacity] - v0
+        period = {"az": 360., "ra": 24.}.get(coord)
+        if period:
+            dv = (dv + period / 2.) % period - period / 2.
+        out = v0 + frac * dv
+        if period:
+            out = out % period
+        outside = (times < t[0]) | (times > t[-1])
+        out[outside] = np.nan
+        return out
+
+
+def read_coord_dump(filename):
+    """
+    Records of a CoordDumpThread ring buffer file, in time order
+    (see CoordRingBuffer.slice)
+    """
+    buf = CoordRingBuffer.open(filename)
+    try:
+        return buf.records()
+    finally:
+        buf.close()
+
+
 class CoordDumpThread(threading.Thread):
     """
     A thread-based class used to dump coordinates (azel or radec) at high cadence to file
 
+    The positions are requested on a monotonic clock schedule, so the
+    cadence doesn't drift with the latency of the control system
+    (ticks are skipped if a request takes longer than the cadence)
+
     ...
 
     Attributes
@@ -24,8 +246,17 @@ class CoordDumpThread(threading.Thread):
         name of output file
     coordType : str
         allowed values: 'azel' (default) and 'radec'
+        (ignored for binary output, which has both)
     cadence : float
         update rate in seconds (default = 0.5) 
+    binary : bool
+        write az, el, ra and dec of all the antennas to a
+        memory-mapped ring buffer (see CoordRingBuffer) instead of
+        text lines. The positions are fetched concurrently, in one
+        burst per tick
+    duration : float
+        binary output only, seconds of positions kept in the ring
+        buffer (default = RING_DURATION)
 
     Methods
     -------
@@ -35,7 +266,8 @@ class CoordDumpThread(threading.Thread):
         stops thread
     """
 
-    def __init__(self, antList, outFileName, coordType="azel", cadence=None):
+    def __init__(self, antList, outFileName, coordType="azel", cadence=None,
+            binary=False, duration=RING_DURATION):
         logger = logger_defaults.getModuleLogger(__name__)
 
         # make thread a daemon in case main wants to exit
@@ -50,44 +282,52 @@ class CoordDumpThread(threading.Thread):
         # antList must be a list
         assert type(antList) == list, "antList argument must be a list"
 
-        # Open output file
-        self.OutFile = open(outFileName, "w")
+        self.antList = antList
+        self.binary = binary
 
-        # set the data pulling function
-        # and populate the header in the output file
-        if coordType == "azel":
-            self._pull_func = ata_control.get_az_el
-            _ant_header = ["%s_%s" %(ant, coord) for ant in antList
-                for coord in ["az", "el"]]
-            _ant_header_str = " ".join(_ant_header)
-            header_str = "# Time_unix " + _ant_header_str + "\n"
+        # cadence in seconds
+        self.cadence = cadence if cadence else _CADENCE
 
-        elif coordType == "radec":
-            self._pull_func = ata_control.get_ra_dec
-            _ant_header = ["%s_%s" %(ant, coord) for ant in antList
-                for coord in ["ra", "dec"]]
-            _ant_header_str = " ".join(_ant_header)
-            header_str = "# Time_unix " + _ant_header_str + "\n"
+        if binary:
+            capacity = max(int(np.ceil(duration / self.cadence)), 1)
+            self.ring = CoordRingBuffer.create(outFileName, antList, capacity)
+            self.OutFile = None
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=FETCH_WORKERS, thread_name_prefix="coord_dump")
+        else:
+            # Open output file
+            self.OutFile = open(outFileName, "w")
 
-        # Write header
-        self.OutFile.write(header_str)
+            # set the data pulling function
+            # and populate the header in the output file
+            if coordType == "azel":
+                self._pull_func = ata_control.get_az_el
+                _ant_header = ["%s_%s" %(ant, coord) for ant in antList
+                    for coord in ["az", "el"]]
+                _ant_header_str = " ".join(_ant_header)
+                header_str = "# Time_unix " + _ant_header_str + "\n"
 
-        self.antList = antList
+            elif coordType == "radec":
+                self._pull_func = ata_control.get_ra_dec
+                _ant_header = ["%s_%s" %(ant, coord) for ant in antList
+                    for coord in ["ra", "dec"]]
+                _ant_header_str = " ".join(_ant_header)
+                header_str = "# Time_unix " + _ant_header_str + "\n"
 
-        # a thread-stopping mechanism
-        self._stop = threading.Event()
+            # Write header
+            self.OutFile.write(header_str)
 
-        # cadence in seconds
-        if not cadence:
-            self.cadence = _CADENCE
+        # a thread-stopping mechanism
+        # (not self._stop, which is a method of threading.Thread)
+        self._stop_event = threading.Event()
 
     def stop(self):
         logger = logger_defaults.getModuleLogger(__name__)
         logger.info("Stopping")
-        self._stop.set()
+        self._stop_event.set()
 
     def _is_terminated(self):
-        return self._stop.isSet()
+        return self._stop_event.is_set()
 
     def _to_string(self, time_now, coords):
         all_str = "%.6f" %time_now
@@ -97,20 +337,78 @@ class CoordDumpThread(threading.Thread):
         all_str += "\n"
         return all_str
 
-    def run(self):
+    def _fetch_burst(self):
+        """
+        az, el, ra, dec arrays of all the antennas (NaN if not available),
+        fetched concurrently
+        """
         logger = logger_defaults.getModuleLogger(__name__)
-        logger.info("Starting coord dump thread")
-        while not self._is_terminated():
+        nants = len(self.antList)
+        values = {coord: np.full(nants, np.nan) for coord in RING_COORDS}
+        futures = {}
+        for i in range(0, nants, FETCH_CHUNK):
+            chunk = self.antList[i:i + FETCH_CHUNK]
+            futures[self._executor.submit(ata_control.get_az_el, chunk)] = \
+                    (i, ("az", "el"))
+            futures[self._executor.submit(ata_control.get_ra_dec, chunk)] = \
+                    (i, ("ra", "dec"))
+        for future, (i, coords) in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.warning("could not get %s: %s" %("/".join(coords), str(e)))
+                continue
+            for j, ant in enumerate(self.antList[i:i + FETCH_CHUNK]):
+                pos = result.get(ant)
+                if pos:
+                    values[coords[0]][i + j] = pos[0]
+                    values[coords[1]][i + j] = pos[1]
+        return values
+
+    def _tick(self):
+        if self.binary:
+            t0 = time.time()
+            values = self._fetch_burst()
+            # time stamp in the middle of the requests
+            time_now = (t0 + time.time()) / 2.
+            self.ring.append(time_now, values["az"], values["el"],
+                    values["ra"], values["dec"])
+        else:
             time_now = time.time()
             coords = self._pull_func(self.antList)
             coords_str = self._to_string(time_now, coords)
 
             # write to output file
             self.OutFile.write(coords_str)
-            time.sleep(self.cadence)
 
-        logger.info("Received stop, run() is returning")
-        self.OutFile.close()
+    def run(self):
+        logger = logger_defaults.getModuleLogger(__name__)
+        logger.info("Starting coord dump thread")
+        next_tick = time.monotonic()
+        next_flush = next_tick + RING_FLUSH_INTERVAL
+        try:
+            while not self._is_terminated():
+                self._tick()
+
+                now = time.monotonic()
+                if self.binary and now >= next_flush:
+                    self.ring.flush()
+                    next_flush = now + RING_FLUSH_INTERVAL
+
+                # next tick on the schedule, skipping the ones already missed
+                next_tick += self.cadence
+                if next_tick < now:
+                    missed = int((now - next_tick) // self.cadence) + 1
+                    logger.debug("running late, skipping %d ticks" %missed)
+                    next_tick += missed * self.cadence
+                self._stop_event.wait(next_tick - now)
+        finally:
+            logger.info("Received stop, run() is returning")
+            if self.binary:
+                self._executor.shutdown(wait=False)
+                self.ring.close()
+            else:
+                self.OutFile.close()
 
 
 
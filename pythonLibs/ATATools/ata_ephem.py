@@ -1,10 +1,64 @@
 """
-This module implements functions to create ATA ephemeris files
+This module implements functions to create ATA ephemeris files,
+and to work with ephemerides as numpy structured arrays
+(see EPHEM_DTYPE, to_ephem_array, az_el_at and mean_az_el)
+
+Scan patterns (swivel, cross, raster, spiral, Lissajous) are made with
+generate_scan, and checked against the antenna drive limits with
+check_ephem / validate_ephem
 """
 
 import numpy as np
 
 
+# one ephemeris point: time in TAI ns, azimuth and elevation in degrees,
+# inverse range. Also the record layout of the binary transport format
+# (little endian, 32 bytes per point)
+EPHEM_DTYPE = np.dtype([('tai_ns', '<i8'), ('az', '<f8'), ('el', '<f8'),
+    ('invr', '<f8')])
+
+
+def make_ephem(tai_ns, az, el, invr=0.0):
+    """
+    Build an ephemeris
+
+    Parameters
+    ----------
+    tai_ns : numpy_array
+             times in ATA TAI ns
+    az     : float or numpy_array
+             azimuth(s) in degrees
+    el     : float or numpy_array
+             elevation(s) in degrees
+    invr   : float or numpy_array
+             inverse range of the source
+
+    Returns
+    -------
+    ephem  : numpy_array
+             array of EPHEM_DTYPE
+    """
+    tai_ns = np.asarray(tai_ns)
+    ephem = np.empty(len(tai_ns), dtype=EPHEM_DTYPE)
+    if np.issubdtype(tai_ns.dtype, np.integer):
+        ephem['tai_ns'] = tai_ns
+    else:
+        ephem['tai_ns'] = np.round(tai_ns)
+    ephem['az'] = np.mod(az, 360.)
+    ephem['el'] = el
+    ephem['invr'] = invr
+    return ephem
+
+
+def scan_times(t_start, t_span, steps):
+    """
+    steps times (int64 TAI ns) evenly spaced from t_start to
+    t_start + t_span (ATA TAI seconds)
+    """
+    t0 = int(round(t_start * 1e9))
+    return t0 + np.round(np.linspace(0., t_span * 1e9, int(steps))).astype(np.int64)
+
+
 def generate_ephem_el_swivel(az_start, el_start, el_end, t_start, t_span,  steps, invr):
     """
     Swivel along Elevation
@@ -32,32 +86,19 @@ def generate_ephem_el_swivel(az_start, el_start, el_end, t_start, t_span,  steps
     Returns
     -------
     ephem    : numpy_array
-               Returns an array with 4 columns for time in TAI ns, azimuth, elevation 
-               and inverse radius of the source
+               Returns an array of EPHEM_DTYPE, with the columns 'tai_ns',
+               'az', 'el' and 'invr'
                 
     Notes
     -----
     ATA TAI time takes leap seconds into account (37s) and therefore is 37 seconds 
     ahead of unix time.
-    Also note that this function does not do any sanity checks when it comes to 
-    antenna slewing. Users should be aware of the ATA dish slew rate and time 
-    taken to acquire sources, and should take this into account when creating
-    ephemerides.
+    Use check_ephem or validate_ephem to check the ephemeris against the
+    antenna slew rates and elevation limits.
 
     """
-    tai = np.linspace(t_start*1e9, (t_start + t_span)*1e9, steps)
-
-    tai = np.round(tai).astype('int')
-
-    el = np.linspace(el_start, el_end, steps)
-    
-    ir = np.array(steps*[invr])
-    
-    az = np.array(steps*[az_start])
-
-    ephem = ((np.array([tai, az, el, ir], dtype=object)))
-    
-    return(ephem.T)
+    return make_ephem(scan_times(t_start, t_span, steps), az_start,
+            np.linspace(el_start, el_end, int(steps)), invr)
 
 
 
@@ -88,35 +129,226 @@ def generate_ephem_az_swivel(az_start, az_end, el_start, t_start, t_span,  steps
     Returns
     -------
     ephem    : numpy_array
-               Returns an array with 4 columns for time in TAI ns, azimuth, elevation 
-               and inverse radius of the source
+               Returns an array of EPHEM_DTYPE, with the columns 'tai_ns',
+               'az', 'el' and 'invr'
                 
     Notes
     -----
     ATA TAI time takes leap seconds into account (37s) and therefore is 37 seconds 
     ahead of unix time.
-    Also note that this function does not do any sanity checks when it comes to 
-    antenna slewing. Users should be aware of the ATA dish slew rate and time 
-    taken to acquire sources, and should take this into account when creating
-    ephemerides.
+    Use check_ephem or validate_ephem to check the ephemeris against the
+    antenna slew rates and elevation limits.
     
     """
-    tai = np.linspace(t_start*1e9, (t_start + t_span)*1e9, steps)
+    return make_ephem(scan_times(t_start, t_span, steps),
+            np.linspace(az_start, az_end, int(steps)), el_start, invr)
 
-    tai = np.round(tai).astype('int')
 
-    az = np.linspace(az_start, az_end, steps)
-    
-    ir = np.array(steps*[invr])
-    
-    el = np.array(steps*[el_start])
+def _polyline_offsets(vertices, steps):
+    """
+    steps points along the polyline through vertices, (n, 2) offsets,
+    evenly spaced along the path (constant scan speed)
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    lengths = np.hypot(*np.diff(vertices, axis=0).T)
+    path = np.concatenate(([0.], np.cumsum(lengths)))
+    s = np.linspace(0., path[-1], int(steps))
+    return np.column_stack((np.interp(s, path, vertices[:,0]),
+        np.interp(s, path, vertices[:,1])))
 
-    ephem = ((np.array([tai, az, el, ir], dtype=object)))
-    
-    return(ephem.T)
 
+def swivel_offsets(steps, size, axis='el'):
+    """
+    Straight scan of length size (degrees) through the centre,
+    along axis ('az' or 'el')
+    """
+    half = size / 2.
+    if axis == 'az':
+        return _polyline_offsets([[-half, 0.], [half, 0.]], steps)
+    if axis == 'el':
+        return _polyline_offsets([[0., -half], [0., half]], steps)
+    raise ValueError("axis must be 'az' or 'el', not {!r}".format(axis))
 
 
+def cross_offsets(steps, size):
+    """
+    Cross scan of arm length size (degrees): along elevation, then
+    along azimuth, both through the centre
+    """
+    half = size / 2.
+    return _polyline_offsets([[0., -half], [0., half], [-half, 0.], [half, 0.]],
+            steps)
+
+
+def raster_offsets(steps, size, rows, size_y=None, axis='az'):
+    """
+    Boustrophedon raster of rows lines of length size (degrees), along
+    axis ('az' or 'el'), covering size_y (default size) across
+    """
+    if rows < 1:
+        raise ValueError('a raster needs at least one row')
+    size_y = size if size_y is None else size_y
+    half, half_y = size / 2., size_y / 2.
+    across = np.linspace(-half_y, half_y, int(rows))
+    along = np.tile([[-half, half], [half, -half]], ((int(rows) + 1) // 2, 1))[:int(rows)]
+    vertices = np.column_stack((along.ravel(), np.repeat(across, 2)))
+    if axis == 'el':
+        vertices = vertices[:,::-1]
+    elif axis != 'az':
+        raise ValueError("axis must be 'az' or 'el', not {!r}".format(axis))
+    return _polyline_offsets(vertices, steps)
+
+
+def spiral_offsets(steps, size, turns=5):
+    """
+    Archimedean spiral out of the centre, to a diameter size (degrees)
+    in turns turns, at an approximately constant scan speed
+    """
+    s = np.sqrt(np.linspace(0., 1., int(steps)))
+    r = s * size / 2.
+    phi = 2. * np.pi * turns * s
+    return np.column_stack((r * np.cos(phi), r * np.sin(phi)))
+
+
+def lissajous_offsets(steps, size, size_y=None, cycles_x=3, cycles_y=2,
+        phase=np.pi / 2.):
+    """
+    On-the-fly Lissajous curve of size by size_y (default size) degrees,
+    with cycles_x and cycles_y periods over the scan
+    """
+    size_y = size if size_y is None else size_y
+    s = np.linspace(0., 1., int(steps))
+    return np.column_stack((
+        size / 2. * np.sin(2. * np.pi * cycles_x * s + phase),
+        size_y / 2. * np.sin(2. * np.pi * cycles_y * s)))
+
+
+SCAN_PATTERNS = {
+    'swivel': swivel_offsets,
+    'cross': cross_offsets,
+    'raster': raster_offsets,
+    'spiral': spiral_offsets,
+    'lissajous': lissajous_offsets,
+}
+
+
+def generate_scan(pattern, az, el, t_start, t_span, steps, invr=0.0,
+        validate=True, **kwargs):
+    """
+    Scan pattern
+
+    Creates the ephemeris of a scan pattern centred on az, el.
+    Offsets along azimuth are true angles on the sky (cross-elevation):
+    they are divided by cos(el) to get the azimuth
+
+    Parameters
+    ----------
+    pattern  : string or callable
+               one of SCAN_PATTERNS ('swivel', 'cross', 'raster', 'spiral',
+               'lissajous'), or a function(steps, **kwargs) returning the
+               (steps, 2) cross-elevation, elevation offsets in degrees
+    az       : float
+               azimuth of the centre
+    el       : float
+               elevation of the centre
+    t_start  : float
+               start time of the scan in ATA TAI seconds
+    t_span   : float
+               time span of the scan in seconds
+    steps    : int
+               Number of data points
+    invr     : float
+               Inverse radius of the source
+    validate : bool
+               check the ephemeris with validate_ephem
+    kwargs   : parameters of the pattern, e.g. size=2., rows=10 for
+               raster_offsets
+
+    Returns
+    -------
+    ephem    : numpy_array
+               array of EPHEM_DTYPE
+
+    Raises
+    ------
+    ValueError if validate and the antennas can't follow the scan
+    """
+    if not callable(pattern):
+        try:
+            pattern = SCAN_PATTERNS[pattern]
+        except KeyError:
+            raise ValueError('unknown scan pattern {!r}, expected one of {}'.format(
+                pattern, ', '.join(SCAN_PATTERNS)))
+    offsets = pattern(int(steps), **kwargs)
+    el_scan = el + offsets[:,1]
+    az_scan = az + offsets[:,0] / np.cos(np.radians(el_scan))
+    ephem = make_ephem(scan_times(t_start, t_span, steps), az_scan, el_scan, invr)
+    if validate:
+        validate_ephem(ephem)
+    return ephem
+
+
+# antenna drive limits, used to validate the ephemerides
+MAX_AZ_RATE = 3.0 #degrees per second
+MAX_EL_RATE = 1.0 #degrees per second
+MIN_EL_LIMIT = 16.8 #degrees
+MAX_EL_LIMIT = 89.0 #degrees
+
+
+def check_ephem(ephem, max_az_rate=MAX_AZ_RATE, max_el_rate=MAX_EL_RATE,
+        min_el=MIN_EL_LIMIT, max_el=MAX_EL_LIMIT):
+    """
+    Slew rate and elevation limit check
+
+    Parameters
+    ----------
+    ephem : numpy_array
+            ephemeris, see to_ephem_array
+    max_az_rate, max_el_rate : float
+            maximum drive rates, degrees per second
+    min_el, max_el : float
+            elevation limits, degrees
+
+    Returns
+    -------
+    bad : numpy_array
+          boolean mask of the points that are outside the elevation
+          limits, not after the previous point in time, or that can't
+          be reached from the previous point at the drive rates
+    """
+    ephem = to_ephem_array(ephem)
+    bad = (ephem['el'] < min_el) | (ephem['el'] > max_el)
+    if len(ephem) > 1:
+        dt = np.diff(ephem['tai_ns']) * 1e-9
+        daz = np.abs((np.diff(ephem['az']) + 180.) % 360. - 180.)
+        del_ = np.abs(np.diff(ephem['el']))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            too_fast = ((dt <= 0) | (daz > max_az_rate * dt)
+                    | (del_ > max_el_rate * dt))
+        bad[1:] |= too_fast
+    return bad
+
+
+def validate_ephem(ephem, **limits):
+    """
+    check_ephem, raising ValueError on the first bad point
+
+    Parameters
+    ----------
+    ephem  : numpy_array
+             ephemeris, see to_ephem_array
+    limits : arguments of check_ephem
+    """
+    ephem = to_ephem_array(ephem)
+    bad = check_ephem(ephem, **limits)
+    if bad.any():
+        ibad = np.flatnonzero(bad)
+        i = ibad[0]
+        raise ValueError('{} of {} ephemeris points outside the antenna limits, '
+                'first point {} (TAI {} ns, az {:.4f}, el {:.4f})'.format(
+                    len(ibad), len(ephem), i, ephem['tai_ns'][i],
+                    ephem['az'][i], ephem['el'][i]))
+
 
 def ephem_to_txt(save_as, ephem_file):
     """
@@ -133,7 +365,220 @@ def ephem_to_txt(save_as, ephem_file):
                  the ephemeris array to be exported as a txt file
 
     """
-    ephemtxt = np.savetxt(save_as, ephem_file, fmt='%i  %.5f  %.5f  %.10E')
+    with open(save_as, 'w') as f:
+        f.write(format_ephem(ephem_file))
+
+
+def format_ephem(ephem):
+    """
+    Ephemeris as the text of an ATA ephemeris file, one
+    'TAI_ns  az  el  invr' line per point
+    """
+    ephem = to_ephem_array(ephem)
+    if len(ephem) == 0:
+        return ''
+    # a single formatting operation for the whole file, much faster
+    # than formatting point by point (np.savetxt)
+    values = np.empty((len(ephem), 4), dtype=object)
+    values[:,0] = ephem['tai_ns'].tolist()
+    values[:,1] = ephem['az'].tolist()
+    values[:,2] = ephem['el'].tolist()
+    values[:,3] = ephem['invr'].tolist()
+    return ('%i  %.5f  %.5f  %.10E\n' * len(ephem)) % tuple(values.ravel().tolist())
+
+
+def ephem_to_bin(save_as, ephem):
+    """
+    Ephemeris to binary file, packed little endian EPHEM_DTYPE records
+    (see decode_binary_ephem)
+    """
+    to_ephem_array(ephem).tofile(save_as)
+
+
+def to_ephem_array(ephem):
+    """
+    Ephemeris to structured array
+
+    Converts an ephemeris given as a list of [TAI_ns, az, el, invr]
+    points (as returned by ata_control.retrieve_ephemeris), or as a
+    (npoints, 4) array, to a structured array of EPHEM_DTYPE. Structured arrays are returned
+    as they are
+
+    Parameters
+    ----------
+    ephem : list or numpy_array
+            the ephemeris
+
+    Returns
+    -------
+    ephem : numpy_array
+            array of EPHEM_DTYPE, with the columns 'tai_ns', 'az', 'el'
+            and 'invr'
+    """
+    if isinstance(ephem, np.ndarray) and ephem.dtype == EPHEM_DTYPE:
+        return ephem
+
+    if isinstance(ephem, np.ndarray) and ephem.dtype != object:
+        points = ephem.reshape(-1, 4)
+        out = np.empty(len(points), dtype=EPHEM_DTYPE)
+        if np.issubdtype(points.dtype, np.integer):
+            out['tai_ns'] = points[:,0]
+        else:
+            out['tai_ns'] = np.round(points[:,0])
+        out['az'] = points[:,1]
+        out['el'] = points[:,2]
+        out['invr'] = points[:,3]
+        return out
+
+    # lists (and object arrays) keep the TAI exact as python ints
+    npoints = len(ephem)
+    out = np.empty(npoints, dtype=EPHEM_DTYPE)
+    out['tai_ns'] = np.fromiter((int(point[0]) for point in ephem),
+            dtype=np.int64, count=npoints)
+    for icol, col in enumerate(('az', 'el', 'invr'), 1):
+        out[col] = np.fromiter((point[icol] for point in ephem),
+                dtype=np.float64, count=npoints)
+    return out
+
+
+def decode_json_ephem(content):
+    """
+    JSON ephemeris to structured array
+
+    Fast decoder of the JSON list of [TAI_ns, az, el, invr] points sent
+    by the REST gateway, straight into an array of EPHEM_DTYPE, without
+    building the intermediate python lists
+
+    Parameters
+    ----------
+    content : bytes or str
+              the JSON document
+
+    Returns
+    -------
+    ephem : numpy_array
+            array of EPHEM_DTYPE
+    """
+    if isinstance(content, bytes):
+        content = content.decode()
+    tokens = content.replace('[', '').replace(']', '').split(',')
+    if len(tokens) == 1 and not tokens[0].strip():
+        return np.empty(0, dtype=EPHEM_DTYPE)
+    if len(tokens) % 4:
+        raise ValueError('ephemeris points must have 4 values each')
+
+    out = np.empty(len(tokens) // 4, dtype=EPHEM_DTYPE)
+    try:
+        out['tai_ns'] = np.array(tokens[0::4], dtype=np.int64)
+    except ValueError:
+        # times written as floats, e.g. 1.6e18
+        out['tai_ns'] = np.round(np.array(tokens[0::4], dtype=np.float64))
+    out['az'] = np.array(tokens[1::4], dtype=np.float64)
+    out['el'] = np.array(tokens[2::4], dtype=np.float64)
+    out['invr'] = np.array(tokens[3::4], dtype=np.float64)
+    return out
+
+
+def decode_binary_ephem(content):
+    """
+    Binary ephemeris to structured array
+
+    Parameters
+    ----------
+    content : bytes
+              packed little endian EPHEM_DTYPE records
+
+    Returns
+    -------
+    ephem : numpy_array
+            array of EPHEM_DTYPE
+    """
+    if len(content) % EPHEM_DTYPE.itemsize:
+        raise ValueError('binary ephemeris size {} is not a multiple of {}'.format(
+            len(content), EPHEM_DTYPE.itemsize))
+    return np.frombuffer(content, dtype=EPHEM_DTYPE).copy()
+
+
+def ephem_to_list(ephem):
+    """
+    Structured array to a list of [TAI_ns, az, el, invr] points,
+    the format of the REST gateway
+    """
+    return [list(point) for point in to_ephem_array(ephem).tolist()]
+
+
+def az_el_at(ephem, t):
+    """
+    Az, el at given time(s)
+
+    Linear interpolation of the ephemeris, located with a binary search
+    (the points have to be sorted in time, as they come from the server).
+    Azimuths are interpolated the short way around the circle
+
+    Parameters
+    ----------
+    ephem : numpy_array
+            ephemeris, structured array of EPHEM_DTYPE (see to_ephem_array)
+    t     : int, float or numpy_array
+            time(s) in TAI ns
+
+    Returns
+    -------
+    az, el : float or numpy_array
+             azimuth and elevation in degrees
+
+    Raises
+    ------
+    ValueError if any of the times is outside the ephemeris
+    """
+    ephem = to_ephem_array(ephem)
+    tai = ephem['tai_ns']
+    t_arr = np.asarray(t)
+    if len(tai) == 0 or np.any(t_arr < tai[0]) or np.any(t_arr > tai[-1]):
+        raise ValueError('time outside of the ephemeris')
+
+    i1 = np.clip(np.searchsorted(tai, t_arr, side='right'), 1, len(tai) - 1)
+    i0 = i1 - 1
+    if len(tai) == 1:
+        i0 = i1 = np.zeros_like(i1)
+    dt = (tai[i1] - tai[i0]).astype(np.float64)
+    frac = np.where(dt > 0, (t_arr - tai[i0]) / np.where(dt > 0, dt, 1.), 0.)
+
+    az0 = ephem['az'][i0]
+    daz = (ephem['az'][i1] - az0 + 180.) % 360. - 180.
+    az = (az0 + frac * daz) % 360.
+    el = ephem['el'][i0] + frac * (ephem['el'][i1] - ephem['el'][i0])
+    if np.ndim(t) == 0:
+        return float(az), float(el)
+    return az, el
 
-    return(ephemtxt)
 
+def mean_az_el(ephem, t1, t2):
+    """
+    Mean az, el of the ephemeris points strictly between t1 and t2
+
+    The points are located with a binary search, rather than by masking
+    the whole array
+
+    Parameters
+    ----------
+    ephem : numpy_array
+            ephemeris, structured array of EPHEM_DTYPE, or (npoints, 4) array
+    t1    : int or float
+            start time in TAI ns
+    t2    : int or float
+            end time in TAI ns
+
+    Returns
+    -------
+    az, el : float
+             mean azimuth and elevation in degrees (nan if there are
+             no points in the interval)
+    """
+    ephem = to_ephem_array(ephem)
+    tai = ephem['tai_ns']
+    i1 = np.searchsorted(tai, t1, side='right')
+    i2 = np.searchsorted(tai, t2, side='left')
+    if i2 <= i1:
+        return np.nan, np.nan
+    return float(ephem['az'][i1:i2].mean()), float(ephem['el'][i1:i2].mean())
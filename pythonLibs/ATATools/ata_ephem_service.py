@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Client-side service in front of the /ephemeris endpoint of the REST gateway.
+
+Generating an ephemeris takes a POST, fetching it back a GET of up to
+43k points. The service keeps the ephemeris IDs (and the fetched points)
+of recent requests, so asking again for the same source, interval and
+duration shortly after (see EPHEM_REUSE_WINDOW) costs nothing, and can
+generate the ephemerides of the next targets of a schedule in the
+background while the current one is observed:
+
+    from ATATools import ata_ephem_service, ata_control
+
+    service = ata_ephem_service.get_service()
+    service.prefetch(['casa', 'cyga', 'taua'])   # returns immediately
+    for source in ['casa', 'cyga', 'taua']:
+        ephem_id = service.get_id(source=source)  # waits only if not ready yet
+        ata_control.track_ephemeris(ephem_id, ant_list)
+        ...
+
+    points = service.get_points(source='casa', duration=2)  # structured array
+    az, el = ata_ephem.az_el_at(points, t_tai_ns)
+
+The ephemeris arguments are the ones of ata_control.generate_ephemeris
+(exactly one of source/radec/azel/tle, plus interval, duration etc.)
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import threading
+
+from . import ata_cache, ata_ephem, logger_defaults
+from .ata_rest import ATARest
+
+# an ephemeris generated for the same arguments is reused for at most
+# EPHEM_REUSE_WINDOW seconds, and at most EPHEM_REUSE_FRACTION of its
+# duration, so it still covers at least 90% of the requested duration
+# (an ephemeris starts when it is generated)
+EPHEM_REUSE_WINDOW = 600.0 #seconds
+EPHEM_REUSE_FRACTION = 0.1
+
+# the point lists of this many ephemerides are kept in memory
+EPHEM_POINTS_CACHE_SIZE = 8
+
+EPHEM_PREFETCH_WORKERS = 4
+
+EPHEM_SOURCES = ('azel', 'radec', 'source', 'tle')
+
+# content type of the packed ata_ephem.EPHEM_DTYPE records
+EPHEM_BINARY_CONTENT_TYPE = 'application/octet-stream'
+
+# defaults applied by the control system, see ata_control._set_ephemeris_defaults
+EPHEM_DEFAULT_INTERVAL = 1 #seconds
+EPHEM_DEFAULT_DURATION = 12 #hours
+
+
+def ephemeris_args(target=None, **ephem_kwargs):
+    """
+    Return the complete /ephemeris request arguments, with the defaults
+    filled in. target can be a source name, or a dictionary of arguments
+
+    :raises ValueError if not exactly one source type is given
+    """
+    args = {}
+    if isinstance(target, dict):
+        args.update(target)
+    elif target is not None:
+        args['source'] = target
+    args.update(ephem_kwargs)
+
+    source_count = len([s for s in EPHEM_SOURCES if s in args])
+    if source_count != 1:
+        raise ValueError('ephemeris takes exactly one source type: ' + ', '.join(EPHEM_SOURCES))
+
+    args.setdefault('interval', EPHEM_DEFAULT_INTERVAL)
+    args.setdefault('duration', EPHEM_DEFAULT_DURATION)
+    return args
+
+def ephemeris_key(args):
+    """
+    Memoisation key of the complete ephemeris arguments
+    """
+    args = dict(args)
+    if 'tle' in args:
+        # TLE files can be long, and only the content matters
+        args['tle'] = hashlib.sha1(args['tle'].encode()).hexdigest()
+    return json.dumps(args, sort_keys=True)
+
+
+class EphemerisService:
+    """
+    Memoising, prefetching front-end to the /ephemeris endpoint.
+    Thread-safe: concurrent requests for the same ephemeris share one POST
+    """
+
+    def __init__(self, reuse_window=EPHEM_REUSE_WINDOW,
+            max_workers=EPHEM_PREFETCH_WORKERS):
+        self.reuse_window = reuse_window
+        self.max_workers = max_workers
+        self._ids = ata_cache.get_cache('ephemeris_id', reuse_window)
+        self._points = ata_cache.get_cache('ephemeris_points', reuse_window,
+                maxsize=EPHEM_POINTS_CACHE_SIZE)
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._executor = None
+
+    def get_id(self, target=None, **ephem_kwargs):
+        """
+        Return the ID of an ephemeris for the given arguments, generating
+        it on the control server unless a recent one can be reused
+
+        :param target: source name, or dictionary of ephemeris arguments
+        :param ephem_kwargs: ephemeris arguments, see ata_control.generate_ephemeris
+        :returns ephemeris ID
+        """
+        args = ephemeris_args(target, **ephem_kwargs)
+        key = ephemeris_key(args)
+
+        ephem_id = self._ids.get(key)
+        if ephem_id is not None:
+            return ephem_id
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._inflight[key] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            ephem_id = self._generate(args)
+            reuse = self.reuse_time(args)
+            if reuse > 0:
+                self._ids.set(key, ephem_id, ttl=reuse)
+            future.set_result(ephem_id)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return ephem_id
+
+    def reuse_time(self, args):
+        """
+        Seconds the ephemeris of the complete arguments args can be
+        reused for after it was generated: reuse_window, or
+        EPHEM_REUSE_FRACTION of a shorter duration
+        """
+        return min(self.reuse_window,
+                EPHEM_REUSE_FRACTION * float(args['duration']) * 3600.0)
+
+    def retrieve(self, ephem_id):
+        """
+        Return the points of ephemeris ephem_id as a list of
+        [TAI_ns, az, el, inverse_range], the format of the server.
+        Kept for compatibility, get_points() returns them without
+        the conversion
+        """
+        return ata_ephem.ephem_to_list(self.get_points(ephem_id=ephem_id))
+
+    def get_points(self, target=None, ephem_id=None, **ephem_kwargs):
+        """
+        Return the points of an ephemeris as a numpy structured array of
+        ata_ephem.EPHEM_DTYPE (columns 'tai_ns', 'az', 'el', 'invr'),
+        see ata_ephem.az_el_at and ata_ephem.mean_az_el.
+        The array is shared with the cache and read-only
+
+        Either give ephem_id, or the ephemeris arguments as for get_id()
+        """
+        if ephem_id is None:
+            ephem_id = self.get_id(target, **ephem_kwargs)
+        return self._points.get_or_fetch(ephem_id, lambda: self._retrieve(ephem_id))
+
+    def prefetch(self, targets, points=False, **ephem_kwargs):
+        """
+        Generate the ephemerides of targets in the background
+
+        :param targets: list of source names or dictionaries of ephemeris arguments
+        :param points: also fetch the points of the ephemerides
+        :param ephem_kwargs: arguments common to all the targets, e.g. duration
+        :returns list of futures, resolving to the ephemeris IDs
+        """
+        logger = logger_defaults.getModuleLogger(__name__)
+        executor = self._get_executor()
+
+        def fetch(target):
+            try:
+                ephem_id = self.get_id(target, **ephem_kwargs)
+                if points:
+                    self.get_points(ephem_id=ephem_id)
+                return ephem_id
+            except Exception as e:
+                logger.warning('prefetching ephemeris for {} failed: {}'.format(target, str(e)))
+                raise
+
+        # validate the arguments here, rather than in the background
+        for target in targets:
+            ephemeris_args(target, **ephem_kwargs)
+        return [executor.submit(fetch, target) for target in targets]
+
+    def invalidate(self, target=None, **ephem_kwargs):
+        """
+        Forget the ephemeris for the given arguments, or all of them
+        if called without arguments
+        """
+        if target is None and not ephem_kwargs:
+            self._ids.invalidate()
+            self._points.invalidate()
+        else:
+            self._ids.invalidate(ephemeris_key(ephemeris_args(target, **ephem_kwargs)))
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix='ephem_prefetch')
+            return self._executor
+
+    @staticmethod
+    def _generate(args):
+        logger = logger_defaults.getModuleLogger(__name__)
+        endpoint = '/ephemeris'
+        try:
+            result = ATARest.post(endpoint, json=args)
+        except Exception as e:
+            logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
+            raise
+        return result['id']
+
+    @staticmethod
+    def _retrieve(ephem_id):
+        logger = logger_defaults.getModuleLogger(__name__)
+        endpoint = '/ephemeris'
+        # ask for the packed binary format, the gateway answers in JSON
+        # if it doesn't know it. Both can come gzip-compressed
+        headers = {'Accept': EPHEM_BINARY_CONTENT_TYPE + ', application/json;q=0.5'}
+        try:
+            content_type, content = ATARest.get_raw(endpoint, json={'id': ephem_id},
+                    headers=headers)
+            if content_type.startswith(EPHEM_BINARY_CONTENT_TYPE):
+                points = ata_ephem.decode_binary_ephem(content)
+            else:
+                points = ata_ephem.decode_json_ephem(content)
+        except Exception as e:
+            logger.error('{:s} got error: {:s}'.format(endpoint, str(e)))
+            raise
+        points.flags.writeable = False
+        return points
+
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_service():
+    """
+    Return the process-wide EphemerisService
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = EphemerisService()
+        return _service
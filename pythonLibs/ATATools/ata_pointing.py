@@ -1,4 +1,14 @@
+import collections.abc
+import concurrent.futures
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
 import numpy as np
+from . import ata_cache, logger_defaults
 from .ata_rest import ATARest, ATARestException
 
 
@@ -10,6 +20,140 @@ PIBY2 = np.pi / 2.0
 
 MAX_EL_FOR_CORRECTION = 1.5533430342749532 #radians, 89.0 degrees
 
+# removeTPOINTCorrections inverts the model by fixed-point iteration,
+# stopping when the round trip is this close to the input
+INVERSE_TOLERANCE = 1e-4 * ARC_SEC #degrees
+INVERSE_MAX_ITERATIONS = 10
+
+# the models are only updated after a pointing campaign: they are kept
+# on disk and revalidated with a conditional GET when used. Models
+# checked less than this long ago are only reused as they are when
+# asked for, with PointingModelSet(ants, max_age=POINTING_MODEL_CACHE_TTL)
+POINTING_MODEL_CACHE_TTL = 3600.0 #seconds
+POINTING_MODEL_CACHE_FILE = os.path.join(ata_cache.CACHE_DIR, 'pointing_models.json')
+POINTING_MODEL_FETCH_WORKERS = 16
+
+_CACHE_FORMAT = 1
+_cache_lock = threading.Lock()
+
+
+def _model_hash(model):
+    return hashlib.sha1(json.dumps(model, sort_keys=True).encode()).hexdigest()
+
+def _read_cache_file():
+    """
+    {ant: entry} of the pointing model cache file, see _fetch_models
+    """
+    logger = logger_defaults.getModuleLogger(__name__)
+    try:
+        with open(POINTING_MODEL_CACHE_FILE) as f:
+            content = json.load(f)
+        if content.get('format') != _CACHE_FORMAT:
+            return {}
+        return content['models']
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning('ignoring unreadable cache file {:s}: {:s}'.format(
+            POINTING_MODEL_CACHE_FILE, str(e)))
+        return {}
+
+def _write_cache_file(updates):
+    """
+    merge the entries updates into the cache file, atomically
+    """
+    logger = logger_defaults.getModuleLogger(__name__)
+    entries = _read_cache_file()
+    entries.update(updates)
+    try:
+        dirname = os.path.dirname(POINTING_MODEL_CACHE_FILE)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.pointing_models')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'format': _CACHE_FORMAT, 'models': entries}, f,
+                    indent=1, sort_keys=True)
+        os.replace(tmpname, POINTING_MODEL_CACHE_FILE)
+    except Exception as e:
+        logger.warning('could not write cache file {:s}: {:s}'.format(
+            POINTING_MODEL_CACHE_FILE, str(e)))
+
+def _fetch_models(ants, max_age=0.0, offline=False,
+        force=False, max_workers=POINTING_MODEL_FETCH_WORKERS):
+    """
+    Return {ant: entry} of the pointing models of ants, from the cache
+    file, revalidating concurrently the entries checked more than
+    max_age seconds ago (all of them if force).
+
+    An entry is a dictionary with the keys
+        model: the /antenna/{ant}/pm response
+        etag, hash: ETag (if the gateway sends one) and sha1 of the model
+        checked: unix time the model was last fetched or revalidated
+        version: incremented every time the model changes
+        modified: unix time of the last change
+
+    If the control system can't be reached (or offline), the cached
+    entries are used whatever their age
+
+    :raises ATARestException if a model is neither cached nor available
+    """
+    logger = logger_defaults.getModuleLogger(__name__)
+    use_cache = ata_cache._enabled
+    with _cache_lock:
+        cached = _read_cache_file() if use_cache else {}
+    now = time.time()
+    stale = [ant for ant in ants if force or not use_cache or ant not in cached
+            or now - cached[ant]['checked'] > max_age]
+    if offline:
+        missing = [ant for ant in ants if ant not in cached]
+        if missing:
+            raise ATARestException('no cached pointing model for {}'.format(
+                ', '.join(missing)))
+        stale = []
+
+    def revalidate(ant):
+        entry = cached.get(ant)
+        etag, model = ATARest.get_if_modified('/antenna/{:s}/pm'.format(ant),
+                etag=entry.get('etag') if entry else None)
+        t = time.time()
+        if model is None:
+            return dict(entry, checked=t, etag=etag or entry.get('etag'))
+        model_hash = _model_hash(model)
+        if entry is not None and entry['hash'] == model_hash:
+            return dict(entry, checked=t, etag=etag)
+        return {'model': model, 'etag': etag, 'hash': model_hash, 'checked': t,
+                'version': entry['version'] + 1 if entry else 1, 'modified': t}
+
+    updates = {}
+    errors = {}
+    if stale:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(max_workers, len(stale)),
+                thread_name_prefix='pm_fetch') as executor:
+            futures = {executor.submit(revalidate, ant): ant for ant in stale}
+            for future in concurrent.futures.as_completed(futures):
+                ant = futures[future]
+                try:
+                    updates[ant] = future.result()
+                except Exception as e:
+                    errors[ant] = e
+
+    fallback = [ant for ant in errors if ant in cached]
+    if fallback:
+        logger.warning('could not revalidate the pointing models of {}, '
+                'using the cached ones: {}'.format(', '.join(fallback),
+                    str(errors[fallback[0]])))
+    missing = [ant for ant in errors if ant not in cached]
+    if missing:
+        raise ATARestException('could not fetch the pointing model of {}: {}'.format(
+            ', '.join(missing), str(errors[missing[0]])))
+
+    if updates and use_cache:
+        with _cache_lock:
+            _write_cache_file(updates)
+    entries = dict(cached)
+    entries.update(updates)
+    return {ant: entries[ant] for ant in ants}
+
 
 class modelCoeff:
     pass
@@ -29,13 +173,50 @@ class PointingModel():
         self.antName = ant
         self.mCoef = modelCoeff()
 
-        pointing_model = ATARest.get('/antenna/{:s}/pm'.format(ant))
+        # the model is kept on disk and always revalidated with a
+        # conditional GET, see _fetch_models
+        entry = _fetch_models([ant], max_age=0.0)[ant]
+        self._set_model(entry['model'])
+        self.version = entry['version']
+
+    def _set_model(self, pointing_model):
         for key, value in pointing_model.items():
             if key in self._TPOINT_COEFFS:
                 setattr(self.mCoef, key, value)
             else:
                 setattr(self, key, value)
 
+    @classmethod
+    def _from_entry(cls, ant, entry):
+        pm = cls.__new__(cls)
+        pm.antName = ant
+        pm.mCoef = modelCoeff()
+        pm._set_model(entry['model'])
+        pm.version = entry['version']
+        return pm
+
+    @classmethod
+    def from_coefficients(cls, ant, coeffs, AzOffset=0.0, ElOffset=0.0):
+        """
+        Model with the given TPOINT coefficients (dictionary, in arcsec,
+        missing ones are 0), without asking the control system
+        """
+        pm = cls.__new__(cls)
+        pm.antName = ant
+        pm.mCoef = modelCoeff()
+        pm.version = None
+        pm.AzOffset = AzOffset
+        pm.ElOffset = ElOffset
+        for key in cls._TPOINT_COEFFS:
+            setattr(pm.mCoef, key, float(coeffs.get(key, 0.0)))
+        return pm
+
+    def coefficients(self):
+        """
+        TPOINT coefficients as a dictionary
+        """
+        return {key: getattr(self.mCoef, key) for key in self._TPOINT_COEFFS}
+
     def avoidImpossibleEl(self, el_rad):
         """
         Keeps you away from the region around zenith that can't be reached
@@ -45,21 +226,22 @@ class PointingModel():
         It is not recommended, but if you insist on using it, then you
         must modify avoidImpossibleEl() to operate on the sum of CA and NPAE
         where it now operates on CA only.
-        @param el_rad input elevation in radians
+        @param el_rad input elevation in radians (scalar or array)
         @return coerced elevation in radians
         """
         # the pointing model makes no sense very close to zenith
         # (you could never get there anyway cause these are nonperp terms)
         avoidance_zone = np.abs(self.mCoef.CA) * SEC2RAD + 0.0001;
-        if ( el_rad <  0.0          ):
-            return 0.0
-        if ( el_rad > (PIBY2 - avoidance_zone)):
-          return (PIBY2 - avoidance_zone);
-        return el_rad;
+        return np.clip(el_rad, 0.0, PIBY2 - avoidance_zone)
 
 
 
     def applyTPOINTCorrections(self, Az, El, IR):
+        """
+        Apply the pointing model to sky az/el in degrees, giving the
+        encoder az/el. Az and El can be scalars or numpy arrays
+        (of the same shape), IR is passed through
+        """
         # break out the individual tracks
         #Track az_track = new Track(track_in.getAz());
         #Track el_track = new Track(track_in.getEl());
@@ -67,8 +249,8 @@ class PointingModel():
 
         # convert to the "coordinate system" of the encoders
         # calculations are done in radians
-        az = Az * DEG2RAD;
-        el = self.avoidImpossibleEl(El * DEG2RAD);
+        az = np.asarray(Az, dtype=np.float64) * DEG2RAD;
+        el = self.avoidImpossibleEl(np.asarray(El, dtype=np.float64) * DEG2RAD);
 
         # pointing terms MUST be applied serially, not in parallel
         az, el = self.applyECEC  (az, el);
@@ -91,6 +273,50 @@ class PointingModel():
 
         return az, el, IR
 
+    def removeTPOINTCorrections(self, Az, El, IR):
+        """
+        Inverse of applyTPOINTCorrections: sky az/el in degrees of the
+        encoder az/el Az, El (scalars or numpy arrays), IR is passed through.
+        Positions whose elevation gets coerced (below the horizon or
+        in the zenith avoidance zone) can't be inverted exactly
+        """
+        az_enc = np.asarray(Az, dtype=np.float64)
+        el_enc = np.asarray(El, dtype=np.float64)
+        az, el = az_enc, el_enc
+        for i in range(INVERSE_MAX_ITERATIONS):
+            az_model, el_model, _ = self.applyTPOINTCorrections(az, el, IR)
+            daz = az_model - az_enc
+            del_ = el_model - el_enc
+            az = az - daz
+            el = el - del_
+            if np.nanmax(np.abs(daz)) < INVERSE_TOLERANCE and \
+                    np.nanmax(np.abs(del_)) < INVERSE_TOLERANCE:
+                break
+        return az, el, IR
+
+    def apply_to_ephemeris(self, ephem, inverse=False):
+        """
+        Correct (or with inverse, uncorrect) all the points of an
+        ephemeris in one vectorised pass
+
+        :param ephem: numpy structured array of ata_ephem.EPHEM_DTYPE,
+            or list of [TAI_ns, az, el, inverse_range] in degrees
+        :param inverse: remove the pointing model instead of applying it
+        :returns the corrected ephemeris, of the same type as ephem
+        """
+        # imported here: ata_ephem is not needed to evaluate the model
+        from . import ata_ephem
+
+        points = ata_ephem.to_ephem_array(ephem)
+        apply = self.removeTPOINTCorrections if inverse else self.applyTPOINTCorrections
+        az, el, _ = apply(points['az'], points['el'], None)
+        out = points.copy()
+        out['az'] = az
+        out['el'] = el
+        if isinstance(ephem, np.ndarray):
+            return out
+        return ata_ephem.ephem_to_list(out)
+
     def applyECEC(self, az, el):
         el = self.coerceEl(el - SEC2RAD * self.mCoef.ECEC * np.cos(el))
         return az, el
@@ -121,37 +347,27 @@ class PointingModel():
 
     def applyNPAE(self, az, el):
         # Prohibit tan(el) from reaching a value too large.
-        if (el > MAX_EL_FOR_CORRECTION):
-            az = az + SEC2RAD * self.mCoef.NPAE * np.tan(MAX_EL_FOR_CORRECTION)
-            return az, el
-        az = az + SEC2RAD * self.mCoef.NPAE * np.tan(el)
+        el_lim = np.minimum(el, MAX_EL_FOR_CORRECTION)
+        az = az + SEC2RAD * self.mCoef.NPAE * np.tan(el_lim)
         return az, el
 
     def applyCA(self, az, el):
         # Prohibit 1/cos(el) from reaching a value too large.
-        if (el > MAX_EL_FOR_CORRECTION):
-            az = az + SEC2RAD * self.mCoef.CA / np.cos(MAX_EL_FOR_CORRECTION)
-            return az, el
-        az = az + SEC2RAD * self.mCoef.CA / np.cos(el)
+        el_lim = np.minimum(el, MAX_EL_FOR_CORRECTION)
+        az = az + SEC2RAD * self.mCoef.CA / np.cos(el_lim)
         return az, el
 
     def applyAW(self, az, el):
         # Prohibit tan(el) from reaching a value too large.
-        if (el > MAX_EL_FOR_CORRECTION):
-            az = az + SEC2RAD * self.mCoef.AW * np.cos(az) * np.tan(MAX_EL_FOR_CORRECTION)
-            el = self.coerceEl(el - SEC2RAD * self.mCoef.AW * np.sin(az))
-            return az, el
-        az = az + SEC2RAD * self.mCoef.AW * np.cos(az) * np.tan(el)
+        el_lim = np.minimum(el, MAX_EL_FOR_CORRECTION)
+        az = az + SEC2RAD * self.mCoef.AW * np.cos(az) * np.tan(el_lim)
         el = self.coerceEl(el - SEC2RAD * self.mCoef.AW * np.sin(az))
         return az, el
 
     def applyAN(self, az, el):
         # Prohibit tan(el) from reaching a value too large.
-        if (el > MAX_EL_FOR_CORRECTION):
-            az = az + SEC2RAD *self. mCoef.AN * np.sin(az) * np.tan(MAX_EL_FOR_CORRECTION)
-            el = self.coerceEl(el + SEC2RAD * self.mCoef.AN * np.cos(az))
-            return az, el
-        az = az + SEC2RAD * self.mCoef.AN * np.sin(az) * np.tan(el)
+        el_lim = np.minimum(el, MAX_EL_FOR_CORRECTION)
+        az = az + SEC2RAD * self.mCoef.AN * np.sin(az) * np.tan(el_lim)
         el = self.coerceEl(el + SEC2RAD * self.mCoef.AN * np.cos(az))
         return az, el
 
@@ -163,11 +379,7 @@ class PointingModel():
         # tan(el) and sec(el) blow up too close to zenith
         # avoid those values
         roundoff_zone = 0.0001;
-        if ( el_rad <  0.0 ):
-            return 0.0
-        if ( el_rad > (PIBY2 - roundoff_zone)):
-          return (PIBY2 - roundoff_zone)
-        return el_rad
+        return np.clip(el_rad, 0.0, PIBY2 - roundoff_zone)
 
 
     def to_tpoint_str(self):
@@ -190,3 +402,78 @@ class PointingModel():
         return retStr
 
 
+
+
+class PointingModelSet(collections.abc.Mapping):
+    """
+    The pointing models of many antennas, fetched concurrently and kept
+    in a versioned cache file (POINTING_MODEL_CACHE_FILE), so repeated
+    runs and offline analysis don't need the control system:
+
+        pms = PointingModelSet(ant_list)
+        az, el, ir = pms['1c'].applyTPOINTCorrections(az, el, 0)
+
+    The models are revalidated with a conditional GET (ETag, or comparing
+    the content hash if the gateway sends no ETag). Models checked less
+    than max_age seconds ago are used without asking, e.g. with
+    max_age=POINTING_MODEL_CACHE_TTL for repeated runs that can live
+    with a model up to an hour old. With offline=True only the cache
+    file is used.
+    """
+
+    def __init__(self, ants, max_age=0.0, offline=False,
+            max_workers=POINTING_MODEL_FETCH_WORKERS):
+        self.ants = list(ants)
+        self.max_age = max_age
+        self.offline = offline
+        self.max_workers = max_workers
+        self._entries = {}
+        self._models = {}
+        self.refresh(force=False)
+
+    def refresh(self, force=True):
+        """
+        Revalidate the models (all of them if force, otherwise only
+        the ones older than max_age)
+
+        :returns list of the antennas whose model changed
+        """
+        entries = _fetch_models(self.ants, self.max_age, self.offline, force,
+                self.max_workers)
+        changed = [ant for ant in self.ants if ant not in self._entries
+                or self._entries[ant]['hash'] != entries[ant]['hash']]
+        for ant in changed:
+            self._models[ant] = PointingModel._from_entry(ant, entries[ant])
+        self._entries = entries
+        return changed
+
+    def __getitem__(self, ant):
+        return self._models[ant]
+
+    def __iter__(self):
+        return iter(self.ants)
+
+    def __len__(self):
+        return len(self.ants)
+
+    def versions(self):
+        """
+        {ant: version} of the models, incremented every time a model changes
+        """
+        return {ant: self._entries[ant]['version'] for ant in self.ants}
+
+    def checked(self):
+        """
+        {ant: unix time} the models were last fetched or revalidated
+        """
+        return {ant: self._entries[ant]['checked'] for ant in self.ants}
+
+    @property
+    def version(self):
+        """
+        Hash identifying the models of the whole set
+        """
+        digest = hashlib.sha1()
+        for ant in sorted(self.ants):
+            digest.update('{}:{};'.format(ant, self._entries[ant]['hash']).encode())
+        return digest.hexdigest()[:12]
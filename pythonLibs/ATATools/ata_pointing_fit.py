@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Least-squares fitting of the 12-term TPOINT model of ata_pointing.PointingModel.
+
+The pointing scripts (ObservationScripts/atapointer_*.py) write, per
+antenna and polarisation, a .tpoint file whose rows hold the sky position
+of the source (az_com, el_com) and the encoder position at which its
+peak was found (az_meas, el_meas). Fitting finds the coefficients that
+map the former onto the latter:
+
+    from ATATools import ata_pointing_fit
+
+    fits = ata_pointing_fit.fit_tpoint_files(glob.glob('*/*.tpoint'))
+    for (ant, pol), fit in sorted(fits.items()):
+        print(ant, pol, fit.rms_before, fit.rms_after)
+        print(fit.to_tpoint_str())
+
+The model is evaluated vectorised over all the points (Gauss-Newton,
+with the Jacobian taken numerically from PointingModel itself, so the
+fit matches exactly what the control system applies), outliers are
+down-weighted by iteratively reweighted least squares (Huber weights,
+or hard rejection beyond a number of MAD-sigmas), and the antennas are
+fitted in parallel.
+"""
+
+import concurrent.futures
+import re
+
+import numpy as np
+
+from . import logger_defaults
+from .ata_pointing import PointingModel, ARC_SEC
+
+MADF = 1.4826 #conversion from MAD to STD
+
+# NPAE is left out by default, see PointingModel.avoidImpossibleEl
+DEFAULT_FIT_TERMS = ('IA', 'AN', 'AW', 'CA', 'ACES', 'ACEC', 'HASA2',
+        'HACA2', 'IE', 'ECES', 'ECEC')
+
+ROBUST_METHODS = (None, 'huber', 'mad')
+HUBER_K = 1.345
+MAD_CLIP = 3.0
+
+FIT_MAX_ITERATIONS = 20
+FIT_TOLERANCE = 1e-3 #arcsec, largest coefficient change to stop at
+
+FIT_WORKERS = 8
+
+# numerical derivative step of the coefficients
+_JACOBIAN_STEP = 1.0 #arcsec
+
+_HEADER_RE = re.compile(r'^!\s*(\w+)\s*=\s*([-+0-9.eE]+)')
+_ANTENNA_RE = re.compile(r'^!\s*Antenna:\s*ant(\w+?)([xy])?\s*$')
+
+
+class TPointData:
+    """
+    Pointing observations of one antenna (and polarisation)
+
+    Attributes:
+        ant, pol: antenna name and polarisation (None if unknown)
+        coeffs: TPOINT coefficients in use during the observations
+            (from the file headers), or None
+        az_com, el_com: sky positions in degrees
+        az_meas, el_meas: encoder positions of the peaks in degrees
+        sbr: peak source to background ratios
+    """
+
+    def __init__(self, az_com, el_com, az_meas, el_meas, sbr=None,
+            ant=None, pol=None, coeffs=None):
+        self.ant = ant
+        self.pol = pol
+        self.coeffs = coeffs
+        self.az_com = np.asarray(az_com, dtype=np.float64)
+        self.el_com = np.asarray(el_com, dtype=np.float64)
+        self.az_meas = np.asarray(az_meas, dtype=np.float64)
+        self.el_meas = np.asarray(el_meas, dtype=np.float64)
+        self.sbr = (np.full(len(self.az_com), np.nan) if sbr is None
+                else np.asarray(sbr, dtype=np.float64))
+
+    def __len__(self):
+        return len(self.az_com)
+
+    @staticmethod
+    def concatenate(datas):
+        datas = list(datas)
+        first = datas[0]
+        return TPointData(*[np.concatenate([getattr(d, col) for d in datas])
+            for col in ('az_com', 'el_com', 'az_meas', 'el_meas', 'sbr')],
+            ant=first.ant, pol=first.pol, coeffs=first.coeffs)
+
+
+def read_tpoint_file(filename):
+    """
+    Read a .tpoint file written by the atapointer scripts
+
+    :returns TPointData
+    """
+    ant, pol = None, None
+    coeffs = {}
+    rows = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith(':'):
+                continue
+            if line.startswith('!'):
+                m = _ANTENNA_RE.match(line)
+                if m:
+                    ant, pol = m.group(1), m.group(2)
+                    continue
+                m = _HEADER_RE.match(line)
+                if m and m.group(1) in PointingModel._TPOINT_COEFFS:
+                    coeffs[m.group(1)] = float(m.group(2))
+                continue
+            fields = line.split('!')[0].split(',')
+            if len(fields) < 4:
+                # e.g. the site latitude line
+                continue
+            rows.append([float(x) for x in fields[:5]] + [np.nan] * (5 - len(fields)))
+
+    rows = np.array(rows, dtype=np.float64).reshape(-1, 5)
+    return TPointData(rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3], rows[:, 4],
+            ant=ant, pol=pol, coeffs=coeffs or None)
+
+
+class PointingFit:
+    """
+    Result of fit_pointing_model
+
+    Attributes:
+        ant: antenna name
+        terms: the fitted coefficients
+        coeffs: all the TPOINT coefficients of the new model (arcsec)
+        sigma: formal errors of the fitted coefficients (arcsec)
+        n_points, n_used: number of points, and of points with weight > 0.5
+        weights: final robust weights of the points
+        residuals_xel, residuals_el: on-sky residuals of the new model (arcsec)
+        rms_before, rms_after: on-sky RMS residual (arcsec) of the initial
+            model and of the new one, over the points used
+        iterations, converged: Gauss-Newton iterations and convergence
+    """
+
+    def __init__(self, ant, terms, coeffs, sigma, weights, residuals_xel,
+            residuals_el, rms_before, rms_after, iterations, converged):
+        self.ant = ant
+        self.terms = tuple(terms)
+        self.coeffs = coeffs
+        self.sigma = sigma
+        self.weights = weights
+        self.n_points = len(weights)
+        self.n_used = int(np.sum(weights > 0.5))
+        self.residuals_xel = residuals_xel
+        self.residuals_el = residuals_el
+        self.rms_before = rms_before
+        self.rms_after = rms_after
+        self.iterations = iterations
+        self.converged = converged
+
+    @property
+    def improved(self):
+        return self.rms_after < self.rms_before
+
+    def model(self):
+        """
+        PointingModel with the fitted coefficients
+        """
+        return PointingModel.from_coefficients(self.ant, self.coeffs)
+
+    def to_tpoint_str(self):
+        return self.model().to_tpoint_str()
+
+    def summary(self):
+        return '{}: {} points ({} used), RMS {:.1f}" -> {:.1f}"{}'.format(
+                self.ant, self.n_points, self.n_used, self.rms_before,
+                self.rms_after, '' if self.converged else ' (not converged)')
+
+
+def _predict(ant, coeffs, az, el):
+    pm = PointingModel.from_coefficients(ant, coeffs)
+    az_enc, el_enc, _ = pm.applyTPOINTCorrections(az, el, None)
+    return az_enc, el_enc
+
+def _residuals(data, ant, coeffs, cos_el):
+    """
+    on-sky (cross-elevation, elevation) residuals in arcsec of the
+    measurements with respect to the model
+    """
+    az_enc, el_enc = _predict(ant, coeffs, data.az_com, data.el_com)
+    daz = (data.az_meas - az_enc + 180.0) % 360.0 - 180.0
+    return daz * cos_el / ARC_SEC, (data.el_meas - el_enc) / ARC_SEC
+
+def _rms(r_xel, r_el, weights):
+    used = weights > 0.5
+    if not np.any(used):
+        return np.nan
+    return float(np.sqrt(np.mean(r_xel[used]**2 + r_el[used]**2)))
+
+def _robust_weights(r_xel, r_el, robust):
+    if robust is None:
+        return np.ones(len(r_el))
+    scale = MADF * np.median(np.abs(np.concatenate([r_xel, r_el])))
+    if scale <= 0.0:
+        return np.ones(len(r_el))
+    mag = np.sqrt((r_xel**2 + r_el**2) / 2.0)
+    if robust == 'huber':
+        return np.minimum(1.0, HUBER_K * scale / np.maximum(mag, 1e-12))
+    return (mag <= MAD_CLIP * scale).astype(np.float64)
+
+
+def fit_pointing_model(data, initial=None, terms=DEFAULT_FIT_TERMS,
+        robust='huber', ant=None, max_iterations=FIT_MAX_ITERATIONS,
+        tolerance=FIT_TOLERANCE):
+    """
+    Fit TPOINT coefficients to pointing observations
+
+    Parameters
+    ------------
+    data : TPointData
+    initial : PointingModel, dict or None
+        starting model, also the one the new fit is compared with. The
+        coefficients not in terms keep their initial values. Default:
+        the coefficients of the data headers, or zeros
+    terms : list of str
+        the coefficients to fit
+    robust : None, 'huber' or 'mad'
+        outlier weighting: Huber weights, or rejection beyond MAD_CLIP
+        MAD-sigmas, recomputed at every iteration
+    ant : str
+        antenna name, default data.ant
+
+    Returns
+    ------------
+    PointingFit
+
+    Raises
+    ------------
+    ValueError
+        on unknown terms or robust method, or too few points
+    """
+    if robust not in ROBUST_METHODS:
+        raise ValueError('unknown robust method {}, expected one of {}'.format(
+            robust, ROBUST_METHODS))
+    unknown = set(terms) - set(PointingModel._TPOINT_COEFFS)
+    if unknown:
+        raise ValueError('unknown TPOINT terms: {}'.format(', '.join(sorted(unknown))))
+    ok = (np.isfinite(data.az_com) & np.isfinite(data.el_com)
+            & np.isfinite(data.az_meas) & np.isfinite(data.el_meas))
+    data = TPointData(data.az_com[ok], data.el_com[ok], data.az_meas[ok],
+            data.el_meas[ok], data.sbr[ok], data.ant, data.pol, data.coeffs)
+    if 2 * len(data) <= len(terms):
+        raise ValueError('{} points are not enough to fit {} terms'.format(
+            len(data), len(terms)))
+
+    ant = ant if ant is not None else data.ant
+    if isinstance(initial, PointingModel):
+        coeffs = initial.coefficients()
+    else:
+        initial = initial if initial is not None else (data.coeffs or {})
+        coeffs = {key: float(initial.get(key, 0.0)) for key in PointingModel._TPOINT_COEFFS}
+    initial_coeffs = dict(coeffs)
+
+    cos_el = np.cos(np.radians(data.el_com))
+    r_xel, r_el = _residuals(data, ant, coeffs, cos_el)
+    weights = np.ones(len(data))
+
+    converged = False
+    iteration = 0
+    for iteration in range(1, max_iterations + 1):
+        # Jacobian of the on-sky predictions (2N, nterms)
+        pred = np.concatenate([-r_xel, -r_el])
+        jac = np.empty((2 * len(data), len(terms)))
+        for k, term in enumerate(terms):
+            stepped = dict(coeffs)
+            stepped[term] += _JACOBIAN_STEP
+            s_xel, s_el = _residuals(data, ant, stepped, cos_el)
+            jac[:, k] = (np.concatenate([-s_xel, -s_el]) - pred) / _JACOBIAN_STEP
+
+        sw = np.sqrt(np.concatenate([weights, weights]))
+        delta, _, _, _ = np.linalg.lstsq(jac * sw[:, np.newaxis],
+                np.concatenate([r_xel, r_el]) * sw, rcond=None)
+        for term, d in zip(terms, delta):
+            coeffs[term] += d
+
+        r_xel, r_el = _residuals(data, ant, coeffs, cos_el)
+        new_weights = _robust_weights(r_xel, r_el, robust)
+        if np.max(np.abs(delta)) < tolerance and np.allclose(new_weights, weights, atol=1e-3):
+            weights = new_weights
+            converged = True
+            break
+        weights = new_weights
+
+    # formal errors from the weighted normal equations
+    w2 = np.concatenate([weights, weights])
+    n_eff = np.sum(w2 > 0.5)
+    dof = max(n_eff - len(terms), 1)
+    chi2 = np.sum(w2 * np.concatenate([r_xel, r_el])**2) / dof
+    cov = np.linalg.pinv(jac.T @ (jac * w2[:, np.newaxis])) * chi2
+    sigma = {term: float(np.sqrt(max(cov[k, k], 0.0))) for k, term in enumerate(terms)}
+
+    b_xel, b_el = _residuals(data, ant, initial_coeffs, cos_el)
+    return PointingFit(ant, terms, coeffs, sigma, weights, r_xel, r_el,
+            _rms(b_xel, b_el, weights), _rms(r_xel, r_el, weights),
+            iteration, converged)
+
+
+def fit_array(observations, models=None, max_workers=FIT_WORKERS, **fit_kwargs):
+    """
+    Fit the pointing models of many antennas in parallel
+
+    :param observations: dictionary {key: TPointData}, key is e.g. the
+        antenna name or (ant, pol)
+    :param models: dictionary {key: PointingModel or coefficient dict}
+        of the initial models, see fit_pointing_model
+    :param fit_kwargs: arguments of fit_pointing_model
+    :returns dictionary {key: PointingFit}, the keys whose fit failed
+        are logged and left out
+    """
+    logger = logger_defaults.getModuleLogger(__name__)
+    models = models or {}
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+            thread_name_prefix='pointing_fit') as executor:
+        futures = {executor.submit(fit_pointing_model, data,
+            initial=models.get(key), **fit_kwargs): key
+            for key, data in observations.items()}
+        for future in concurrent.futures.as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                logger.error('pointing fit of {} failed: {}'.format(key, str(e)))
+    return results
+
+def fit_tpoint_files(filenames, models=None, max_workers=FIT_WORKERS, **fit_kwargs):
+    """
+    Read .tpoint files, group them by antenna and polarisation
+    (from the file headers) and fit them in parallel, see fit_array
+
+    :param models: initial models, keyed by (ant, pol) or ant
+    :returns dictionary {(ant, pol): PointingFit}
+    """
+    groups = {}
+    for filename in filenames:
+        data = read_tpoint_file(filename)
+        if len(data):
+            groups.setdefault((data.ant, data.pol), []).append(data)
+    observations = {key: TPointData.concatenate(datas) for key, datas in groups.items()}
+    if models:
+        models = {key: models.get(key, models.get(key[0])) for key in observations}
+    return fit_array(observations, models, max_workers, **fit_kwargs)
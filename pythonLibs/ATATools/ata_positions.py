@@ -15,14 +15,262 @@ import os
 import datetime as dt
 import ephem
 import math
+from scipy.optimize import brentq
 from astropy import units as u
 from astropy.coordinates import Angle
 from . import ata_constants as ata_const
+from . import ata_catalog
 from . import logger_defaults
 
 MIN_MOON_SUN_DIST = 45.0
 MIN_ELEV = 23.0
 
+# coarse step of the up_windows() search. Windows (or gaps) shorter
+# than that can be missed
+UP_WINDOW_STEP = 600.0 #seconds
+
+# J2000 positions (ra in hours decimal, dec in degrees decimal)
+# of the sources known by name
+SOURCE_RADEC = {
+        'casa': (23.391, 58.808),
+        'cyga': (19.991, 40.734),
+        'taua': (5.575, 22.016),
+        'vira': (12.514, 12.391),
+        }
+
+# geostationary sources (az, el in degrees)
+SOURCE_AZEL = {
+        'goes-16': (121.998, 23.598),
+        }
+
+# sources isUp() always reports as up
+ALWAYS_UP = frozenset(['goes-16'])
+
+# sources computed with pyephem at every time step
+SOLAR_SYSTEM = {'sun': ephem.Sun, 'moon': ephem.Moon}
+SOLAR_SYSTEM_STEP = 600.0 #seconds, see _solar_system_azel
+
+_UNIX_EPOCH_JD = 2440587.5
+_J2000_JD = 2451545.0
+_ARCSEC = math.pi / 180.0 / 3600.0
+
+
+def _to_unix(d):
+    """
+    datetime to unix time. Naive datetimes are taken as UTC,
+    as pyephem does
+    """
+    if isinstance(d, dt.datetime):
+        if d.tzinfo is None:
+            d = d.replace(tzinfo=dt.timezone.utc)
+        return d.timestamp()
+    return float(d)
+
+def _times_to_unix(times):
+    if isinstance(times, (dt.datetime, int, float)):
+        times = [times]
+    if isinstance(times, np.ndarray) and times.dtype != object:
+        return times.astype(np.float64).ravel()
+    return np.array([_to_unix(d) for d in times], dtype=np.float64)
+
+def _precession_matrices(jd):
+    """
+    J2000 -> mean equator and equinox of date (IAU 1976), shape (M, 3, 3)
+    """
+    T = (jd - _J2000_JD) / 36525.0
+    zeta = (2306.2181 * T + 0.30188 * T**2 + 0.017998 * T**3) * _ARCSEC
+    z = (2306.2181 * T + 1.09468 * T**2 + 0.018203 * T**3) * _ARCSEC
+    theta = (2004.3109 * T - 0.42665 * T**2 - 0.041833 * T**3) * _ARCSEC
+
+    cze, sze = np.cos(zeta), np.sin(zeta)
+    cz, sz = np.cos(z), np.sin(z)
+    cth, sth = np.cos(theta), np.sin(theta)
+
+    P = np.empty(T.shape + (3, 3))
+    P[..., 0, 0] = cze * cth * cz - sze * sz
+    P[..., 0, 1] = -sze * cth * cz - cze * sz
+    P[..., 0, 2] = -sth * cz
+    P[..., 1, 0] = cze * cth * sz + sze * cz
+    P[..., 1, 1] = -sze * cth * sz + cze * cz
+    P[..., 1, 2] = -sth * sz
+    P[..., 2, 0] = cze * sth
+    P[..., 2, 1] = -sze * sth
+    P[..., 2, 2] = cth
+    return P
+
+def _local_sidereal_time(jd):
+    """
+    local mean sidereal time at the ATA in radians
+    """
+    D = jd - _J2000_JD
+    T = D / 36525.0
+    gmst = 280.46061837 + 360.98564736629 * D + 0.000387933 * T**2 - T**3 / 38710000.0
+    return np.radians((gmst + ata_const.ATA_LON) % 360.0)
+
+def _refraction(el_deg):
+    """
+    atmospheric refraction in degrees (Bennett), for the pyephem
+    default atmosphere (1010 mbar, 15 C)
+    """
+    h = np.maximum(el_deg, -1.0)
+    R = 1.02 / np.tan(np.radians(h + 10.3 / (h + 5.11))) / 60.0
+    R *= 283.0 / (273.0 + 15.0)
+    return np.where(el_deg > -1.0, R, 0.0)
+
+def _equatorial_to_azel(ra, dec, jd):
+    """
+    az/el in degrees from ra/dec of date in radians, (N, M) arrays
+    for the M julian dates jd
+    """
+    ha = _local_sidereal_time(jd) - ra
+    lat = math.radians(ata_const.ATA_LAT)
+    sin_el = math.sin(lat) * np.sin(dec) + math.cos(lat) * np.cos(dec) * np.cos(ha)
+    el = np.degrees(np.arcsin(np.clip(sin_el, -1.0, 1.0)))
+    az = np.degrees(np.arctan2(-np.cos(dec) * np.sin(ha),
+        np.sin(dec) * math.cos(lat) - np.cos(dec) * math.sin(lat) * np.cos(ha))) % 360.0
+    return az, el + _refraction(el)
+
+def radec_to_azel(ra, dec, unix_times):
+    """
+    Vectorised apparent az/el of J2000 positions as seen from the ATA
+
+    :param ra: array of N right ascensions in hours
+    :param dec: array of N declinations in degrees
+    :param unix_times: array of M unix times
+    :returns az, el: (N, M) arrays in degrees
+
+    Precession and refraction are included, nutation and aberration are
+    not, so above the horizon the positions agree with pyephem to a few
+    hundredths of a degree
+    """
+    ra = np.radians(np.atleast_1d(np.asarray(ra, dtype=np.float64)) * 15.0)
+    dec = np.radians(np.atleast_1d(np.asarray(dec, dtype=np.float64)))
+    jd = np.asarray(unix_times, dtype=np.float64) / 86400.0 + _UNIX_EPOCH_JD
+
+    # unit vectors (N, 3), precessed to the equinox of every time (N, M, 3)
+    v = np.stack([np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)], axis=-1)
+    v = np.einsum('mij,nj->nmi', _precession_matrices(jd), v)
+    ra_d = np.arctan2(v[..., 1], v[..., 0])
+    dec_d = np.arcsin(np.clip(v[..., 2], -1.0, 1.0))
+    return _equatorial_to_azel(ra_d, dec_d, jd)
+
+def _solar_system_azel(name, unix_times, step=SOLAR_SYSTEM_STEP):
+    """
+    az/el in degrees of the Sun or Moon at the given unix times.
+
+    pyephem computes the apparent topocentric ra/dec every step seconds,
+    which is interpolated to the requested times (they change slowly,
+    unlike az/el) and converted to az/el
+    """
+    observer = ephem.Observer()
+    observer.lat = ata_const.ATA_LAT * math.pi/180.0
+    observer.lon = ata_const.ATA_LON * math.pi/180.0
+    observer.elev = ata_const.ATA_ELEV
+    body = SOLAR_SYSTEM[name]()
+
+    unix_times = np.asarray(unix_times, dtype=np.float64)
+    if len(unix_times) == 0:
+        return np.empty(0), np.empty(0)
+    t_min, t_max = unix_times.min(), unix_times.max()
+    nsteps = int(math.ceil((t_max - t_min) / step)) + 1
+    if nsteps >= len(unix_times):
+        grid = unix_times
+    else:
+        grid = t_min + step * np.arange(nsteps)
+
+    ra = np.empty(len(grid))
+    dec = np.empty(len(grid))
+    for i, t in enumerate(grid):
+        # pyephem dates are days since 1899/12/31 12:00 UTC
+        observer.date = t / 86400.0 + 25567.5
+        body.compute(observer)
+        ra[i] = body.ra
+        dec[i] = body.dec
+
+    if grid is not unix_times:
+        ra = np.interp(unix_times, grid, np.unwrap(ra))
+        dec = np.interp(unix_times, grid, dec)
+    jd = unix_times / 86400.0 + _UNIX_EPOCH_JD
+    az, el = _equatorial_to_azel(ra[np.newaxis, :], dec[np.newaxis, :], jd)
+    return az[0], el[0]
+
+def angular_separation(az1, el1, az2, el2):
+    """
+    Vectorised angular distance in degrees between az/el positions in degrees
+    """
+    az1, el1, az2, el2 = [np.radians(a) for a in (az1, el1, az2, el2)]
+    cos_d = np.sin(el1) * np.sin(el2) + np.cos(el1) * np.cos(el2) * np.cos(az1 - az2)
+    return np.degrees(np.arccos(np.clip(cos_d, -1.0, 1.0)))
+
+
+class Visibility:
+    """
+    Positions and observability of N sources at M times,
+    as computed by ATAPositions.visibility()
+
+    Attributes (arrays are (N, M), rows in the order of sources):
+        sources: list of source names
+        unix_times: (M,) array of unix times
+        az, el: az/el in degrees
+        sun_dist, moon_dist: angular distance to the Sun and Moon in degrees
+            (moon_dist of the moon itself is 90, as in getPreferedSourceUp),
+            None if computed with a sky mask
+        avoid: in a Sun/Moon exclusion zone of the sky mask, or None
+        is_up: el > min_elev (or the source is in ALWAYS_UP)
+        visible: is_up and far enough from the Sun and Moon
+        margin: distance in degrees to the tightest of the constraints,
+            positive when visible (-inf in the exclusion zones of a sky mask)
+    """
+
+    def __init__(self, sources, unix_times, az, el, sun_dist, moon_dist,
+            min_elev=MIN_ELEV, min_sun_moon_dist=MIN_MOON_SUN_DIST, avoid=None):
+        self.sources = list(sources)
+        self.unix_times = unix_times
+        self.az = az
+        self.el = el
+        self.sun_dist = sun_dist
+        self.moon_dist = moon_dist
+        always_up = np.array([s is not None and s.lower() in ALWAYS_UP
+            for s in self.sources])[:, np.newaxis]
+        self.avoid = avoid
+        self.is_up = (el > min_elev) | always_up
+        # by how much (in degrees) the tightest constraint is met,
+        # negative if the source is not observable
+        el_margin = np.where(always_up, np.inf, el - min_elev)
+        if avoid is not None:
+            self.visible = self.is_up & ~avoid
+            self.margin = np.where(avoid, -np.inf, el_margin)
+        else:
+            self.visible = (self.is_up & (sun_dist >= min_sun_moon_dist)
+                    & (moon_dist >= min_sun_moon_dist))
+            self.margin = np.minimum(el_margin,
+                    np.minimum(sun_dist, moon_dist) - min_sun_moon_dist)
+
+    def index(self, source):
+        return self.sources.index(source)
+
+    def uptime(self, start=0):
+        """
+        Number of consecutive visible time steps of every source,
+        counted from time step start
+        """
+        vis = self.visible[:, start:]
+        # index of the first not visible step, or all of them
+        return np.where(vis.all(axis=1), vis.shape[1], np.argmin(vis, axis=1))
+
+    def first_visible(self):
+        """
+        Return (source index, time index) of the first time step at which
+        any source is visible (the first one in the source list if several
+        are), or None
+        """
+        steps = np.flatnonzero(self.visible.any(axis=0))
+        if len(steps) == 0:
+            return None
+        istep = steps[0]
+        return int(np.argmax(self.visible[:, istep])), int(istep)
+
+
 class ATAPositions:
 
     def __init__(self):
@@ -33,11 +281,171 @@ class ATAPositions:
         self.observer.elev = ata_const.ATA_ELEV
 
     @staticmethod
-    def getPreferedSourceUp(preference,sources,d=None):    
+    def visibility(sources, times, min_elev=MIN_ELEV, min_sun_moon_dist=MIN_MOON_SUN_DIST,
+            skymask=None):
+        """
+        Compute the az/el, Sun and Moon distances and observability of
+        all the sources at all the times in one vectorised pass
+
+        Parameters
+        ------------
+        sources : list
+            source names (sun, moon, the keys of SOURCE_RADEC and SOURCE_AZEL,
+            the sources of ata_catalog.get_catalog()),
+            or (ra, dec) tuples, ra in hours, dec in degrees
+        times : list of datetime, or array of unix times
+            naive datetimes are UTC, as for pyephem
+        min_elev : float
+            minimum elevation in degrees
+        min_sun_moon_dist : float
+            minimum distance from the Sun and the Moon in degrees
+        skymask : ata_skymask.SkyMask
+            if given, the Sun and Moon exclusion is looked up in the mask
+            instead of computed, when the mask covers the times and all
+            the sources have fixed ra/dec
+
+        Returns
+        ------------
+        Visibility
+            with (len(sources), len(times)) arrays
+
+        Raises
+        ------------
+        ValueError
+            if a source is unknown, or the skymask was computed for
+            another min_sun_moon_dist
+        """
+        unix_times = _times_to_unix(times)
+        nsrc, ntimes = len(sources), len(unix_times)
+        az = np.empty((nsrc, ntimes))
+        el = np.empty((nsrc, ntimes))
+
+        catalog = ata_catalog.get_catalog(required=False)
+        names = []
+        radec_rows, radec = [], []
+        solar_rows = {}
+        for i, source in enumerate(sources):
+            if isinstance(source, (tuple, list)):
+                ra, dec = source
+                names.append("%f,%f" % (ra, dec))
+                radec_rows.append(i)
+                radec.append((ra, dec))
+                continue
+            names.append(source)
+            key = source.lower()
+            if key in SOLAR_SYSTEM:
+                solar_rows.setdefault(key, []).append(i)
+            elif key in SOURCE_RADEC:
+                radec_rows.append(i)
+                radec.append(SOURCE_RADEC[key])
+            elif key in SOURCE_AZEL:
+                az[i], el[i] = SOURCE_AZEL[key]
+            elif key in catalog:
+                radec_rows.append(i)
+                radec.append(catalog.radec(key))
+            else:
+                raise ValueError("unknown source {}".format(source))
+
+        if radec_rows:
+            ra, dec = zip(*radec)
+            az[radec_rows], el[radec_rows] = radec_to_azel(ra, dec, unix_times)
+
+        if skymask is not None:
+            if skymask.min_sun_moon_dist != min_sun_moon_dist:
+                raise ValueError("sky mask computed for a minimum Sun/Moon distance of {}".format(
+                    skymask.min_sun_moon_dist))
+            if len(radec_rows) == nsrc and skymask.covers(unix_times):
+                avoid = np.zeros((nsrc, ntimes), dtype=bool)
+                if radec_rows:
+                    avoid[radec_rows] = skymask.excluded(ra, dec, unix_times, geo=False)
+                return Visibility(names, unix_times, az, el, None, None,
+                        min_elev, min_sun_moon_dist, avoid=avoid)
+
+        sun_az, sun_el = _solar_system_azel('sun', unix_times)
+        moon_az, moon_el = _solar_system_azel('moon', unix_times)
+        for rows, body_az, body_el in ((solar_rows.get('sun', []), sun_az, sun_el),
+                (solar_rows.get('moon', []), moon_az, moon_el)):
+            az[rows] = body_az
+            el[rows] = body_el
+
+        sun_dist = angular_separation(az, el, sun_az, sun_el)
+        moon_dist = angular_separation(az, el, moon_az, moon_el)
+        # as in the scalar code: the moon is never too close to itself
+        moon_dist[solar_rows.get('moon', [])] = 90.0
+
+        return Visibility(names, unix_times, az, el, sun_dist, moon_dist,
+                min_elev, min_sun_moon_dist)
+
+    @staticmethod
+    def up_windows(source, start, end, min_elev=MIN_ELEV,
+            min_sun_moon_dist=MIN_MOON_SUN_DIST, step=UP_WINDOW_STEP, tol=1.0):
+        """
+        Find the time intervals during which source is observable: above
+        min_elev and at least min_sun_moon_dist from the Sun and the Moon.
+
+        The constraints are evaluated every step seconds, and every change
+        of observability is then refined with Brent's method to tol seconds
+
+        Parameters
+        ------------
+        source : str or (ra, dec) tuple
+            see visibility()
+        start, end : datetime or unix time
+            the search interval. Naive datetimes are UTC
+        min_elev : float
+            minimum elevation in degrees
+        min_sun_moon_dist : float
+            minimum distance from the Sun and the Moon in degrees
+        step : float
+            coarse search step in seconds. Windows shorter than that may be missed
+        tol : float
+            precision of the window edges in seconds
+
+        Returns
+        ------------
+        list of (datetime, datetime)
+            start and end (naive UTC) of the observable windows, in time
+            order, clipped to [start, end]
+        """
+        t_start, t_end = _to_unix(start), _to_unix(end)
+        if t_end <= t_start:
+            return []
+
+        def margin(times):
+            return ATAPositions.visibility([source], times, min_elev,
+                    min_sun_moon_dist).margin[0]
+
+        npoints = max(2, int(math.ceil((t_end - t_start) / step)) + 1)
+        grid = np.linspace(t_start, t_end, npoints)
+        up = margin(grid) > 0
+
+        def crossing(t1, t2):
+            return brentq(lambda t: margin([t])[0], t1, t2, xtol=tol)
+
+        windows = []
+        window_start = t_start if up[0] else None
+        for i in np.flatnonzero(up[1:] != up[:-1]):
+            t = crossing(grid[i], grid[i+1])
+            if up[i]:
+                windows.append((window_start, t))
+                window_start = None
+            else:
+                window_start = t
+        if window_start is not None:
+            windows.append((window_start, t_end))
+
+        def to_datetime(t):
+            return dt.datetime.fromtimestamp(t, dt.timezone.utc).replace(tzinfo=None)
+
+        return [(to_datetime(t1), to_datetime(t2)) for t1, t2 in windows]
+
+    @staticmethod
+    def getPreferedSourceUp(preference,sources,d=None,skymask=None):    
         """
         Checks if prefered source is up and far enough from sun (and moon)
         if yes, prefered is returned. if no, new prefered is picked
         the new prefered is the source from the list that will have a longest uptime
+        (looking up to one day ahead, in minute steps)
 
         Parameters
         ------------
@@ -47,6 +455,9 @@ class ATAPositions:
             list of possible sources
         d : datetime
             date and time of the search. Default is now
+        skymask : ata_skymask.SkyMask
+            Sun/Moon exclusion mask to use where it covers the search,
+            see visibility()
 
         Returns
         ------------
@@ -61,95 +472,54 @@ class ATAPositions:
         if(d == None):
             d=dt.datetime.now()
 
-        pos = ATAPositions()
-
         #if we have some preference, just checking if it is still up and far away from sun/moon
         if (preference) and (preference in sources):
-            info = pos.getAzEl(d, preference)
-            sun_angle = ATAPositions.angular_distance('sun', preference, d)
-            if(preference == 'moon'):
-                moon_angle = 90.0
-            else:
-                moon_angle = ATAPositions.angular_distance('moon', preference, d)
-            is_up = pos.isUp(preference, d)
-            if(is_up == True and sun_angle >= MIN_MOON_SUN_DIST and moon_angle >= MIN_MOON_SUN_DIST):
-                logger.info('prefered source is up: {}, {}'.format(info['az'],info['el']))
+            vis = ATAPositions.visibility([preference], [d], skymask=skymask)
+            if vis.visible[0, 0]:
+                logger.info('prefered source is up: {}, {}'.format(vis.az[0, 0], vis.el[0, 0]))
                 return preference,0
         
         #since we are here, the prefered source is not up
-        preference_uptime = 0
-        now_date = d
-        preference=None
-        for s in sources:
-            c_uptime = 0
-            future_minutes = 1
-            while (future_minutes < 1440):
-                d = now_date + dt.timedelta(minutes=future_minutes)
-                sun_angle = ATAPositions.angular_distance('sun', s, d)
-                if(s == 'moon'):
-                    moon_angle = 90.0
-                else:
-                    moon_angle = ATAPositions.angular_distance('moon', s, d)
-                is_up = pos.isUp(s, d)
-                if(is_up == True and sun_angle >= MIN_MOON_SUN_DIST and moon_angle >= MIN_MOON_SUN_DIST):
-                    c_uptime += 1
-                    future_minutes +=1
-                else:
-                    break;
-
-            #if source is longer that last prefered, update prefered
-            if(preference_uptime < c_uptime):
-                preference = s
-                preference_uptime = c_uptime
-
-        return preference,1
+        if not sources:
+            return None,1
+        t0 = _to_unix(d)
+        vis = ATAPositions.visibility(sources, t0 + 60.0 * np.arange(1, 1440),
+                skymask=skymask)
+        uptime = vis.uptime()
+
+        #the first source with the longest uptime, if any is up at all
+        best = int(np.argmax(uptime))
+        if uptime[best] == 0:
+            return None,1
+        return sources[best],1
 
 
 
     @staticmethod
-    def getFirstInListThatIsUp(sources, d=None):
+    def getFirstInListThatIsUp(sources, d=None, skymask=None):
 
         if(d == None):
             d=dt.datetime.now()
 
-        pos = ATAPositions();
+        if not sources:
+            return None
 
-        for s in sources:
-            info = pos.getAzEl(d, s)
-            sun_angle = ATAPositions.angular_distance('sun', s, d)
-            if(s == 'moon'):
-                moon_angle = 90.0
-            else:
-                moon_angle = ATAPositions.angular_distance('moon', s, d)
-            is_up = pos.isUp(s, d)
-            if(is_up == True and sun_angle >= MIN_MOON_SUN_DIST and moon_angle >= MIN_MOON_SUN_DIST):
-              info = pos.getAzEl(d, s)
-              return { 'status' : 'up', 'source' : s, 'az' : info['az'], 'el' : info['el'] }
-
-        # If we got this far, none are up. So get the next one to rise
-        future_minutes = 1;
-        now_date = d
-
-        while(future_minutes < 1440): #If more than 1 day, something is wrong
-
-            d = now_date + dt.timedelta(minutes=future_minutes)
-
-            for s in sources:
-                info = pos.getAzEl(dt.datetime.now(), s)
-                sun_angle = ATAPositions.angular_distance('sun', s, d)
-                if(s == 'moon'):
-                    moon_angle = 90.0
-                else:
-                    moon_angle = ATAPositions.angular_distance('moon', s, d)
-                is_up = pos.isUp(s, d)
-                if(is_up == True and sun_angle >= MIN_MOON_SUN_DIST and moon_angle >= MIN_MOON_SUN_DIST):
-                    info = pos.getAzEl(d, s)
-                    return { 'status' : 'next_up', 'source' : s, 'az' : info['az'], \
-                            'el' : info['el'], "minutes" : future_minutes }
-            future_minutes+=1;
+        # now, and then every minute up to a day ahead
+        t0 = _to_unix(d)
+        vis = ATAPositions.visibility(sources, t0 + 60.0 * np.arange(0, 1440),
+                skymask=skymask)
 
+        first = vis.first_visible()
+        if first is None:
+            return None
 
-        return None
+        isrc, minutes = first
+        s = sources[isrc]
+        az, el = float(vis.az[isrc, minutes]), float(vis.el[isrc, minutes])
+        if minutes == 0:
+            return { 'status' : 'up', 'source' : s, 'az' : az, 'el' : el }
+        return { 'status' : 'next_up', 'source' : s, 'az' : az, \
+                'el' : el, "minutes" : minutes }
 
     def getSunAzEl(self, d=None):
         if(d == None):
@@ -172,31 +542,24 @@ class ATAPositions:
         obj = None
         if(name != None):
 
-            if(name.lower() == "sun"):
-                obj = ephem.Sun()
-            elif(name.lower() == "moon"):
-                obj = ephem.Moon()
-            elif(name.lower() == "casa"):
+            key = name.lower()
+            if(key in SOLAR_SYSTEM):
+                obj = SOLAR_SYSTEM[key]()
+            elif(key in SOURCE_RADEC):
                 obj =  ephem.FixedBody()
-                obj._ra = 23.391 * math.pi/180.0 * 15.0
-                obj._dec = 58.808 * math.pi/180.0
-            elif(name.lower() == "cyga"):
+                obj._ra = SOURCE_RADEC[key][0] * math.pi/180.0 * 15.0
+                obj._dec = SOURCE_RADEC[key][1] * math.pi/180.0
+            elif(key in SOURCE_AZEL):
                 obj =  ephem.FixedBody()
-                obj._ra = 19.991 * math.pi/180.0 * 15.0
-                obj._dec = 40.734 * math.pi/180.0
-            elif(name.lower() == "taua"):
-                obj =  ephem.FixedBody()
-                obj._ra = 5.575 * math.pi/180.0 * 15.0
-                obj._dec = 22.016 * math.pi/180.0
-            elif(name.lower() == "vira"):
-                obj =  ephem.FixedBody()
-                obj._ra = 12.514 * math.pi/180.0 * 15.0
-                obj._dec = 12.391 * math.pi/180.0
-            elif(name.lower() == "goes-16"):
-                obj =  ephem.FixedBody()
-                ra,dec = self.observer.radec_of(121.998 * math.pi/180.0, 23.598 * math.pi/180.0)
+                ra,dec = self.observer.radec_of(SOURCE_AZEL[key][0] * math.pi/180.0,
+                        SOURCE_AZEL[key][1] * math.pi/180.0)
                 obj._ra =  ra
                 obj._dec = dec
+            elif(key in ata_catalog.get_catalog(required=False)):
+                obj =  ephem.FixedBody()
+                ra,dec = ata_catalog.get_catalog(required=False).radec(key)
+                obj._ra = ra * math.pi/180.0 * 15.0
+                obj._dec = dec * math.pi/180.0
             elif(name.lower() == "radec"):
                 obj =  ephem.FixedBody();
                 obj._ra = ra * math.pi/180.0 * 15.0
@@ -219,7 +582,7 @@ class ATAPositions:
     def isUp(self, name, d=None, ra=-99.0, dec=-99):
         
         #TODO: JK: I am very hesitant to leave it here
-        if(name == 'goes-16'):
+        if(name in ALWAYS_UP):
             return True
 
         if(d == None):
@@ -1,4 +1,16 @@
+import asyncio
+import concurrent.futures
+import copy
+import functools
+import json as jsonlib
+import random
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from . import ata_rest_metrics
 
 
 class ATARestException(Exception):
@@ -13,6 +25,19 @@ class ATARest:
     Simple API to encapsulate REST calls with more directed error handling.
     Any errors will cause a ATARestException to be thrown with any error message
     if available.
+
+    All calls go through one shared requests.Session, so connections to the
+    REST gateway are pooled and kept alive between calls (and between threads).
+    Idempotent GETs that fail on a connection error, a connect timeout or
+    a gateway error (RETRY_STATUS_CODES: 502, 503, 504) are retried up to
+    GET_RETRIES times with jittered exponential backoff. A GET that times
+    out waiting for the response is not retried: the gateway got it, and
+    is busy. Use configure() to change the timeouts, retries or pool size.
+
+    Optionally (COALESCE = True, or configure(coalesce=True)) identical GETs
+    issued by several threads at the same time share one HTTP request, and
+    GETs repeated within COALESCE_WINDOW seconds reuse the last response.
+    Any PUT, POST or DELETE drops the reused responses.
     """
     
     HOST = 'restgw.hcro.org'
@@ -20,6 +45,22 @@ class ATARest:
 
     RETURN_MSG_KEY = 'message'
 
+    # (connect, read) timeouts in seconds. The read timeout has to be generous,
+    # since calls with wait=True block until the antennas are on source
+    CONNECT_TIMEOUT = 5.0
+    READ_TIMEOUT = 600.0
+
+    GET_RETRIES = 3
+    RETRY_BACKOFF = 0.2 #seconds, doubled on every retry
+    RETRY_BACKOFF_MAX = 5.0 #seconds
+    RETRY_STATUS_CODES = frozenset([502, 503, 504])
+
+    POOL_CONNECTIONS = 4
+    POOL_MAXSIZE = 64
+
+    COALESCE = False
+    COALESCE_WINDOW = 0.3 #seconds
+
     _OP_GET = 'get'
     _OP_PUT = 'put'
     _OP_POST = 'post'
@@ -27,6 +68,125 @@ class ATARest:
 
     _debug = False
 
+    _session = None
+    _session_lock = threading.Lock()
+
+    # request coalescing state, guarded by _coalesce_lock
+    _inflight = {}
+    _recent = {}
+    _write_generation = 0
+    _coalesce_lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, connect_timeout=None, read_timeout=None, get_retries=None,
+            retry_backoff=None, pool_maxsize=None, coalesce=None, coalesce_window=None):
+        """
+        Change the connection policy of the shared session.
+        Only the given (not None) parameters are changed.
+
+        :param connect_timeout: TCP connect timeout in seconds
+        :param read_timeout: timeout in seconds waiting for the server response
+        :param get_retries: number of retries of a failed GET
+        :param retry_backoff: initial retry backoff in seconds
+        :param pool_maxsize: maximum number of kept-alive connections
+        :param coalesce: share concurrent identical GETs (True/False)
+        :param coalesce_window: seconds a GET response is reused for
+        """
+        with cls._session_lock:
+            if connect_timeout is not None:
+                cls.CONNECT_TIMEOUT = float(connect_timeout)
+            if read_timeout is not None:
+                cls.READ_TIMEOUT = float(read_timeout)
+            if get_retries is not None:
+                cls.GET_RETRIES = int(get_retries)
+            if retry_backoff is not None:
+                cls.RETRY_BACKOFF = float(retry_backoff)
+            if pool_maxsize is not None:
+                cls.POOL_MAXSIZE = int(pool_maxsize)
+                # the adapter is sized on creation, force a new session
+                cls._close_session()
+        if pool_maxsize is not None:
+            # and the AsyncATARest workers on the pool size
+            AsyncATARest._reset_executor()
+        with cls._coalesce_lock:
+            if coalesce is not None:
+                cls.COALESCE = bool(coalesce)
+            if coalesce_window is not None:
+                cls.COALESCE_WINDOW = float(coalesce_window)
+            cls._recent.clear()
+
+    @classmethod
+    def get_session(cls):
+        """
+        Return the shared requests.Session, creating it on first use
+        """
+        session = cls._session
+        if session is None:
+            with cls._session_lock:
+                if cls._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=cls.POOL_CONNECTIONS,
+                            pool_maxsize=cls.POOL_MAXSIZE, pool_block=False)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    cls._session = session
+                session = cls._session
+        return session
+
+    @classmethod
+    def close(cls):
+        """
+        Close the shared session and all of its pooled connections.
+        A new session is created on the next call
+        """
+        with cls._session_lock:
+            cls._close_session()
+
+    @classmethod
+    def _close_session(cls):
+        # caller holds _session_lock
+        if cls._session is not None:
+            cls._session.close()
+            cls._session = None
+
+    @classmethod
+    def _retry_sleep(cls, attempt):
+        """
+        Full-jitter exponential backoff, so that many clients retrying
+        at the same time don't hit the gateway in lockstep
+        """
+        backoff = min(cls.RETRY_BACKOFF_MAX, cls.RETRY_BACKOFF * (2 ** attempt))
+        time.sleep(random.uniform(0, backoff))
+
+    @classmethod
+    def _request(cls, op, url, **kwargs):
+        """
+        Send a single request over the shared session, retrying idempotent
+        GETs on connection errors (including connect timeouts) and gateway
+        errors. Read timeouts are not retried, each can take READ_TIMEOUT
+        """
+        kwargs.setdefault('timeout', (cls.CONNECT_TIMEOUT, cls.READ_TIMEOUT))
+        session = cls.get_session()
+        retries = cls.GET_RETRIES if op == cls._OP_GET else 0
+
+        attempt = 0
+        while True:
+            try:
+                response = session.request(op, url, **kwargs)
+            except requests.ConnectionError:
+                # also ConnectTimeout, but not ReadTimeout
+                if attempt >= retries:
+                    raise
+            else:
+                if (response.status_code not in cls.RETRY_STATUS_CODES
+                        or attempt >= retries):
+                    return response
+                response.close()
+            if cls._debug:
+                print('retrying {:s} {:s}'.format(op, url))
+            cls._retry_sleep(attempt)
+            attempt += 1
+
     @classmethod
     def form_url(cls, endpoint):
         if not endpoint.startswith('/'):
@@ -36,34 +196,115 @@ class ATARest:
 
     @classmethod
     def _do_op(cls, op, endpoint, **kwargs):
+        """
+        Handle one of the HTTP operations, coalescing GETs if enabled
+
+        :param op: HTTP operation to perform
+        :param endpoint: REST endpoint (no stem) to call
+        :param kwargs: any additional arguments to requests.get(), etc.
+
+        :returns dict from JSON section of REST server response
+        :rtype dict
+
+        :raises ATARestException on any error response
+        """
+        if op != cls._OP_GET:
+            # the write may change anything we have read, or are reading
+            if cls.COALESCE or cls._recent:
+                with cls._coalesce_lock:
+                    cls._recent.clear()
+                    cls._inflight.clear()
+                    cls._write_generation += 1
+        elif cls.COALESCE:
+            key = cls._coalesce_key(endpoint, kwargs)
+            if key is not None:
+                return cls._coalesced_get(key, endpoint, **kwargs)
+        return cls._send(op, endpoint, **kwargs)
+
+    @staticmethod
+    def _coalesce_key(endpoint, kwargs):
+        try:
+            return endpoint + jsonlib.dumps(kwargs, sort_keys=True)
+        except (TypeError, ValueError):
+            # e.g. a file or a session-specific argument, don't share
+            return None
+
+    @classmethod
+    def _coalesced_get(cls, key, endpoint, **kwargs):
+        """
+        GET endpoint, sharing the request with other threads asking for the
+        same key at the same time, and reusing a response that is less than
+        COALESCE_WINDOW seconds old. Every caller gets its own copy of the
+        decoded JSON, so it is free to modify it
+        """
+        with cls._coalesce_lock:
+            recent = cls._recent.get(key)
+            if recent is not None and time.monotonic() - recent[0] < cls.COALESCE_WINDOW:
+                return copy.deepcopy(recent[1])
+            call = cls._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _InflightCall()
+                cls._inflight[key] = call
+            generation = cls._write_generation
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = cls._send(cls._OP_GET, endpoint, **kwargs)
+        except BaseException as e:
+            call.error = e if isinstance(e, ATARestException) else ATARestException(str(e))
+            raise
+        finally:
+            with cls._coalesce_lock:
+                if cls._inflight.get(key) is call:
+                    del cls._inflight[key]
+                # don't keep a response that may predate a write
+                if call.error is None and generation == cls._write_generation:
+                    cls._recent[key] = (time.monotonic(), call.result)
+            call.done.set()
+        return copy.deepcopy(call.result)
+
+    @classmethod
+    def _send(cls, op, endpoint, raw=False, with_etag=False, **kwargs):
         """
         Handle one of the HTTP operations
 
         :param op: HTTP operation to perform
         :param endpoint: REST endpoint (no stem) to call
+        :param raw: return the undecoded body of a successful response
+        :param with_etag: return (ETag, JSON), (ETag, None) on a
+            304 Not Modified answer
         :param kwargs: any additional arguments to requests.get(), etc.
         
-        :returns dict from JSON section of REST server response
+        :returns dict from JSON section of REST server response,
+            or (content type, body bytes) if raw
         :rtype dict
 
         :raises ATARestException on any error response
         """
 
+        t_start = time.monotonic()
+        response = None
+        error = True
         try:
             url = cls.form_url(endpoint)
             if cls._debug:
                 print(url)
 
-            if op == cls._OP_GET:
-                response = requests.get(url, **kwargs)
-            elif op == cls._OP_PUT:
-                response = requests.put(url, **kwargs)
-            elif op == cls._OP_DEL:
-                response = requests.delete(url, **kwargs)
-            elif op == cls._OP_POST:
-                response = requests.post(url, **kwargs)
-            else:
+            if op not in (cls._OP_GET, cls._OP_PUT, cls._OP_DEL, cls._OP_POST):
                 raise ATARestException('Bad op given to ATARest._do_op()')
+            response = cls._request(op, url, **kwargs)
+            if raw and response.status_code == requests.codes.ok:
+                error = False
+                return response.headers.get('Content-Type', ''), response.content
+            if with_etag and response.status_code == requests.codes.not_modified:
+                error = False
+                return response.headers.get('ETag'), None
 
             json = response.json()
             if response.status_code != requests.codes.ok:
@@ -73,9 +314,20 @@ class ATARest:
                     raise ATARestException('No error message from REST API ' + op)
             if cls._debug:
                 print(json)
+            error = False
+            if with_etag:
+                return response.headers.get('ETag'), json
             return json
         except Exception as e:
             raise ATARestException(str(e))
+        finally:
+            bytes_sent = bytes_received = 0
+            if response is not None:
+                body = response.request.body if response.request is not None else None
+                bytes_sent = len(body) if body else 0
+                bytes_received = len(response.content or b'')
+            ata_rest_metrics.record(op, endpoint, time.monotonic() - t_start,
+                    error, bytes_sent, bytes_received)
 
 
     @classmethod
@@ -93,6 +345,47 @@ class ATARest:
         """
         return cls._do_op(cls._OP_GET, endpoint, **kwargs)
 
+    @classmethod
+    def get_raw(cls, endpoint, **kwargs):
+        """
+        HTTP GET operation on ATA REST API endpoint, for endpoints that
+        can answer in other formats than JSON (never coalesced)
+
+        :param endpoint: REST endpoint (no stem) to call
+        :param kwargs: any additional arguments to requests.get(), etc.
+
+        :returns (content type, body bytes) of the REST server response.
+            gzip content encoding is already undone
+        :rtype tuple
+
+        :raises ATARestException on any error response
+        """
+        return cls._send(cls._OP_GET, endpoint, raw=True, **kwargs)
+
+    @classmethod
+    def get_if_modified(cls, endpoint, etag=None, **kwargs):
+        """
+        Conditional HTTP GET operation on ATA REST API endpoint
+        (never coalesced): if etag is given and the resource still has
+        this ETag, the server answers 304 Not Modified without a body
+
+        :param endpoint: REST endpoint (no stem) to call
+        :param etag: ETag of the copy held by the caller, or None
+        :param kwargs: any additional arguments to requests.get(), etc.
+
+        :returns (ETag, dict from JSON section of REST server response),
+            or (ETag, None) if not modified. The ETag is None if the
+            server doesn't send any
+        :rtype tuple
+
+        :raises ATARestException on any error response
+        """
+        if etag is not None:
+            headers = dict(kwargs.pop('headers', None) or {})
+            headers['If-None-Match'] = etag
+            kwargs['headers'] = headers
+        return cls._send(cls._OP_GET, endpoint, with_etag=True, **kwargs)
+
     @classmethod
     def put(cls, endpoint, **kwargs):
         """
@@ -137,7 +430,111 @@ class ATARest:
         :raises ATARestException on any error response
         """
         return cls._do_op(cls._OP_DEL, endpoint, **kwargs)
-    
+
+
+
+class _InflightCall:
+    """
+    A GET shared by several threads, see ATARest._coalesced_get()
+    """
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class AsyncATARest:
+    """
+    asyncio counterpart of ATARest.
+
+    The coroutines run the blocking ATARest calls on a dedicated thread pool,
+    so they share ATARest's pooled session, timeouts, retries and error
+    handling. Many requests can be awaited at the same time, e.g.:
+
+        azel, pams = await asyncio.gather(
+                AsyncATARest.get('/antennas/1a,1c/azel'),
+                AsyncATARest.get('/antennas/1a,1c/pams'))
+
+    Any errors will cause a ATARestException to be raised.
+    """
+
+    # number of requests that can be in flight at the same time,
+    # None: the size of the ATARest connection pool when the workers
+    # are started (ATARest.configure(pool_maxsize=...) restarts them)
+    MAX_CONCURRENT = None
+
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    @classmethod
+    def _get_executor(cls):
+        with cls._executor_lock:
+            if cls._executor is None:
+                max_workers = cls.MAX_CONCURRENT
+                if max_workers is None:
+                    max_workers = ATARest.POOL_MAXSIZE
+                cls._executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=max_workers,
+                        thread_name_prefix='AsyncATARest')
+            return cls._executor
+
+    @classmethod
+    def _reset_executor(cls):
+        """
+        Start new workers on the next call, the running calls finish
+        on the old ones
+        """
+        with cls._executor_lock:
+            executor, cls._executor = cls._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    @classmethod
+    def shutdown(cls):
+        """
+        Stop the worker threads. They are recreated on the next call
+        """
+        with cls._executor_lock:
+            if cls._executor is not None:
+                cls._executor.shutdown(wait=True)
+                cls._executor = None
+
+    @classmethod
+    async def _do_op(cls, op, endpoint, **kwargs):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(ATARest._do_op, op, endpoint, **kwargs)
+        return await loop.run_in_executor(cls._get_executor(), call)
+
+    @classmethod
+    async def get(cls, endpoint, **kwargs):
+        """
+        HTTP GET operation on ATA REST API endpoint, see ATARest.get()
+        """
+        return await cls._do_op(ATARest._OP_GET, endpoint, **kwargs)
+
+    @classmethod
+    async def put(cls, endpoint, **kwargs):
+        """
+        HTTP PUT operation on ATA REST API endpoint, see ATARest.put()
+        """
+        return await cls._do_op(ATARest._OP_PUT, endpoint, **kwargs)
+
+    @classmethod
+    async def post(cls, endpoint, **kwargs):
+        """
+        HTTP POST operation on ATA REST API endpoint, see ATARest.post()
+        """
+        return await cls._do_op(ATARest._OP_POST, endpoint, **kwargs)
+
+    @classmethod
+    async def delete(cls, endpoint, **kwargs):
+        """
+        HTTP DELETE operation on ATA REST API endpoint, see ATARest.delete()
+        """
+        return await cls._do_op(ATARest._OP_DEL, endpoint, **kwargs)
+
 
 if __name__ == '__main__':
     print(ATARest.get('/antennas/1a/pams'))
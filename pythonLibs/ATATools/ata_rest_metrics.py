@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Latency/throughput instrumentation of the ATA REST calls.
+
+Every request sent by ATARest is recorded under its endpoint template,
+i.e. the endpoint with the antenna lists, LOs, groups etc. replaced by
+placeholders ('/antennas/1a,1c/azel' -> '/antennas/{ants}/azel'), so the
+numbers of a whole observing session can be compared per control call.
+
+    from ATATools import ata_rest_metrics
+
+    print(ata_rest_metrics.prometheus_text())   # Prometheus exposition format
+    stats = ata_rest_metrics.snapshot()          # JSON-serialisable dict
+
+    # how much of this block was spent waiting for the REST gateway?
+    with ata_rest_metrics.profile('start_recording') as prof:
+        snap_dada.start_recording(antlo_list, tobs)
+    print(prof.report())
+"""
+
+import json
+import re
+import threading
+import time
+
+from . import logger_defaults
+
+ENABLED = True
+
+# latency histogram upper bounds in seconds (Prometheus-style cumulative buckets)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+        10.0, 30.0, 60.0, 300.0)
+
+_METRIC_PREFIX = 'ata_rest'
+
+# (pattern, replacement) applied in order to turn an endpoint into a template
+_TEMPLATE_RULES = [
+    (re.compile(r'^/antennas/[^/]+'), '/antennas/{ants}'),
+    (re.compile(r'^/antenna/[^/]+'), '/antenna/{ant}'),
+    (re.compile(r'^/lo1/skyfreq/[^/]+'), '/lo1/skyfreq/{lo}'),
+    (re.compile(r'^/sa/ls/[^/]+'), '/sa/ls/{group}'),
+    (re.compile(r'^/sa/give/[^/]+/[^/]+/[^/]+'), '/sa/give/{from}/{to}/{ants}'),
+]
+
+
+def endpoint_template(endpoint):
+    """
+    Return the template of endpoint, e.g.
+    '/antennas/1a,1c/azel' -> '/antennas/{ants}/azel'
+    """
+    if not endpoint.startswith('/'):
+        endpoint = '/' + endpoint
+    endpoint = endpoint.split('?', 1)[0]
+    for pattern, replacement in _TEMPLATE_RULES:
+        endpoint, n = pattern.subn(replacement, endpoint)
+        if n:
+            break
+    return endpoint
+
+
+class _EndpointStats:
+    __slots__ = ('count', 'errors', 'latency_sum', 'latency_max', 'buckets',
+            'bytes_sent', 'bytes_received')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def add(self, latency, error, bytes_sent, bytes_received):
+        self.count += 1
+        if error:
+            self.errors += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        for ibucket, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                break
+        else:
+            ibucket = len(LATENCY_BUCKETS)
+        self.buckets[ibucket] += 1
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+
+    def as_dict(self):
+        cumulative = []
+        total = 0
+        for bound, n in zip(list(LATENCY_BUCKETS) + ['+Inf'], self.buckets):
+            total += n
+            cumulative.append([bound, total])
+        return {'count': self.count, 'errors': self.errors,
+                'latency_sum': self.latency_sum,
+                'latency_mean': self.latency_sum / self.count if self.count else 0.0,
+                'latency_max': self.latency_max,
+                'latency_buckets': cumulative,
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received}
+
+
+class RestMetrics:
+    """
+    Thread-safe collection of per-endpoint-template call statistics
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, op, template, latency, error=False, bytes_sent=0, bytes_received=0):
+        key = (op.upper(), template)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = _EndpointStats()
+                self._stats[key] = stats
+            stats.add(latency, error, bytes_sent, bytes_received)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def snapshot(self):
+        """
+        Return the statistics as a dictionary
+        {'GET /antennas/{ants}/azel': {'count': ..., 'latency_sum': ..., ...}}
+        """
+        with self._lock:
+            return {'{} {}'.format(op, template): stats.as_dict()
+                    for (op, template), stats in sorted(self._stats.items())}
+
+    def total_time(self):
+        """
+        Total time in seconds spent in REST calls
+        """
+        with self._lock:
+            return sum(stats.latency_sum for stats in self._stats.values())
+
+    def total_calls(self):
+        with self._lock:
+            return sum(stats.count for stats in self._stats.values())
+
+    def prometheus_text(self):
+        """
+        Return the statistics in the Prometheus text exposition format
+        """
+        p = _METRIC_PREFIX
+        lines = [
+            '# HELP {}_requests_total REST calls per endpoint template'.format(p),
+            '# TYPE {}_requests_total counter'.format(p),
+        ]
+        with self._lock:
+            items = sorted(self._stats.items())
+            for (op, template), stats in items:
+                lines.append('{}_requests_total{} {}'.format(p, _labels(op, template),
+                    stats.count))
+
+            lines.append('# HELP {}_errors_total failed REST calls per endpoint template'.format(p))
+            lines.append('# TYPE {}_errors_total counter'.format(p))
+            for (op, template), stats in items:
+                lines.append('{}_errors_total{} {}'.format(p, _labels(op, template),
+                    stats.errors))
+
+            lines.append('# HELP {}_request_duration_seconds REST call latency'.format(p))
+            lines.append('# TYPE {}_request_duration_seconds histogram'.format(p))
+            for (op, template), stats in items:
+                total = 0
+                for bound, n in zip(list(LATENCY_BUCKETS) + ['+Inf'], stats.buckets):
+                    total += n
+                    lines.append('{}_request_duration_seconds_bucket{} {}'.format(p,
+                        _labels(op, template, le=bound), total))
+                lines.append('{}_request_duration_seconds_sum{} {:.6f}'.format(p,
+                    _labels(op, template), stats.latency_sum))
+                lines.append('{}_request_duration_seconds_count{} {}'.format(p,
+                    _labels(op, template), stats.count))
+
+            for name, attr, helpstr in (('request_bytes', 'bytes_sent', 'request payload'),
+                    ('response_bytes', 'bytes_received', 'response payload')):
+                lines.append('# HELP {}_{}_total {} size in bytes'.format(p, name, helpstr))
+                lines.append('# TYPE {}_{}_total counter'.format(p, name))
+                for (op, template), stats in items:
+                    lines.append('{}_{}_total{} {}'.format(p, name, _labels(op, template),
+                        getattr(stats, attr)))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(op, template, le=None):
+    labels = 'method="{}",endpoint="{}"'.format(op, template.replace('"', '\\"'))
+    if le is not None:
+        labels += ',le="{}"'.format(le)
+    return '{' + labels + '}'
+
+
+class RestProfile:
+    """
+    REST statistics of one block of code, see profile()
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self.metrics = RestMetrics()
+        self.t_start = None
+        self.t_end = None
+
+    @property
+    def wall_time(self):
+        t_end = self.t_end if self.t_end is not None else time.monotonic()
+        return t_end - self.t_start
+
+    @property
+    def rest_time(self):
+        """
+        Summed duration of the REST calls. Can be more than wall_time
+        if the calls were made concurrently
+        """
+        return self.metrics.total_time()
+
+    def snapshot(self):
+        return {'name': self.name, 'wall_time': self.wall_time,
+                'rest_time': self.rest_time, 'calls': self.metrics.total_calls(),
+                'endpoints': self.metrics.snapshot()}
+
+    def report(self):
+        """
+        Return a human readable summary, the slowest endpoints first
+        """
+        lines = ['REST profile{}: {} calls, {:.3f} s REST time in {:.3f} s wall time ({:.0f}%)'.format(
+            ' of ' + self.name if self.name else '', self.metrics.total_calls(),
+            self.rest_time, self.wall_time,
+            100. * self.rest_time / self.wall_time if self.wall_time > 0 else 0.)]
+        endpoints = sorted(self.metrics.snapshot().items(),
+                key=lambda item: -item[1]['latency_sum'])
+        for endpoint, stats in endpoints:
+            lines.append('  {:<40s} {:5d} calls {:4d} errors {:9.3f} s total {:8.3f} s mean'.format(
+                endpoint, stats['count'], stats['errors'], stats['latency_sum'],
+                stats['latency_mean']))
+        return '\n'.join(lines)
+
+
+METRICS = RestMetrics()
+
+_profiles = []
+_profiles_lock = threading.Lock()
+
+
+def record(op, endpoint, latency, error=False, bytes_sent=0, bytes_received=0):
+    """
+    Record one REST call (called by ATARest)
+    """
+    if not ENABLED:
+        return
+    template = endpoint_template(endpoint)
+    METRICS.record(op, template, latency, error, bytes_sent, bytes_received)
+    if _profiles:
+        with _profiles_lock:
+            profiles = list(_profiles)
+        for prof in profiles:
+            prof.metrics.record(op, template, latency, error, bytes_sent, bytes_received)
+
+
+class profile:
+    """
+    Context manager collecting the REST calls made (by any thread)
+    while the block runs:
+
+        with ata_rest_metrics.profile('setup') as prof:
+            ...
+        print(prof.report())
+    """
+
+    def __init__(self, name=None, log=False):
+        self.prof = RestProfile(name)
+        self.log = log
+
+    def __enter__(self):
+        self.prof.t_start = time.monotonic()
+        with _profiles_lock:
+            _profiles.append(self.prof)
+        return self.prof
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.prof.t_end = time.monotonic()
+        with _profiles_lock:
+            _profiles.remove(self.prof)
+        if self.log:
+            logger = logger_defaults.getModuleLogger(__name__)
+            logger.info(self.prof.report())
+        return False
+
+
+def snapshot():
+    """
+    Return the process-wide statistics as a JSON-serialisable dictionary
+    """
+    return METRICS.snapshot()
+
+def to_json(**kwargs):
+    return json.dumps(snapshot(), **kwargs)
+
+def prometheus_text():
+    """
+    Return the process-wide statistics in the Prometheus text format
+    """
+    return METRICS.prometheus_text()
+
+def reset():
+    METRICS.reset()
@@ -0,0 +1,707 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-in for the ATA REST gateway (restgw.hcro.org:12345)
+
+Serves the endpoints used by ata_control, ata_sources and ata_pointing
+from an in-memory model of the array, with configurable latency, so the
+control layer can be exercised and benchmarked without the telescope.
+
+    from ATATools import ata_rest_mock, ata_control
+
+    with ata_rest_mock.MockRestGateway(latency=0.05, slew_time=1.0) as gw:
+        gw.install()  # point ATARest at the mock
+        ata_control.get_az_el(['1a', '1c'])
+        print(gw.calls)
+
+or as a stand-alone server (then set ATARest.HOST/PORT in the client):
+
+    python -m ATATools.ata_rest_mock --port 12345 --latency 0.05
+
+The answers are plausible rather than right: positions come from a
+made-up linear sky motion, ephemerides are straight lines etc.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import ata_constants, ata_ephem, logger_defaults
+from .ata_rest import ATARest
+
+LOS = ('a', 'b', 'c', 'd')
+ANT_GROUPS = ('none', 'bfa', 'maint')
+
+DEFAULT_PAM = 27.0
+DEFAULT_FREQ = 1400.0 #MHz
+
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+GZIP_MIN_SIZE = 1024 #bytes
+
+# placeholders of the endpoint templates
+_TEMPLATE_FIELDS = {name: r'(?P<{}>[^/]+)'.format(name)
+        for name in ('ants', 'ant', 'lo', 'group', 'src', 'dst')}
+
+
+def _source_position(name):
+    """
+    deterministic made-up (ra [h], dec [deg]) for a source name
+    """
+    digest = hashlib.md5(name.lower().encode()).digest()
+    ra = digest[0] / 255. * 24.
+    dec = -30. + digest[1] / 255. * 120.
+    return ra, dec
+
+
+def _source_az_el(name, t=None):
+    """
+    made-up (az, el) in degrees of a source, moving 15 deg/h in az
+    """
+    if t is None:
+        t = time.time()
+    ra, dec = _source_position(name)
+    az = (ra * 15. + t / 240.) % 360.
+    el = 20. + (dec + 30.) / 120. * 60.
+    return az, el
+
+
+class _ArrayState:
+    """
+    In-memory state of the mocked array
+    """
+
+    def __init__(self, antennas):
+        self.lock = threading.Lock()
+        self.antennas = list(antennas)
+        self.az_el = {ant: [0., 18.] for ant in self.antennas}
+        self.offsets = {ant: [0., 0.] for ant in self.antennas}
+        self.sources = {ant: 'none' for ant in self.antennas}
+        self.pams = {ant: {'x': DEFAULT_PAM, 'y': DEFAULT_PAM} for ant in self.antennas}
+        self.lnas = {ant: True for ant in self.antennas}
+        self.focus = {ant: DEFAULT_FREQ for ant in self.antennas}
+        self.skyfreq = {lo: DEFAULT_FREQ for lo in LOS}
+        self.groups = {group: [] for group in ANT_GROUPS}
+        self.groups['none'] = list(self.antennas)
+        self.pointing_models = {}
+        self.ephemerides = {}
+        self.ephemeris_sources = {}
+        self.windsocking = False
+        self.alarm = None
+        self._next_ephem_id = 1
+
+    def new_ephemeris_id(self):
+        # caller holds the lock
+        ephem_id = 'mock{:06d}'.format(self._next_ephem_id)
+        self._next_ephem_id += 1
+        return ephem_id
+
+
+class MockRestGateway:
+    """
+    Threaded HTTP server answering like the ATA REST gateway.
+
+    :param host, port: where to listen. port=0 picks a free port
+    :param latency: mean response time of a request in seconds
+    :param jitter: the response time is drawn uniformly from
+        latency * [1 - jitter, 1 + jitter]
+    :param per_antenna_latency: additional time per antenna for the
+        /antennas/{ants}/... endpoints (the gateway queries each antenna)
+    :param slew_time: time that calls with wait=True (track, azel, park)
+        take to return
+    :param error_rate: fraction of requests answered with a 503
+    :param antennas: antenna names of the mocked array
+    :param binary_ephemeris: answer GET /ephemeris with packed
+        ata_ephem.EPHEM_DTYPE records if the client accepts them
+    :param gzip_responses: gzip-compress large responses if the client
+        accepts it
+
+    The number of requests per endpoint template is counted in `calls`
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.03, jitter=0.3,
+            per_antenna_latency=0.0, slew_time=0.0, error_rate=0.0,
+            antennas=None, binary_ephemeris=False, gzip_responses=False):
+        self.latency = latency
+        self.jitter = jitter
+        self.per_antenna_latency = per_antenna_latency
+        self.slew_time = slew_time
+        self.error_rate = error_rate
+        self.binary_ephemeris = binary_ephemeris
+        self.gzip_responses = gzip_responses
+
+        self.state = _ArrayState(antennas or ata_constants.ant_names)
+        self.calls = {}
+        self._calls_lock = threading.Lock()
+        self._routes = self._make_routes()
+
+        handler = type('Handler', (_RequestHandler,), {'gateway': self})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = None
+        self._installed = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        """
+        Serve requests from a background thread
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever,
+                    name='MockRestGateway', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self.uninstall()
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def install(self):
+        """
+        Point ATARest to this server, until uninstall() or stop()
+        """
+        if self._installed is None:
+            self._installed = (ATARest.HOST, ATARest.PORT)
+        ATARest.HOST = self.host
+        ATARest.PORT = self.port
+        ATARest.close()
+
+    def uninstall(self):
+        if self._installed is not None:
+            ATARest.HOST, ATARest.PORT = self._installed
+            self._installed = None
+            ATARest.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def reset_calls(self):
+        with self._calls_lock:
+            self.calls.clear()
+
+    def total_calls(self):
+        with self._calls_lock:
+            return sum(self.calls.values())
+
+    def set_windsocking(self, active):
+        with self.state.lock:
+            self.state.windsocking = bool(active)
+
+    def set_pointing_model(self, ant, coeffs):
+        """
+        Change (some of) the TPOINT coefficients of ant, as after
+        a pointing campaign
+        """
+        with self.state.lock:
+            self.state.pointing_models.setdefault(ant, {}).update(coeffs)
+
+    #
+    # request dispatching
+    #
+
+    def _make_routes(self):
+        routes = [
+            ('GET',    r'/antennas/{ants}/azel',      self._get_az_el),
+            ('PUT',    r'/antennas/{ants}/azel',      self._put_az_el),
+            ('GET',    r'/antennas/{ants}/radec',     self._get_ra_dec),
+            ('GET',    r'/antennas/{ants}/sources',   self._get_sources),
+            ('PUT',    r'/antennas/{ants}/track',     self._put_track),
+            ('PUT',    r'/antennas/{ants}/offset',    self._put_offset),
+            ('PUT',    r'/antennas/{ants}/park',      self._put_park),
+            ('GET',    r'/antennas/{ants}/pams',      self._get_pams),
+            ('GET',    r'/antennas/{ants}/det',       self._get_dets),
+            ('GET',    r'/antennas/{ants}/focus',     self._get_focus),
+            ('PUT',    r'/antennas/{ants}/focus',     self._put_focus),
+            ('GET',    r'/antennas/{ants}/locations', self._get_locations),
+            ('PUT',    r'/antennas/{ants}/autotune2', self._put_ok),
+            ('PUT',    r'/antenna/{ant}/pams',        self._put_pams),
+            ('GET',    r'/antenna/{ant}/lnas',        self._get_lnas),
+            ('PUT',    r'/antenna/{ant}/lnas',        self._put_ok),
+            ('GET',    r'/antenna/{ant}/pm',          self._get_pointing_model),
+            ('GET',    r'/lo1/skyfreq/{lo}',          self._get_sky_freq),
+            ('PUT',    r'/lo1/skyfreq/{lo}',          self._put_sky_freq),
+            ('POST',   r'/ephemeris',                 self._post_ephemeris),
+            ('GET',    r'/ephemeris',                 self._get_ephemeris),
+            ('PUT',    r'/ephemeris',                 self._put_ephemeris),
+            ('GET',    r'/source',                    self._get_source),
+            ('GET',    r'/satellites',                self._get_satellites),
+            ('GET',    r'/windsocking',               self._get_windsocking),
+            ('GET',    r'/sa/ls/{group}',             self._get_group),
+            ('PUT',    r'/sa/give/{src}/{dst}/{ants}', self._put_give),
+            ('GET',    r'/status',                    self._get_status),
+            ('GET',    r'/alarm',                     self._get_alarm),
+            ('PUT',    r'/alarm',                     self._put_alarm),
+            ('DELETE', r'/alarm',                     self._delete_alarm),
+        ]
+        return [(op, template, re.compile('^' + template.format(**_TEMPLATE_FIELDS) + '$'), func)
+                for op, template, func in routes]
+
+    def _dispatch(self, op, path, body):
+        """
+        Return (status code, JSON-serialisable reply)
+        """
+        for route_op, template, pattern, func in self._routes:
+            match = pattern.match(path)
+            if match is None or route_op != op:
+                continue
+            with self._calls_lock:
+                key = '{} {}'.format(op, template)
+                self.calls[key] = self.calls.get(key, 0) + 1
+
+            args = match.groupdict()
+            if 'ants' in args:
+                args['ants'] = args['ants'].split(',')
+            self._delay(len(args.get('ants', ())))
+            if self.error_rate and random.random() < self.error_rate:
+                return 503, {'message': 'mock: injected error'}
+            try:
+                return 200, func(body, **args)
+            except KeyError as e:
+                return 400, {'message': 'unknown {}'.format(str(e))}
+            except ValueError as e:
+                return 400, {'message': str(e)}
+        return 404, {'message': 'mock: no endpoint {} {}'.format(op, path)}
+
+    def _delay(self, nants):
+        delay = self.latency + nants * self.per_antenna_latency
+        if self.jitter:
+            delay *= random.uniform(1. - self.jitter, 1. + self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _wait(self, body):
+        if _truthy(body.get('wait', False)) and self.slew_time > 0:
+            time.sleep(self.slew_time)
+
+    def _check_ants(self, ants):
+        unknown = [ant for ant in ants if ant not in self.state.az_el]
+        if unknown:
+            raise KeyError(','.join(unknown))
+
+    #
+    # endpoints
+    #
+
+    def _get_az_el(self, body, ants):
+        self._check_ants(ants)
+        with self.state.lock:
+            return {ant: {'az': self.state.az_el[ant][0] + self.state.offsets[ant][0],
+                          'el': self.state.az_el[ant][1] + self.state.offsets[ant][1]}
+                    for ant in ants}
+
+    def _put_az_el(self, body, ants):
+        self._check_ants(ants)
+        az, el = float(body['az']), float(body['el'])
+        with self.state.lock:
+            for ant in ants:
+                self.state.az_el[ant] = [az, el]
+                self.state.sources[ant] = 'azel'
+        self._wait(body)
+        return {}
+
+    def _get_ra_dec(self, body, ants):
+        self._check_ants(ants)
+        with self.state.lock:
+            sources = {ant: self.state.sources[ant] for ant in ants}
+        retdict = {}
+        for ant, source in sources.items():
+            ra, dec = _source_position(source)
+            retdict[ant] = {'ra': ra, 'dec': dec}
+        return retdict
+
+    def _get_sources(self, body, ants):
+        self._check_ants(ants)
+        with self.state.lock:
+            return {ant: self.state.sources[ant] for ant in ants}
+
+    def _put_track(self, body, ants):
+        self._check_ants(ants)
+        # the id can also be a source name, tracked with an on-the-fly ephemeris
+        ephem_id = body['id']
+        with self.state.lock:
+            if ephem_id in self.state.ephemerides:
+                source = self.state.ephemeris_sources[ephem_id]
+                az, el = _interpolate(self.state.ephemerides[ephem_id], time.time() * 1e9)
+            else:
+                source = ephem_id
+                az, el = _source_az_el(source)
+            for ant in ants:
+                self.state.az_el[ant] = [az, el]
+                self.state.sources[ant] = source
+                if 'azel' in body:
+                    self.state.offsets[ant] = [float(v) for v in body['azel']]
+                elif 'xoffset' in body:
+                    xel, el_off = [float(v) for v in body['xoffset']]
+                    self.state.offsets[ant] = [xel / max(math.cos(math.radians(el)), 1e-3), el_off]
+        self._wait(body)
+        return {}
+
+    def _put_offset(self, body, ants):
+        self._check_ants(ants)
+        offset = [float(v) for v in body['azel']]
+        with self.state.lock:
+            for ant in ants:
+                self.state.offsets[ant] = offset
+        return {}
+
+    def _put_park(self, body, ants):
+        self._check_ants(ants)
+        with self.state.lock:
+            for ant in ants:
+                self.state.az_el[ant] = [0., 18.]
+                self.state.offsets[ant] = [0., 0.]
+                self.state.sources[ant] = 'none'
+        self._wait(body)
+        return {}
+
+    def _get_pams(self, body, ants):
+        self._check_ants(ants)
+        with self.state.lock:
+            return {ant: {pol: {'front': self.state.pams[ant][pol], 'back': 0.0}
+                          for pol in ('x', 'y')}
+                    for ant in ants}
+
+    def _put_pams(self, body, ant):
+        self._check_ants([ant])
+        with self.state.lock:
+            for pol in ('x', 'y'):
+                if pol in body:
+                    self.state.pams[ant][pol] = float(body[pol]['value'])
+        return {}
+
+    def _get_dets(self, body, ants):
+        self._check_ants(ants)
+        with self.state.lock:
+            # detector power drops with the attenuation
+            return {ant: {pol: 10. ** ((-self.state.pams[ant][pol] + 20.) / 10.)
+                          for pol in ('x', 'y')}
+                    for ant in ants}
+
+    def _get_focus(self, body, ants):
+        self._check_ants(ants)
+        with self.state.lock:
+            return {ant: self.state.focus[ant] for ant in ants}
+
+    def _put_focus(self, body, ants):
+        self._check_ants(ants)
+        value = float(body['value'])
+        with self.state.lock:
+            for ant in ants:
+                self.state.focus[ant] = value
+        return {}
+
+    def _get_locations(self, body, ants):
+        self._check_ants(ants)
+        retdict = {}
+        for ant in ants:
+            digest = hashlib.md5(ant.encode()).digest()
+            retdict[ant] = {'N': digest[0] - 128., 'E': digest[1] - 128.,
+                    'U': digest[2] / 100.}
+        return retdict
+
+    def _get_lnas(self, body, ant):
+        self._check_ants([ant])
+        with self.state.lock:
+            return {'on': self.state.lnas[ant]}
+
+    def _get_pointing_model(self, body, ant):
+        self._check_ants([ant])
+        digest = hashlib.md5(('pm' + ant).encode()).digest()
+        coeffs = ['IA', 'AN', 'AW', 'CA', 'NPAE', 'ACES', 'ACEC', 'HASA2', 'HACA2',
+                'IE', 'ECES', 'ECEC']
+        pointing_model = {name: (digest[i] - 128.) * 2. for i, name in enumerate(coeffs)}
+        pointing_model['NPAE'] = 0.0
+        pointing_model.update({'AzOffset': 0.0, 'ElOffset': 0.0})
+        with self.state.lock:
+            pointing_model.update(self.state.pointing_models.get(ant, {}))
+        return pointing_model
+
+    def _get_sky_freq(self, body, lo):
+        lo = lo.lower()
+        with self.state.lock:
+            return {lo: self.state.skyfreq[lo]}
+
+    def _put_sky_freq(self, body, lo):
+        lo = lo.lower()
+        value = float(body['value'])
+        with self.state.lock:
+            if lo not in self.state.skyfreq:
+                raise KeyError(lo)
+            self.state.skyfreq[lo] = value
+        return {}
+
+    def _post_ephemeris(self, body):
+        kinds = [kind for kind in ('source', 'radec', 'azel', 'tle') if kind in body]
+        if len(kinds) != 1:
+            raise ValueError('exactly one of source, radec, azel or tle required')
+        kind = kinds[0]
+        if kind == 'source':
+            name = body['source']
+            az, el = _source_az_el(name)
+            rate = 1. / 240.
+        elif kind == 'radec':
+            name = 'radec'
+            az, el = _source_az_el('{:.4f},{:.4f}'.format(*body['radec']))
+            rate = 1. / 240.
+        elif kind == 'azel':
+            name = 'azel'
+            az, el = [float(v) for v in body['azel']]
+            rate = 0.
+        else:
+            name = body['tle'].strip().split('\n')[0].strip()
+            az, el = _source_az_el(name)
+            rate = 0.5 / 60.
+
+        interval = float(body.get('interval', 1))
+        duration = float(body.get('duration', 12))
+        npoints = max(2, int(duration * 3600. / interval) + 1)
+        t0 = time.time()
+        points = [[int((t0 + i * interval) * 1e9), (az + i * interval * rate) % 360., el, 0.0]
+                for i in range(npoints)]
+        with self.state.lock:
+            ephem_id = self.state.new_ephemeris_id()
+            self.state.ephemerides[ephem_id] = points
+            self.state.ephemeris_sources[ephem_id] = name
+        return {'id': ephem_id}
+
+    def _get_ephemeris(self, body):
+        with self.state.lock:
+            return _EphemerisPoints(self.state.ephemerides[body['id']])
+
+    def _put_ephemeris(self, body):
+        points = []
+        for line in body['ephemeris_data'].splitlines():
+            cols = line.split()
+            if len(cols) < 3 or line.lstrip().startswith('#'):
+                continue
+            points.append([int(float(cols[0])), float(cols[1]), float(cols[2]),
+                float(cols[3]) if len(cols) > 3 else 0.0])
+        if not points:
+            raise ValueError('empty ephemeris')
+        with self.state.lock:
+            ephem_id = self.state.new_ephemeris_id()
+            self.state.ephemerides[ephem_id] = points
+            self.state.ephemeris_sources[ephem_id] = body.get('ephemeris_filename', ephem_id)
+        return {'id': ephem_id}
+
+    def _get_source(self, body):
+        name = body['source']
+        ra, dec = _source_position(name)
+        az, el = _source_az_el(name)
+        now = int(time.time())
+        return {'object': name, 'ra': ra, 'dec': dec, 'az': az, 'el': el,
+                'is_up': el > 16.5, 'rise_time_posix': now - 3600,
+                'set_time_posix': now + 3600}
+
+    def _get_satellites(self, body):
+        sats = []
+        for i in range(1, 13):
+            name = 'GPS-MOCK-{:02d}--PRN-{:02d}-'.format(i, i)
+            az, el = _source_az_el(name)
+            sats.append({'name': name, 'az': '{:.3f}'.format(az),
+                'el': '{:.3f}'.format(el),
+                'state': 'Rising' if i % 2 else 'Setting'})
+        return {'GPS': sats}
+
+    def _get_windsocking(self, body):
+        with self.state.lock:
+            return {'windsocking_active': self.state.windsocking}
+
+    def _get_group(self, body, group):
+        with self.state.lock:
+            return list(self.state.groups[group])
+
+    def _put_give(self, body, src, dst, ants):
+        with self.state.lock:
+            missing = [ant for ant in ants if ant not in self.state.groups[src]]
+            if missing:
+                raise ValueError('{} not in group {}'.format(','.join(missing), src))
+            for ant in ants:
+                self.state.groups[src].remove(ant)
+                self.state.groups[dst].append(ant)
+        return {}
+
+    def _get_status(self, body):
+        return {'status': 'mock REST gateway, {} antennas'.format(len(self.state.antennas))}
+
+    def _get_alarm(self, body):
+        with self.state.lock:
+            return self.state.alarm or {}
+
+    def _put_alarm(self, body):
+        with self.state.lock:
+            self.state.alarm = {'user': body.get('user'), 'reason': body.get('reason')}
+        return {}
+
+    def _delete_alarm(self, body):
+        with self.state.lock:
+            self.state.alarm = None
+        return {}
+
+    def _put_ok(self, body, **kwargs):
+        return {}
+
+
+def _truthy(value):
+    if isinstance(value, str):
+        return value.lower() in ('true', '1', 'yes')
+    return bool(value)
+
+
+class _EphemerisPoints(list):
+    """
+    marks a reply that can be sent in the binary ephemeris format
+    """
+    pass
+
+
+def _interpolate(points, t_ns):
+    """
+    (az, el) of the ephemeris point closest to t_ns
+    """
+    closest = min(points, key=lambda point: abs(point[0] - t_ns))
+    return closest[1], closest[2]
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    gateway = None
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self, op):
+        url = urllib.parse.urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            body = self._decode_body(raw)
+        except ValueError as e:
+            self._reply(400, {'message': 'bad request body: {}'.format(str(e))})
+            return
+        # query string arguments, if any, are treated like form data
+        for key, values in urllib.parse.parse_qs(url.query).items():
+            body.setdefault(key, values[-1])
+
+        status, reply = self.gateway._dispatch(op, url.path, body)
+        self._reply(status, reply)
+
+    def _decode_body(self, raw):
+        if not raw:
+            return {}
+        content_type = self.headers.get('Content-Type', '')
+        if 'json' in content_type:
+            body = json.loads(raw.decode())
+            if not isinstance(body, dict):
+                raise ValueError('expected a JSON object')
+            return body
+        return {key: values[-1] for key, values in
+                urllib.parse.parse_qs(raw.decode(), keep_blank_values=True).items()}
+
+    def _reply(self, status, reply):
+        content_type = 'application/json'
+        if (isinstance(reply, _EphemerisPoints) and self.gateway.binary_ephemeris
+                and BINARY_CONTENT_TYPE in self.headers.get('Accept', '')):
+            content_type = BINARY_CONTENT_TYPE
+            data = ata_ephem.to_ephem_array(reply).tobytes()
+        else:
+            data = json.dumps(reply).encode()
+
+        etag = None
+        if self.command == 'GET' and status == 200:
+            etag = '"{}"'.format(hashlib.sha1(data).hexdigest())
+            if etag in [t.strip() for t in self.headers.get('If-None-Match', '').split(',')]:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+        content_encoding = None
+        if (self.gateway.gzip_responses and len(data) > GZIP_MIN_SIZE
+                and 'gzip' in self.headers.get('Accept-Encoding', '')):
+            content_encoding = 'gzip'
+            data = gzip.compress(data, compresslevel=1)
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if etag:
+            self.send_header('ETag', etag)
+        if content_encoding:
+            self.send_header('Content-Encoding', content_encoding)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def log_message(self, format, *args):
+        logger = logger_defaults.getModuleLogger(__name__)
+        logger.debug(format % args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the ATA REST gateway')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=ATARest.PORT)
+    parser.add_argument('--latency', type=float, default=0.03,
+            help='mean request latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.3,
+            help='relative latency jitter')
+    parser.add_argument('--per-antenna-latency', type=float, default=0.0,
+            help='additional latency per antenna in seconds')
+    parser.add_argument('--slew-time', type=float, default=0.0,
+            help='duration of calls with wait=True in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+            help='fraction of requests answered with a 503')
+    parser.add_argument('--binary-ephemeris', action='store_true',
+            help='send ephemerides in the packed binary format if accepted')
+    parser.add_argument('--gzip', action='store_true',
+            help='gzip large responses if accepted')
+    args = parser.parse_args()
+
+    gateway = MockRestGateway(args.host, args.port, args.latency, args.jitter,
+            args.per_antenna_latency, args.slew_time, args.error_rate,
+            binary_ephemeris=args.binary_ephemeris, gzip_responses=args.gzip)
+    print('mock REST gateway on http://{}:{}'.format(gateway.host, gateway.port))
+    try:
+        gateway.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
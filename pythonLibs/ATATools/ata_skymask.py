@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Precomputed Sun/Moon/geostationary-belt avoidance masks of the sky.
+
+A SkyMask covers one "night" (the 24 hours from local mean noon at the
+ATA) on a J2000 ra/dec grid:
+
+  * the Sun and Moon exclusion zones, one bit plane every step seconds
+    (they move slowly in ra/dec, unlike in az/el),
+  * the geostationary belt exclusion zone, which is fixed in hour angle
+    and declination, so one static plane is enough.
+
+Once computed, a mask is saved (as packed bits) under
+ata_cache.CACHE_DIR/skymask, so checking whether a source is too close
+to the Sun, Moon or the GEO satellites is a table lookup:
+
+    from ATATools import ata_skymask
+
+    mask = ata_skymask.get_night_mask()             # tonight, loaded or computed
+    mask.excluded(ra_hours, dec_deg, unix_times)    # (N, M) bool, True = avoid
+    mask.excluded(ra_hours, dec_deg, unix_times, geo=False)   # Sun/Moon only
+
+The zones are widened by the pixel size, the time step and (for the GEO
+belt) the precession since J2000, so the mask can exclude slightly more
+than the exact distances, never less.
+"""
+
+import datetime as dt
+import math
+import os
+import tempfile
+import threading
+
+import ephem
+import numpy as np
+from scipy.spatial import cKDTree
+
+from . import ata_cache
+from . import ata_constants as ata_const
+from . import ata_positions, logger_defaults
+
+SKYMASK_DIR = os.path.join(ata_cache.CACHE_DIR, 'skymask')
+
+SKYMASK_STEP = 600.0 #seconds
+SKYMASK_RESOLUTION = 1.0 #degrees
+SKYMASK_DURATION = 86400.0 #seconds
+
+# half-width of the geostationary belt exclusion zone
+GEO_AVOID_DIST = 5.0 #degrees
+
+_GEO_RADIUS = 42164.17 #km
+_WGS84_A = 6378.137 #km
+_WGS84_F = 1.0 / 298.257223563
+
+# bound on the J2000 -> date precession in the GEO lookup (~0.014 deg/yr)
+_GEO_PRECESSION_PAD = 0.6 #degrees
+
+_FORMAT_VERSION = 1
+
+
+def night_start(d=None):
+    """
+    Unix time of the local mean noon at the ATA starting the night of d
+    (datetime, naive is UTC, or unix time; default now): the last noon
+    at or before d
+    """
+    if d is None:
+        d = dt.datetime.now(dt.timezone.utc)
+    noon_offset = (12.0 - ata_const.ATA_LON / 15.0) * 3600.0
+    t = ata_positions._to_unix(d)
+    return math.floor((t - noon_offset) / 86400.0) * 86400.0 + noon_offset
+
+def _pixel_vectors(nlat, nlon, resolution):
+    """
+    unit vectors of the pixel centres of a (nlat, nlon) grid, flattened
+    """
+    lat = np.radians(-90.0 + resolution * (np.arange(nlat) + 0.5))
+    lon = np.radians(resolution * (np.arange(nlon) + 0.5))
+    lat, lon = np.meshgrid(lat, lon, indexing='ij')
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon),
+        np.sin(lat)], axis=-1).reshape(-1, 3)
+
+def _chord(radius):
+    return 2.0 * math.sin(math.radians(min(radius, 180.0)) / 2.0)
+
+def _geo_belt_hadec(step=0.25):
+    """
+    Topocentric hour angle and declination (degrees) of the points of
+    the geostationary belt above the ATA horizon
+    """
+    lat = math.radians(ata_const.ATA_LAT)
+    e2 = _WGS84_F * (2.0 - _WGS84_F)
+    n = _WGS84_A / math.sqrt(1.0 - e2 * math.sin(lat)**2)
+    h = ata_const.ATA_ELEV / 1000.0
+    # in the frame rotating with the Earth, x axis at the ATA meridian
+    site = np.array([(n + h) * math.cos(lat), 0.0, (n * (1.0 - e2) + h) * math.sin(lat)])
+
+    dlon = np.radians(np.arange(-90.0, 90.0 + step, step))
+    sat = np.stack([_GEO_RADIUS * np.cos(dlon), _GEO_RADIUS * np.sin(dlon),
+        np.zeros_like(dlon)], axis=-1)
+    v = sat - site
+    v /= np.linalg.norm(v, axis=-1)[:, np.newaxis]
+    zenith = np.array([math.cos(lat), 0.0, math.sin(lat)])
+    above = v @ zenith > 0.0
+    v = v[above]
+    # hour angle increases westwards
+    ha = np.degrees(-np.arctan2(v[:, 1], v[:, 0])) % 360.0
+    dec = np.degrees(np.arcsin(v[:, 2]))
+    return ha, dec
+
+def _to_j2000(vectors, unix_times):
+    """
+    rotate (M, 3) vectors of date at the M unix times to J2000
+    """
+    jd = np.asarray(unix_times, dtype=np.float64) / 86400.0 + ata_positions._UNIX_EPOCH_JD
+    return np.einsum('mji,mj->mi', ata_positions._precession_matrices(jd), vectors)
+
+def _solar_system_vectors(name, unix_times):
+    """
+    apparent topocentric J2000 unit vectors (M, 3) of the Sun or Moon
+    """
+    observer = ephem.Observer()
+    observer.lat = ata_const.ATA_LAT * math.pi/180.0
+    observer.lon = ata_const.ATA_LON * math.pi/180.0
+    observer.elev = ata_const.ATA_ELEV
+    body = ata_positions.SOLAR_SYSTEM[name]()
+    v = np.empty((len(unix_times), 3))
+    for i, t in enumerate(unix_times):
+        observer.date = t / 86400.0 + 25567.5
+        body.compute(observer)
+        ra, dec = float(body.ra), float(body.dec)
+        v[i] = (math.cos(dec) * math.cos(ra), math.cos(dec) * math.sin(ra), math.sin(dec))
+    return _to_j2000(v, unix_times)
+
+
+class SkyMask:
+    """
+    Sun/Moon (time dependent) and GEO belt (static) exclusion masks
+
+    Attributes:
+        t0: unix time of the first time step
+        step: time step in seconds
+        ntimes: number of time steps, the mask covers [t0, t0 + ntimes*step)
+        resolution: pixel size in degrees
+        min_sun_moon_dist: Sun/Moon exclusion radius in degrees
+        geo_dist: half-width of the GEO belt exclusion zone in degrees
+    """
+
+    def __init__(self, t0, step, resolution, min_sun_moon_dist, geo_dist,
+            sun_moon_bits, geo_bits, ntimes):
+        self.t0 = float(t0)
+        self.step = float(step)
+        self.ntimes = int(ntimes)
+        self.resolution = float(resolution)
+        self.min_sun_moon_dist = float(min_sun_moon_dist)
+        self.geo_dist = float(geo_dist)
+        self.ndec = int(round(180.0 / self.resolution))
+        self.nra = int(round(360.0 / self.resolution))
+        # packed bits (np.packbits order), indexed [time, dec, ra] and [dec, ha]
+        self._sun_moon = sun_moon_bits
+        self._geo = geo_bits
+
+    @classmethod
+    def compute(cls, t0, duration=SKYMASK_DURATION, step=SKYMASK_STEP,
+            resolution=SKYMASK_RESOLUTION,
+            min_sun_moon_dist=ata_positions.MIN_MOON_SUN_DIST,
+            geo_dist=GEO_AVOID_DIST):
+        """
+        Compute the masks for duration seconds from unix time t0
+        """
+        ndec = int(round(180.0 / resolution))
+        nra = int(round(360.0 / resolution))
+        ntimes = int(math.ceil(duration / step))
+        pixels = _pixel_vectors(ndec, nra, resolution)
+        tree = cKDTree(pixels)
+        pixel_pad = resolution * math.sqrt(2.0) / 2.0
+
+        # the time steps are looked up by nearest step, so the zones
+        # are widened by half of the largest motion between two steps
+        unix_times = t0 + step * np.arange(ntimes + 1)
+        planes = np.zeros((ntimes, ndec * nra), dtype=bool)
+        for name in ('sun', 'moon'):
+            v = _solar_system_vectors(name, unix_times)
+            motion = np.degrees(np.arccos(np.clip(np.sum(v[1:] * v[:-1], axis=1), -1.0, 1.0)))
+            chord = _chord(min_sun_moon_dist + pixel_pad + motion.max() / 2.0)
+            for itime, rows in enumerate(tree.query_ball_point(v[:-1], chord)):
+                planes[itime, rows] = True
+
+        ha, dec = _geo_belt_hadec(step=resolution / 4.0)
+        belt = np.stack([np.cos(np.radians(dec)) * np.cos(np.radians(ha)),
+            np.cos(np.radians(dec)) * np.sin(np.radians(ha)),
+            np.sin(np.radians(dec))], axis=-1)
+        geo = np.zeros(ndec * nra, dtype=bool)
+        chord = _chord(geo_dist + pixel_pad + _GEO_PRECESSION_PAD)
+        for rows in tree.query_ball_point(belt, chord):
+            geo[rows] = True
+
+        return cls(t0, step, resolution, min_sun_moon_dist, geo_dist,
+                np.packbits(planes.ravel()), np.packbits(geo), ntimes)
+
+    def covers(self, unix_times):
+        """
+        True if all the unix times are within the mask
+        """
+        unix_times = np.asarray(unix_times, dtype=np.float64)
+        return bool(len(unix_times) == 0 or (unix_times.min() >= self.t0
+            and unix_times.max() < self.t0 + self.ntimes * self.step))
+
+    def _pixels(self, lon_deg, dec_deg):
+        idec = np.clip(((dec_deg + 90.0) / self.resolution).astype(np.intp), 0, self.ndec - 1)
+        ilon = ((lon_deg % 360.0) / self.resolution).astype(np.intp) % self.nra
+        return idec * self.nra + ilon
+
+    @staticmethod
+    def _bits(packed, index):
+        return (packed[index >> 3] >> (7 - (index & 7))) & 1 == 1
+
+    def excluded(self, ra, dec, unix_times, sun_moon=True, geo=True):
+        """
+        Whether J2000 positions are in an exclusion zone
+
+        :param ra: array of N right ascensions in hours
+        :param dec: array of N declinations in degrees
+        :param unix_times: array of M unix times
+        :param sun_moon: check the Sun and Moon zones
+        :param geo: check the geostationary belt zone
+        :returns (N, M) bool array, True if the position is to be avoided
+        :raises ValueError if the mask doesn't cover the times
+        """
+        ra = np.atleast_1d(np.asarray(ra, dtype=np.float64))[:, np.newaxis]
+        dec = np.atleast_1d(np.asarray(dec, dtype=np.float64))[:, np.newaxis]
+        unix_times = np.atleast_1d(np.asarray(unix_times, dtype=np.float64))
+        if not self.covers(unix_times):
+            raise ValueError('sky mask does not cover the requested times')
+
+        out = np.zeros((ra.shape[0], len(unix_times)), dtype=bool)
+        if sun_moon:
+            itime = np.minimum(np.rint((unix_times - self.t0) / self.step).astype(np.intp),
+                    self.ntimes - 1)
+            index = itime * (self.ndec * self.nra) + self._pixels(ra * 15.0, dec)
+            out |= self._bits(self._sun_moon, index)
+        if geo:
+            jd = unix_times / 86400.0 + ata_positions._UNIX_EPOCH_JD
+            lst = np.degrees(ata_positions._local_sidereal_time(jd))
+            out |= self._bits(self._geo, self._pixels(lst - ra * 15.0, dec))
+        return out
+
+    def save(self, filename):
+        """
+        Save the mask (atomically) to filename (.npz)
+        """
+        dirname = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.skymask', suffix='.npz')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, version=_FORMAT_VERSION,
+                        params=np.array([self.t0, self.step, self.resolution,
+                            self.min_sun_moon_dist, self.geo_dist, self.ntimes]),
+                        sun_moon=self._sun_moon, geo=self._geo)
+            os.replace(tmpname, filename)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            if int(data['version']) != _FORMAT_VERSION:
+                raise ValueError('{}: unsupported sky mask format'.format(filename))
+            t0, step, resolution, min_dist, geo_dist, ntimes = data['params']
+            return cls(t0, step, resolution, min_dist, geo_dist,
+                    data['sun_moon'], data['geo'], ntimes)
+
+
+_masks = {}
+_masks_lock = threading.Lock()
+
+def mask_filename(t0, step=SKYMASK_STEP, resolution=SKYMASK_RESOLUTION,
+        min_sun_moon_dist=ata_positions.MIN_MOON_SUN_DIST, geo_dist=GEO_AVOID_DIST):
+    night = dt.datetime.fromtimestamp(t0, dt.timezone.utc).strftime('%Y%m%d')
+    return os.path.join(SKYMASK_DIR, 'skymask_{}_{:g}s_{:g}deg_{:g}_{:g}.npz'.format(
+        night, step, resolution, min_sun_moon_dist, geo_dist))
+
+def get_night_mask(d=None, step=SKYMASK_STEP, resolution=SKYMASK_RESOLUTION,
+        min_sun_moon_dist=ata_positions.MIN_MOON_SUN_DIST, geo_dist=GEO_AVOID_DIST):
+    """
+    Return the SkyMask of the night of d (see night_start), loaded from
+    SKYMASK_DIR, or computed and saved there if not done yet
+    """
+    logger = logger_defaults.getModuleLogger(__name__)
+    t0 = night_start(d)
+    filename = mask_filename(t0, step, resolution, min_sun_moon_dist, geo_dist)
+    with _masks_lock:
+        mask = _masks.get(filename)
+        if mask is not None:
+            return mask
+        try:
+            mask = SkyMask.load(filename)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning('ignoring sky mask {}: {}'.format(filename, str(e)))
+        if mask is None:
+            mask = SkyMask.compute(t0, SKYMASK_DURATION, step, resolution,
+                    min_sun_moon_dist, geo_dist)
+            try:
+                mask.save(filename)
+            except OSError as e:
+                logger.warning('failed to save sky mask {}: {}'.format(filename, str(e)))
+        _masks[filename] = mask
+        return mask
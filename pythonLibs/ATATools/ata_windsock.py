@@ -0,0 +1,270 @@
+"""
+Process-wide windsocking watcher
+
+A single background thread polls the control system windsocking status
+for all the subscribers of the process (callbacks and queues), instead
+of one poller per observer:
+
+    from ATATools import ata_windsock
+
+    watcher = ata_windsock.get_watcher()
+    watcher.subscribe(my_callback)        # my_callback(is_windsocking)
+    events = watcher.subscribe_queue()    # (is_windsocking, unix_time)
+
+    # or, in a long recording:
+    events = watcher.wait(tobs, abort_on_stow=True)
+
+The polling is adaptive: every POLL_INTERVAL_CALM seconds when the
+antennas have not been stowed for a while, every POLL_INTERVAL_ALERT
+seconds while windsocking and for ALERT_HOLD seconds after a change
+(wind gusts usually come in bursts near the threshold).
+"""
+
+import queue
+import threading
+import time
+
+from . import logger_defaults
+
+
+POLL_INTERVAL_CALM = 15.0 #seconds
+POLL_INTERVAL_ALERT = 2.0 #seconds
+POLL_INTERVAL_ERROR = 5.0 #seconds, after a failed request
+ALERT_HOLD = 600.0 #seconds of fast polling after a change
+
+
+def _check_windsocking():
+    # imported here: ata_control imports this module
+    from . import ata_control
+    return ata_control.check_windsocking()
+
+
+class WindsockWatcher:
+    """
+    Polls the windsocking status in a daemon thread (started with the
+    first subscription) and notifies the subscribers of the changes
+
+    :param check: function returning True while the antennas are windsocking
+    """
+
+    def __init__(self, check=_check_windsocking):
+        self._check = check
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._queues = []
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._polled = threading.Condition(self._lock)
+        self.active = None
+        self.changed_at = None
+        self.checked_at = None
+        # unix time the current status was first seen: the last change,
+        # or the first check
+        self.since = None
+        self.stowed = threading.Event()
+
+    def start(self):
+        """
+        Start the polling thread, if not already running
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                    name='windsock_watcher')
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the polling thread (the subscriptions are kept)
+        """
+        self._stop_event.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+        self._thread = None
+
+    def subscribe(self, callback):
+        """
+        Call callback(is_windsocking) from the watcher thread whenever
+        the windsocking status changes
+        """
+        with self._lock:
+            self._callbacks.append(callback)
+        self.start()
+        return callback
+
+    def subscribe_queue(self, maxsize=0):
+        """
+        :returns queue.Queue receiving (is_windsocking, unix_time) tuples
+            whenever the windsocking status changes
+        """
+        return self._subscribe_queue(maxsize)[0]
+
+    def _subscribe_queue(self, maxsize=0):
+        """
+        subscribe_queue(), also returning the (active, since) status at
+        the time of the subscription: the queue only receives the later
+        changes
+        """
+        events = queue.Queue(maxsize)
+        with self._lock:
+            self._queues.append(events)
+            status = (self.active, self.since)
+        self.start()
+        return events, status
+
+    def unsubscribe(self, callback_or_queue):
+        with self._lock:
+            if callback_or_queue in self._callbacks:
+                self._callbacks.remove(callback_or_queue)
+            if callback_or_queue in self._queues:
+                self._queues.remove(callback_or_queue)
+
+    def poll_now(self, timeout=None):
+        """
+        Check the status now rather than at the next scheduled poll
+
+        :returns the windsocking status (None if it could not be checked
+            before timeout)
+        """
+        self.start()
+        with self._lock:
+            checked_at = self.checked_at
+            self._wakeup.set()
+            self._polled.wait_for(lambda: self.checked_at != checked_at, timeout)
+            return self.active
+
+    def wait(self, duration, abort_on_stow=False):
+        """
+        Sleep for duration seconds, watching the windsocking status
+
+        :param abort_on_stow: return as soon as windsocking begins
+            (immediately if it is already active)
+        :returns list of the (is_windsocking, unix_time) changes during
+            the wait; if the antennas were already windsocking, the
+            first one is (True, time windsocking started, or was first
+            seen)
+        """
+        end = time.monotonic() + duration
+        events, (active, since) = self._subscribe_queue()
+        changes = []
+        try:
+            if active is None:
+                self.poll_now(timeout=POLL_INTERVAL_ERROR)
+                with self._lock:
+                    # the changes queued so far are part of the status
+                    _drain(events)
+                    active, since = self.active, self.since
+            if active:
+                changes.append((True, since))
+                if abort_on_stow:
+                    return changes
+            while True:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    return changes
+                try:
+                    change = events.get(timeout=remaining)
+                except queue.Empty:
+                    return changes
+                changes.append(change)
+                if change[0] and abort_on_stow:
+                    return changes
+        finally:
+            self.unsubscribe(events)
+
+    def poll_interval(self):
+        """
+        Seconds until the next poll, see the module documentation
+        """
+        if self.active is None:
+            return POLL_INTERVAL_ERROR
+        if self.active or (self.changed_at is not None and
+                time.time() - self.changed_at < ALERT_HOLD):
+            return POLL_INTERVAL_ALERT
+        return POLL_INTERVAL_CALM
+
+    def _queue_event_locked(self, is_windsocking, t):
+        # caller holds the lock, so that the queues get exactly the
+        # changes after the status they subscribed with
+        logger = logger_defaults.getModuleLogger(__name__)
+        for events in self._queues:
+            try:
+                events.put_nowait((is_windsocking, t))
+            except queue.Full:
+                logger.warning('windsocking event queue full, dropping event')
+
+    def _notify(self, is_windsocking):
+        logger = logger_defaults.getModuleLogger(__name__)
+        with self._lock:
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            try:
+                callback(is_windsocking)
+            except Exception as e:
+                logger.exception('windsocking callback {} failed: {}'.format(
+                    callback, str(e)))
+
+    def _run(self):
+        logger = logger_defaults.getModuleLogger(__name__)
+        while not self._stop_event.is_set():
+            self._wakeup.clear()
+            interval = None
+            try:
+                status = bool(self._check())
+            except Exception as e:
+                logger.warning('could not check windsocking: {}'.format(str(e)))
+                interval = POLL_INTERVAL_ERROR
+                with self._lock:
+                    self.checked_at = time.time()
+                    self._polled.notify_all()
+            else:
+                t = time.time()
+                with self._lock:
+                    # the first check sets the state, it is not a change
+                    changed = self.active is not None and status != self.active
+                    if changed or self.active is None:
+                        self.since = t
+                    self.active = status
+                    self.checked_at = t
+                    if changed:
+                        self.changed_at = t
+                        self._queue_event_locked(status, t)
+                    self._polled.notify_all()
+                if status:
+                    self.stowed.set()
+                else:
+                    self.stowed.clear()
+                if changed:
+                    logger.info('windsocking {:s}'.format(
+                        'started' if status else 'ended'))
+                    self._notify(status)
+            if interval is None:
+                interval = self.poll_interval()
+            self._wakeup.wait(interval)
+
+
+def _drain(events):
+    while True:
+        try:
+            events.get_nowait()
+        except queue.Empty:
+            return
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+def get_watcher():
+    """
+    The windsocking watcher shared by the whole process
+    """
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = WindsockWatcher()
+        return _watcher
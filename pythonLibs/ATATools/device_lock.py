@@ -1,8 +1,27 @@
-import redis
+"""
+Redis locks serialising the access to devices (SNAPs, RFSoC boards)
+shared between processes, e.g.:
+
+    with DeviceLock(snap.host):
+        x, y = snap.adc_get_samples()
+
+A lock is acquired atomically (SET NX PX) with a random owner token,
+and only released by its owner (Lua script). Waiters block on the
+"<device>_lock_released" pub/sub channel instead of polling. Every
+acquisition returns a fencing token, incremented for each new owner,
+that devices/services can use to reject requests from an owner whose
+lock expired. Acquisition and hold times are kept per device, see
+get_lock_stats.
+
+The redis connection is only made on first use (see get_redis), so
+importing this module doesn't need redishost.
+"""
+
+import threading
 import time
+import uuid
 
 REDISHOST = 'redishost'
-REDIS = redis.Redis(REDISHOST)
 SLEEP_TIME = 0.1
 NSEC       = 4. #to retry getting lock
 MAX_NTRIES = int(NSEC/SLEEP_TIME)
@@ -15,48 +34,264 @@ class LockError(Exception):
     pass
 
 
-try:
-    REDIS.ping()
-except ConnectionError as e:
-    raise
+_redis = None
+_redis_lock = threading.Lock()
+
+def get_redis():
+    """
+    The redis connection to REDISHOST, created (and checked with a ping)
+    on the first call
+    """
+    global _redis
+    with _redis_lock:
+        if _redis is None:
+            import redis
+            conn = redis.Redis(REDISHOST)
+            conn.ping()
+            _redis = conn
+        return _redis
+
+def __getattr__(name):
+    # REDIS used to be created at import time
+    if name == 'REDIS':
+        return get_redis()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+# KEYS: lock, fence counter; ARGV: owner token, expire (ms)
+# returns {1, fencing token} if acquired, {0, ms until the lock expires}
+_ACQUIRE_SCRIPT = """
+if redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return {1, redis.call('incr', KEYS[2])}
+end
+return {0, redis.call('pttl', KEYS[1])}
+"""
+
+# KEYS: lock, release channel; ARGV: owner token
+# returns 1 if released, 0 if the lock is not (any more) ours
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('del', KEYS[1])
+    redis.call('publish', KEYS[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# KEYS: lock; ARGV: owner token, expire (ms)
+_EXTEND_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_scripts = {}
+
+def _script(conn, source):
+    """
+    source registered on conn (the script sha is computed once, the
+    script is only sent to the server if it doesn't know it yet)
+    """
+    key = (id(conn), source)
+    script = _scripts.get(key)
+    if script is None:
+        script = _scripts[key] = conn.register_script(source)
+    return script
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+def _new_stats():
+    return {'acquired': 0, 'contended': 0, 'timeouts': 0, 'expired': 0,
+            'wait_time': 0.0, 'max_wait_time': 0.0,
+            'hold_time': 0.0, 'max_hold_time': 0.0}
+
+def _update_stats(device, **increments):
+    with _stats_lock:
+        stats = _stats.setdefault(device, _new_stats())
+        for key, value in increments.items():
+            if key.startswith('max_'):
+                stats[key] = max(stats[key], value)
+            else:
+                stats[key] += value
+
+def get_lock_stats(device_hostname=None):
+    """
+    Lock statistics of this process, for device_hostname or all the
+    devices ({device: stats}). The stats are a dictionary of
+        acquired, contended (acquisitions that had to wait), timeouts,
+        expired (locks that expired before their release),
+        wait_time, max_wait_time, hold_time, max_hold_time (seconds)
+    """
+    with _stats_lock:
+        if device_hostname is not None:
+            return dict(_stats.get(device_hostname, _new_stats()))
+        return {device: dict(stats) for device, stats in _stats.items()}
+
+def reset_lock_stats():
+    with _stats_lock:
+        _stats.clear()
 
 
+class DeviceLock:
+    """
+    Lock of one device, see the module documentation
+
+    :param device_hostname: name of the device
+    :param expire: seconds after which the lock expires if not released
+    :param timeout: maximum seconds to wait for the lock
+    :param redis_conn: redis connection, default get_redis()
+    """
+
+    def __init__(self, device_hostname, expire=DEFAULT_EXPIRE, timeout=NSEC,
+            redis_conn=None):
+        self.device = device_hostname
+        self.lockname = device_hostname+"_lock"
+        self.fence_name = self.lockname+"_fence"
+        self.channel = self.lockname+"_released"
+        self.expire = expire
+        self.timeout = timeout
+        self.redis = redis_conn if redis_conn is not None else get_redis()
+        self.token = None
+        self.fence = None
+        self._acquired_at = None
+
+    def _try_acquire(self, token):
+        acquire = _script(self.redis, _ACQUIRE_SCRIPT)
+        acquired, value = acquire(keys=[self.lockname, self.fence_name],
+                args=[token, int(self.expire*1000)])
+        return bool(acquired), int(value)
+
+    def acquire(self, blocking=True, timeout=None):
+        """
+        Acquire the lock, waiting for at most timeout seconds (default
+        self.timeout) for the current owner to release it
+
+        :returns the fencing token
+        :raises LockError if the lock couldn't be obtained
+        """
+        if self.token is not None:
+            raise LockError("Lock %s is already held by this object"
+                    %self.lockname)
+        timeout = self.timeout if timeout is None else timeout
+        token = uuid.uuid4().hex
+        t_start = time.monotonic()
+
+        acquired, value = self._try_acquire(token)
+        contended = not acquired
+        if not acquired and blocking:
+            deadline = t_start + timeout
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                while not acquired:
+                    # retry once subscribed, the release may have been missed
+                    acquired, value = self._try_acquire(token)
+                    if acquired:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    if value == -2:
+                        # released in between, retry now
+                        continue
+                    # a crashed owner doesn't publish: wake up at the expiry
+                    wait = remaining if value < 0 else min(remaining, value/1000.)
+                    pubsub.get_message(timeout=max(wait, 0.001))
+            finally:
+                pubsub.close()
+
+        t_acquired = time.monotonic()
+        if not acquired:
+            _update_stats(self.device, contended=1, timeouts=1,
+                    wait_time=t_acquired-t_start,
+                    max_wait_time=t_acquired-t_start)
+            raise LockError("Lock for device '%s' couldn't be obtained "
+                    "in %.1f s" %(self.device, t_acquired - t_start))
+
+        self.token = token
+        self.fence = value
+        self._acquired_at = t_acquired
+        _update_stats(self.device, acquired=1, contended=int(contended),
+                wait_time=t_acquired-t_start, max_wait_time=t_acquired-t_start)
+        return self.fence
+
+    def extend(self, expire=None):
+        """
+        Reset the expiry of the held lock to expire seconds (default
+        self.expire)
+
+        :raises LockError if the lock is not held any more
+        """
+        expire = self.expire if expire is None else expire
+        extend = _script(self.redis, _EXTEND_SCRIPT)
+        if self.token is None or not extend(keys=[self.lockname],
+                args=[self.token, int(expire*1000)]):
+            raise LockError("Lock %s is not held" %self.lockname)
+
+    def release(self):
+        """
+        Release the lock, waking up the waiters
+
+        :returns True if released, False if the lock had already expired
+            (and may have been taken by someone else)
+        """
+        if self.token is None:
+            return False
+        release = _script(self.redis, _RELEASE_SCRIPT)
+        released = bool(release(keys=[self.lockname, self.channel],
+                args=[self.token]))
+        hold_time = time.monotonic() - self._acquired_at
+        _update_stats(self.device, expired=int(not released),
+                hold_time=hold_time, max_hold_time=hold_time)
+        self.token = None
+        self._acquired_at = None
+        return released
+
+    def locked(self):
+        return self.token is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+
+# locks taken with set_device_lock, for release_device_lock
+_held_locks = {}
+_held_locks_lock = threading.Lock()
 
 def set_device_lock(device_hostname,expire=DEFAULT_EXPIRE):
-    lockname = device_hostname+"_lock"
-
-    lock = REDIS.get(lockname)
-    ntries = 0
-    if lock:
-        # make sure we can obtain lock
-        while lock:
-            lock = REDIS.get(lockname)
-            time.sleep(0.1)
-            ntries += 1
-            if ntries > MAX_NTRIES:
-                raise LockError("Lock for device '%s' couldn't be obtained "
-                        "after %i tries" %(device_hostname, ntries))
-
-        # now set lock
-        resp = REDIS.set(lockname, LOCK_ON, ex=expire)
-        if resp:
-            return 1
-        else:
-            raise LockError("Could not set lock %s"
-                    %lockname)
-
-    else:
-        resp = REDIS.set(lockname, LOCK_ON, ex=expire)
-        if resp:
-            return 1
-        else:
-            raise LockError("Could not set lock %s (was initially unset)"
-                    %lockname)
+    """
+    Acquire the lock of device_hostname, see DeviceLock
+
+    :returns the fencing token
+    :raises LockError if the lock couldn't be obtained in NSEC seconds
+    """
+    lock = DeviceLock(device_hostname, expire=expire)
+    fence = lock.acquire()
+    with _held_locks_lock:
+        _held_locks.setdefault(device_hostname, []).append(lock)
+    return fence
 
 
 
 def release_device_lock(device_hostname):
-    lockname = device_hostname+"_lock"
+    """
+    Release the lock of device_hostname taken with set_device_lock
 
-    resp = REDIS.delete(lockname)
-    return resp
+    :returns 1 if released, 0 if it was not held (or had expired)
+    """
+    with _held_locks_lock:
+        locks = _held_locks.get(device_hostname)
+        lock = locks.pop(0) if locks else None
+        if locks == []:
+            del _held_locks[device_hostname]
+    if lock is None:
+        return 0
+    return int(lock.release())
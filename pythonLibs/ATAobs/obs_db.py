@@ -133,25 +133,23 @@ def initAntennasTable(recid,antlist,sources,azs=0.0,els=0.0, getpams=True):
                      "source=%(src)s")
 
     if getpams:
-        try:
-            logger.info("getting pam values")
-            pamvals = ata_control.get_pams(antlist)
-            detvals = ata_control.get_dets(antlist)
-        except:
-            logger.exception("unable to get pams, ignoring flag")
-            getpams = False
+        logger.info("getting pam values")
+        snapshots = ata_control.get_antenna_snapshot(antlist, fields=('pams', 'dets'))
 
     #this is not the cleanest way. Probably the itertools.izip should be used
     for x in range(nants):
         cant = antlist[x]
         dict1 = {'id': recid, 'ant': cant, 'az': azs[x], 'el': els[x], 'src': sources[x]}
-        if getpams:
+        if getpams and snapshots[cant].ok:
             insertcmd = insertcmdpams
-            dict1['pamx'] = pamvals['ant' + cant + 'x']
-            dict1['pamy'] = pamvals['ant' + cant + 'y']
-            dict1['pamdetx'] = detvals['ant' + cant + 'x']
-            dict1['pamdety'] = detvals['ant' + cant + 'y']
+            dict1['pamx'] = snapshots[cant].pams['x']
+            dict1['pamy'] = snapshots[cant].pams['y']
+            dict1['pamdetx'] = snapshots[cant].dets['x']
+            dict1['pamdety'] = snapshots[cant].dets['y']
         else:
+            if getpams:
+                logger.warning("unable to get pams for ant {}: {}, ignoring flag".format(
+                    cant, snapshots[cant].errors))
             insertcmd = insertcmdnopams
 
         logger.info("commiting for ant {}".format(cant))
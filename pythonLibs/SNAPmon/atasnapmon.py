@@ -27,10 +27,10 @@ from itertools import repeat
 import atexit
 
 from ATATools import ata_helpers
-from ATATools.device_lock import set_device_lock, release_device_lock
+from ATATools.device_lock import DeviceLock
 
 ATA_CFG = snap_config.get_ata_cfg()
-ATA_SNAP_TAB = snap_config.get_ata_snap_tab()
+SNAP_MAPPING = snap_config.get_snap_mapping()
 
 BW = snap_defaults.bw #MHz
 NCHANS = snap_defaults.nchan
@@ -95,11 +95,10 @@ class SnapThread(Thread):
         itry = 0
         while (itry < ntries):
             try:
-                set_device_lock(snap.host)
-                acc_len = snap.fpga.read_int('timebase_sync_period')*8/4096/2
-                xx,yy = snap.spec_read()
-                adc_x, adc_y = snap.adc_get_samples()
-                release_device_lock(snap.host)
+                with DeviceLock(snap.host):
+                    acc_len = snap.fpga.read_int('timebase_sync_period')*8/4096/2
+                    xx,yy = snap.spec_read()
+                    adc_x, adc_y = snap.adc_get_samples()
 
                 xx = xx / acc_len
                 yy = yy / acc_len
@@ -121,7 +120,7 @@ class SnapThread(Thread):
                     zip(self.hosts,snaps_res)}
             time.sleep(1)
 
-LOs = pd.unique(ATA_SNAP_TAB.LO)
+LOs = list(SNAP_MAPPING.lo_to_entries)
 cfreq_thread = cfreqThread(LOs)
 cfreq_thread.daemon = True
 cfreq_thread.start()
@@ -144,7 +143,7 @@ for snap in fengs:
             )
 
     cfreqs = cfreq_thread.cfreqs
-    lo = ATA_SNAP_TAB[ATA_SNAP_TAB.snap_hostname == snap.host].LO.values[0]
+    lo = SNAP_MAPPING.snap_to_entry[snap.host].lo
     cfreq = cfreqs[lo]
 
     xx,yy,adc_x,adc_y = snaps_res[snap.host]
@@ -178,8 +177,7 @@ for snap in fengs:
                 marker_color='red'), 
             1, 2)
 
-    ant_name = ATA_SNAP_TAB[ATA_SNAP_TAB.snap_hostname == snap.host].ANT_name
-    ant_name = ant_name.values[0]
+    ant_name = SNAP_MAPPING.snap_to_entry[snap.host].ant
     #ind = np.where(snap_ant[:,0] == snap.host)[0]
     #ant_name = snap_ant[ind,1][0]
 
@@ -227,11 +225,10 @@ def gen_bp(interval=None):
 
     for i,snap in enumerate(fengs):
         xx, yy, adc_x, adc_y = snaps_res[snap.host]
-        lo = ATA_SNAP_TAB[ATA_SNAP_TAB.snap_hostname == snap.host].LO.values[0]
+        snap_entry = SNAP_MAPPING.snap_to_entry[snap.host]
+        lo = snap_entry.lo
         cfreq = cfreqs[lo]
-        ant_name = ATA_SNAP_TAB[ATA_SNAP_TAB.snap_hostname ==\
-                snap.host].ANT_name
-        ant_name = ant_name.values[0]
+        ant_name = snap_entry.ant
         #x = np.linspace(cfreq - BW/2, cfreq + BW/2, len(xx)) - FOFF/2.
         #x = np.linspace(cfreq - BW/2 + FOFF/2., cfreq + BW/2 + FOFF/2., 
         #        len(xx)+1) - FOFF/2.
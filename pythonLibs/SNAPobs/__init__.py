@@ -1,4 +1,21 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-from .snap_dada import snap_dada, snap_dada_defaults
-from .snap_hpguppi import snap_hpguppi
+import importlib
+
+# snap_dada, snap_dada_defaults and snap_hpguppi are imported on first
+# use, so that e.g. "from SNAPobs import snap_config" doesn't load
+# casperfpga, the hashpipe redis keys, ...
+_LAZY_SUBMODULES = {
+    'snap_dada': '.snap_dada.snap_dada',
+    'snap_dada_defaults': '.snap_dada.snap_dada_defaults',
+    'snap_hpguppi': '.snap_hpguppi.snap_hpguppi',
+}
+
+def __getattr__(name):
+    if name in _LAZY_SUBMODULES:
+        module = importlib.import_module(_LAZY_SUBMODULES[name], __name__)
+        # importing the module binds the subpackage of the same name,
+        # the module is what "from SNAPobs import snap_dada" always gave
+        globals()[name] = module
+        return module
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
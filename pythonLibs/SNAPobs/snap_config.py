@@ -1,56 +1,93 @@
 import os,sys
-import pandas as pd
-import toml
+import collections
+import copy
+import re
+import threading
+import types
 
 from SNAPobs import snap_defaults
 from ATATools import ata_helpers
 
+# The configuration files are parsed on first use (get_ata_cfg,
+# get_ata_snap_tab, ...), not at import time, and parsed again only
+# when the file is modified. ATA_SHARE_DIR, ATA_CFG, ATA_BASE_OBS_DIR,
+# ATA_SNAP_TAB, ANTLO and ATA_SNAP_IF are still available as module
+# attributes, see __getattr__. Use get_snap_mapping for the lookups
+# between antennas, LOs, snaps and IF channels.
 
-ATA_SHARE_DIR = snap_defaults.share_dir
-ATA_CFG = ata_helpers.parse_cfg(os.path.join(ATA_SHARE_DIR,
-    'ata.cfg'))
-ATA_BASE_OBS_DIR = ATA_CFG['OBSDIR']
+_configs = {}
+_configs_lock = threading.RLock()
 
-_snap_tab = open(os.path.join(ATA_SHARE_DIR, 'ata_snap.tab'))
-_snap_tab_names = [name for name in _snap_tab.readline().strip().lstrip("#").split(" ")
-        if name]
-ATA_SNAP_TAB = pd.read_csv(_snap_tab, delim_whitespace=True, index_col=False,
-        names=_snap_tab_names, dtype=str)
-_snap_tab.close()
 
-#extend ATA_SNAP_TAB with antlo
-ANTLO = [ant+lo.upper() for ant,lo in zip(ATA_SNAP_TAB.ANT_name, ATA_SNAP_TAB.LO)]
-ATA_SNAP_TAB.insert(ATA_SNAP_TAB.shape[1], "antlo", ANTLO, True)
+def _file_version(filename):
+    path = os.path.join(get_ata_share_dir(), filename)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (path, None)
+    return (path, st.st_mtime_ns, st.st_size)
 
 
-_snap_if = open(os.path.join(ATA_SHARE_DIR, 'ata_if.cfg'))
-_snap_if_names = [name for name in _snap_if.readline().strip().lstrip("#").split(" ")
-        if name]
+def _cached(name, load, filenames=None):
+    """
+    load(), cached until one of filenames (default: name) in the share
+    directory is modified
+    """
+    version = tuple(_file_version(filename)
+            for filename in (filenames or (name,)))
+    with _configs_lock:
+        entry = _configs.get(name)
+        if entry is None or entry[0] != version:
+            entry = _configs[name] = (version, load())
+        return entry[1]
+
+
+def _read_tab(filename):
+    # pandas is only needed once a table is read
+    import pandas as pd
+
+    with open(os.path.join(get_ata_share_dir(), filename)) as tab:
+        names = [name for name in tab.readline().strip().lstrip("#").split(" ")
+                if name]
+        return pd.read_csv(tab, sep=r"\s+", index_col=False,
+                names=names, dtype=str)
+
 
-ATA_SNAP_IF = pd.read_csv(_snap_if, delim_whitespace=True, index_col=False,
-        names=_snap_if_names, dtype=str)
-_snap_if.close()
+def _load_snap_tab():
+    snap_tab = _read_tab('ata_snap.tab')
+    #extend ATA_SNAP_TAB with antlo
+    antlo = [ant+lo.upper() for ant,lo in zip(snap_tab.ANT_name, snap_tab.LO)]
+    snap_tab.insert(snap_tab.shape[1], "antlo", antlo, True)
+    return snap_tab
 
 
+def get_ata_share_dir():
+    return snap_defaults.get_share_dir()
+
 def get_ata_cfg():
-    return ATA_CFG
+    return _cached('ata.cfg', lambda: ata_helpers.parse_cfg(
+        os.path.join(get_ata_share_dir(), 'ata.cfg')))
 
 def get_ata_snap_tab():
-    return ATA_SNAP_TAB
+    return _cached('ata_snap.tab', _load_snap_tab)
 
 def get_ata_snap_if():
-    return ATA_SNAP_IF
+    return _cached('ata_if.cfg', lambda: _read_tab('ata_if.cfg'))
 
 def get_ata_base_obs_dir():
-    return ATA_BASE_OBS_DIR
+    return get_ata_cfg()['OBSDIR']
 
 def get_ata_obsinfo():
     """
     Return obsinfo.toml file as a python dictionary
     """
-    f = open(os.path.join(ATA_SHARE_DIR, 'obsinfo.toml'), "r")
-    obsinfo = toml.load(f)
-    return obsinfo
+    return copy.deepcopy(_cached('obsinfo.toml', _load_obsinfo))
+
+def _load_obsinfo():
+    import toml
+
+    with open(os.path.join(get_ata_share_dir(), 'obsinfo.toml'), "r") as f:
+        return toml.load(f)
 
 def get_rfsoc_active_antlist():
     """
@@ -69,3 +106,146 @@ def get_rfsoc_active_antlist():
                 "Will return xpol antennas anyway")
 
     return x_pol_ants.tolist()
+
+
+# one row of ata_snap.tab
+SnapEntry = collections.namedtuple('SnapEntry',
+        ['antlo', 'ant', 'lo', 'snap_hostname', 'recv_host', 'recv_port'])
+
+# the attenuator module and channels of a snap in ata_if.cfg
+SnapIF = collections.namedtuple('SnapIF', ['module', 'chx', 'chy'])
+
+# e.g. "rfsoc2-ctrl-3" is pipeline 2 of board "rfsoc2-ctrl"
+RFSOC_HOSTNAME_RE = re.compile(r"(?P<boardname>.*)-(?P<pipeline>\d+)$")
+
+
+def rfsoc_pipeline_id(snap_hostname):
+    """
+    pipeline id (0 based) of an rfsoc hostname, None for snaps
+    """
+    if not snap_hostname.startswith("rfsoc"):
+        return None
+    match = RFSOC_HOSTNAME_RE.match(snap_hostname)
+    if match is None:
+        return None
+    return int(match.group('pipeline')) - 1
+
+
+class SnapMapping:
+    """
+    Read-only indexes of ata_snap.tab and ata_if.cfg, built once per
+    version of the files (see get_snap_mapping), to replace the table
+    filtering in loops:
+
+        entries         SnapEntry of every row of ata_snap.tab, in order
+        antlo_to_snap   {antlo: snap_hostname}
+        snap_to_entry   {snap_hostname: SnapEntry}
+        ant_to_entries  {ANT_name: (SnapEntry, ...)}, the LOs an antenna feeds
+        lo_to_entries   {LO: (SnapEntry, ...)}
+        snap_to_if      {snap_hostname: SnapIF}
+        module_to_snaps {module: (snap_hostname, ...)}, in ata_if.cfg order
+        snap_to_pipeline {snap_hostname: rfsoc pipeline id, None for snaps}
+    """
+
+    def __init__(self, snap_tab, snap_if=None):
+        self.entries = tuple(SnapEntry(*row) for row in zip(snap_tab.antlo,
+            snap_tab.ANT_name, snap_tab.LO, snap_tab.snap_hostname,
+            snap_tab.recv_host, snap_tab.recv_port))
+
+        ant_to_entries = {}
+        lo_to_entries = {}
+        for entry in self.entries:
+            ant_to_entries.setdefault(entry.ant, []).append(entry)
+            lo_to_entries.setdefault(entry.lo, []).append(entry)
+
+        self.antlo_to_snap = types.MappingProxyType(
+                {entry.antlo: entry.snap_hostname for entry in self.entries})
+        self.snap_to_entry = types.MappingProxyType(
+                {entry.snap_hostname: entry for entry in self.entries})
+        self.ant_to_entries = types.MappingProxyType(
+                {ant: tuple(entries) for ant,entries in ant_to_entries.items()})
+        self.lo_to_entries = types.MappingProxyType(
+                {lo: tuple(entries) for lo,entries in lo_to_entries.items()})
+        self.snap_to_pipeline = types.MappingProxyType(
+                {entry.snap_hostname: rfsoc_pipeline_id(entry.snap_hostname)
+                    for entry in self.entries})
+
+        snap_to_if = {}
+        module_to_snaps = {}
+        if snap_if is not None:
+            for snap_hostname, module, chx, chy in zip(snap_if.snap_hostname,
+                    snap_if.module, snap_if.chx, snap_if.chy):
+                snap_to_if[snap_hostname] = SnapIF(module, chx, chy)
+                module_to_snaps.setdefault(module, []).append(snap_hostname)
+        self.snap_to_if = types.MappingProxyType(snap_to_if)
+        self.module_to_snaps = types.MappingProxyType(
+                {module: tuple(snaps) for module,snaps in module_to_snaps.items()})
+
+    def select(self, antlo_list):
+        """
+        SnapEntry of the antlos in antlo_list, in ata_snap.tab order
+
+        :raises RuntimeError if some antlos are not in the table
+        """
+        antlos = set(antlo_list)
+        missing = sorted(antlos.difference(self.antlo_to_snap))
+        if missing:
+            raise RuntimeError("The specified ant-los (%s) are not in the "
+                    "configuration file (%s)" %(missing, list(self.antlo_to_snap)))
+        return [entry for entry in self.entries if entry.antlo in antlos]
+
+    def select_snaps(self, snap_hostnames):
+        """
+        SnapEntry of the snap_hostnames, in ata_snap.tab order
+
+        :raises RuntimeError if some snaps are not in the table
+        """
+        snaps = set(snap_hostnames)
+        missing = sorted(snaps.difference(self.snap_to_entry))
+        if missing:
+            raise RuntimeError("Not all snaps (%s) are provided in the config "
+                    "table (%s)" %(missing, list(self.snap_to_entry)))
+        return [entry for entry in self.entries if entry.snap_hostname in snaps]
+
+    def if_modules(self, snap_hostnames):
+        """
+        {module: [(snap_hostname, SnapIF), ...]} of the snap_hostnames
+        that have an IF entry, in the order of snap_hostnames
+        """
+        modules = {}
+        for snap_hostname in snap_hostnames:
+            snap_if = self.snap_to_if.get(snap_hostname)
+            if snap_if is not None:
+                modules.setdefault(snap_if.module, []).append(
+                        (snap_hostname, snap_if))
+        return modules
+
+
+def _load_snap_mapping():
+    snap_if = None
+    if _file_version('ata_if.cfg')[1] is not None:
+        snap_if = get_ata_snap_if()
+    return SnapMapping(get_ata_snap_tab(), snap_if)
+
+def get_snap_mapping():
+    """
+    SnapMapping of the current ata_snap.tab and ata_if.cfg (rebuilt only
+    when one of them is modified)
+    """
+    return _cached('snap_mapping', _load_snap_mapping,
+            ('ata_snap.tab', 'ata_if.cfg'))
+
+
+_LAZY_ATTRIBUTES = {
+    'ATA_SHARE_DIR': get_ata_share_dir,
+    'ATA_CFG': get_ata_cfg,
+    'ATA_BASE_OBS_DIR': get_ata_base_obs_dir,
+    'ATA_SNAP_TAB': get_ata_snap_tab,
+    'ANTLO': lambda: list(get_ata_snap_tab().antlo),
+    'ATA_SNAP_IF': get_ata_snap_if,
+}
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
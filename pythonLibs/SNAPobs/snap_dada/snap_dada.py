@@ -1,4 +1,4 @@
-from ATATools import ata_control, ata_coords, ata_helpers, logger_defaults
+from ATATools import ata_control, ata_coords, ata_helpers, ata_windsock, logger_defaults
 from .. import snap_control, snap_defaults, snap_dirs, snap_config, snap_if
 
 from . import snap_dada_control, snap_dada_defaults
@@ -11,15 +11,21 @@ import numpy as np
 import pandas as pd
 from pathlib import Path
 
-ATA_CFG      = snap_config.get_ata_cfg()
-ATA_SNAP_TAB = snap_config.get_ata_snap_tab()
-
-ATA_BASE_OBS_DIR = ATA_CFG['OBSDIR']
-
 MYCWD = os.path.dirname(os.path.realpath(__file__))
 TEMPLATE_HDR_PATH = os.path.join(MYCWD, snap_defaults.template_header)
 
-UTCFMT = ATA_CFG['UTCFMT']
+# the configuration is read on first use, see snap_config
+_LAZY_CONFIG = {
+    'ATA_CFG': snap_config.get_ata_cfg,
+    'ATA_SNAP_TAB': snap_config.get_ata_snap_tab,
+    'ATA_BASE_OBS_DIR': snap_config.get_ata_base_obs_dir,
+    'UTCFMT': lambda: snap_config.get_ata_cfg()['UTCFMT'],
+}
+
+def __getattr__(name):
+    if name in _LAZY_CONFIG:
+        return _LAZY_CONFIG[name]()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 def dup_arr(a, i):
     ii = len(a)
@@ -40,21 +46,22 @@ def set_freq_auto(freqs, ant_list):
     assert len(freqs) == len(ant_list),\
             "Number of requested frequencies should match number of antennas"
 
-    obs_ant_tab = ATA_SNAP_TAB[ATA_SNAP_TAB.ANT_name.isin(ant_list)]
-    los = pd.unique(obs_ant_tab.LO)
+    ant_entries = snap_config.get_snap_mapping().ant_to_entries
 
     lo_freq_mapping = {}
+    lo_ants = {}
     for ant,freq in zip(ant_list,freqs):
-        obs_ant = obs_ant_tab[obs_ant_tab.ANT_name==ant]
-        obs_ant_lo = str(obs_ant.LO.values.squeeze())
-        if obs_ant_lo in lo_freq_mapping:
-            assert freq == lo_freq_mapping[obs_ant_lo],\
-                    "A wrong LO-ant mapping for ant: %s" %(obs_ant.ANT_name)
-        else:
-            lo_freq_mapping[obs_ant_lo] = freq
+        for entry in ant_entries.get(ant, ()):
+            if entry.lo in lo_freq_mapping:
+                assert freq == lo_freq_mapping[entry.lo],\
+                        "A wrong LO-ant mapping for ant: %s" %(ant)
+            else:
+                lo_freq_mapping[entry.lo] = freq
+            if ant not in lo_ants.setdefault(entry.lo, []):
+                lo_ants[entry.lo].append(ant)
 
     for lo,freq in lo_freq_mapping.items():
-        ants_sub = list(obs_ant_tab[obs_ant_tab.LO == lo].ANT_name)
+        ants_sub = lo_ants[lo]
         logger.info("Setting {freq:.2f} (LO: {lo:s}) sky freq for"\
                 "ants: ({ants:s})".format(freq=float(freq), lo=lo,
                     ants=",".join(ants_sub)))
@@ -88,7 +95,7 @@ def get_freq_auto(antlo_list):
     los  = list(set(ant[2] for ant in antlo_list))
 
     focus_freq = ata_control.get_freq_focus(ant_list)
-    sky_freq   = {lo:ata_control.get_sky_freq(lo) for lo in los}
+    sky_freq   = {lo:ata_control.get_sky_freq(lo, use_cache=False) for lo in los}
 
     retdict = {}
 
@@ -104,14 +111,24 @@ def write_obs_finished(obs_basedir):
     Path(os.path.join(obs_basedir, "obs.finished")).touch()
 
 
+def write_windsocking_log(obs_basedir, changes):
+    """
+    windsocking.txt: one "unix_time windsocking_active" line per
+    windsocking change during the observation
+    """
+    with open(os.path.join(obs_basedir, "windsocking.txt"), "w") as f:
+        for is_windsocking, t in changes:
+            f.write("%.3f %i\n" %(t, is_windsocking))
+
+
 def mark_obs_for_heimdall(utc):
-    base_obs = os.path.join(ATA_BASE_OBS_DIR, utc)
+    base_obs = os.path.join(snap_config.get_ata_base_obs_dir(), utc)
     Path(os.path.join(base_obs, "obs.heimdall")).touch()
 
 
 def get_utc_dada_now(t_sec):
     t = datetime.timedelta(seconds=t_sec)
-    return (datetime.datetime.now()+t).strftime(UTCFMT)
+    return (datetime.datetime.now()+t).strftime(snap_config.get_ata_cfg()['UTCFMT'])
 
 
 #def rfc_to_cfreq(rfreq, ifc, srate):
@@ -227,33 +244,36 @@ def get_obs_params(ant_list, given_source):
 def get_obs_params(antlo_list):
     ant_list = [ant[:2] for ant in antlo_list]
     ant_list = list(set(ant_list))
+    lo_list  = list(set([ant[2] for ant in antlo_list]))
 
-    source_s = ata_control.get_eph_source(ant_list)
-    radec_s = ata_control.getRaDec(ant_list)
-    azel_s  = ata_control.getAzEl(ant_list)
-    pamvals_s = ata_control.get_pams(ant_list)
-    detvals_s = ata_control.get_dets(ant_list)
-    #ifattnvals
+    # all the control-system reads in one concurrent burst
+    snapshots = ata_control.get_antenna_snapshot(ant_list, los=lo_list)
+    failed = {ant: snap.errors for ant, snap in snapshots.items()
+            if not snap.ok}
+    if failed:
+        raise RuntimeError("Could not read the antenna state: %s" %failed)
 
     radec   = {}
     azel    = {}
     pamvals = {}
     detvals = {}
     source  = {}
+    skyfreq = {}
 
     # adding LOs to the dictionary
     for antlo in antlo_list:
         ant = antlo[:2]
         lo  = antlo[2]
-        radec[ant+lo]   = radec_s[ant]
-        azel[ant+lo]    = azel_s[ant]
-        source[ant+lo]  = source_s[ant]
-        pamvals[ant+lo+"x"] = pamvals_s[ant+"x"]
-        pamvals[ant+lo+"y"] = pamvals_s[ant+"y"]
-        detvals[ant+lo+"x"] = detvals_s[ant+"x"]
-        detvals[ant+lo+"y"] = detvals_s[ant+"y"]
-
-    skyfreq     = get_freq_auto(antlo_list)
+        snap = snapshots[ant]
+        radec[ant+lo]   = [snap.ra, snap.dec]
+        azel[ant+lo]    = [snap.az, snap.el]
+        source[ant+lo]  = snap.source
+        pamvals[ant+lo+"x"] = snap.pams['x']
+        pamvals[ant+lo+"y"] = snap.pams['y']
+        detvals[ant+lo+"x"] = snap.dets['x']
+        detvals[ant+lo+"y"] = snap.dets['y']
+        skyfreq[antlo]  = [snap.skyfreq[lo.lower()], snap.focus]
+
     ifattnvals = snap_if.getatten(antlo_list)
 
     obsParams = gather_ants(radec, azel, skyfreq,
@@ -267,7 +287,7 @@ def write_dada_header(headerdir, headerlist):
 
 
 def check_if_valid_ants(ant_list):
-    valid_ants = ATA_CFG['ACTIVE_ANTS']
+    valid_ants = snap_config.get_ata_cfg()['ACTIVE_ANTS']
     mask = [ant in valid_ants for ant in ant_list]
     if not(all(mask)):
         raise RuntimeError("Antennas provided: %s\n"\
@@ -276,9 +296,22 @@ def check_if_valid_ants(ant_list):
 
 
 def start_recording(antlo_list, tobs, npolout = 2, ics=False, 
-        acclen=None, dbnull=None, disable_rfi=False, source=None):
+        acclen=None, dbnull=None, disable_rfi=False, source=None,
+        windsock=None):
+    """
+    Record antlo_list for tobs seconds
+
+    windsock: None (default) to ignore windsocking, "mark" to log the
+    windsocking changes during the observation in windsocking.txt,
+    "abort" to also stop the recording as soon as the antennas stow
+    (see ata_windsock)
+    """
     logger =  logger_defaults.getModuleLogger(__name__)
 
+    if windsock not in (None, "mark", "abort"):
+        raise RuntimeError("windsock must be None, 'mark' or 'abort', not %s"
+                %windsock)
+
     if len(antlo_list[0]) != 3:
         raise RuntimeError("Make sure to include the LO in the ant list")
 
@@ -287,24 +320,18 @@ def start_recording(antlo_list, tobs, npolout = 2, ics=False,
 
     check_if_valid_ants(ant_list)
 
-    #sub_tab = ATA_SNAP_TAB[ATA_SNAP_TAB.ANT_name.isin(ant_list)]
-    sub_tab = ATA_SNAP_TAB[ATA_SNAP_TAB.antlo.isin(antlo_list)]
+    ATA_CFG      = snap_config.get_ata_cfg()
 
-    if len(sub_tab) != len(antlo_list):
-        raise RuntimeError("The specified ant-los (%s) are not in the configuration file (%s)"
-                %(antlo_list, sub_tab[['snap_hostname', 'ANT_name', 'LO']]))
+    # the ata_snap.tab rows of the antlos, in table order
+    sub_tab = snap_config.get_snap_mapping().select(antlo_list)
 
-    snap_names = list(sub_tab.snap_hostname)
+    snap_names = [entry.snap_hostname for entry in sub_tab]
+    recv_hosts = [entry.recv_host for entry in sub_tab]
+    recv_ports = [entry.recv_port for entry in sub_tab]
 
     # better put them in a dictionary
-    snaps = {}
     s = snap_control.init_snaps(snap_names)
-    #for iant,ant in enumerate(ant_list):
-    #    snaps[ant] = s[iant]
-    for isnap_name, snap_name in enumerate(snap_names):
-        ant = (sub_tab.ANT_name[sub_tab.snap_hostname == snap_name]).values[0]
-        lo  = (sub_tab.LO[sub_tab.snap_hostname == snap_name]).values[0].upper()
-        snaps[ant+lo] = s[isnap_name]
+    snaps = {entry.antlo: snap for entry,snap in zip(sub_tab, s)}
 
     # set accumulation length if provided
     if not acclen:
@@ -333,7 +360,7 @@ def start_recording(antlo_list, tobs, npolout = 2, ics=False,
 
     # create obs base directory
     logger.debug("Creating obs directories")
-    base_obs = os.path.join(ATA_BASE_OBS_DIR, utc_str)
+    base_obs = os.path.join(ATA_CFG['OBSDIR'], utc_str)
     snap_dirs.create_dir(base_obs)
 
     if ics:
@@ -391,7 +418,7 @@ def start_recording(antlo_list, tobs, npolout = 2, ics=False,
     headers = create_headers(obsParams)
     header_paths = []
     #for ant in sub_tab.ANT_name:
-    for antlo in sub_tab.antlo:
+    for antlo in snaps:
         header_paths.append(os.path.join(base_obs, antlo,
             "obs.header"))
         write_dada_header(header_paths[-1], headers[antlo])
@@ -401,14 +428,14 @@ def start_recording(antlo_list, tobs, npolout = 2, ics=False,
     #cpu_cores = snap_dada_defaults.NIC_cores[:len(ant_list)]
     cpu_cores = dup_arr(snap_dada_defaults.NIC_cores, len(ant_list))
     udpdb_logs = [os.path.join(ATA_CFG['LOGDIR'], "udpdb_%s.log")
-            %hostn for hostn in list(sub_tab.snap_hostname)]
+            %hostn for hostn in snap_names]
     if ics:
-        snap_dada_control.udpdb(list(sub_tab.snap_hostname), list(sub_tab.recv_host),
-                list(sub_tab.recv_port), cpu_cores, header_paths, keylist[:-1],
+        snap_dada_control.udpdb(snap_names, recv_hosts,
+                recv_ports, cpu_cores, header_paths, keylist[:-1],
                 udpdb_logs)
     else:
-        snap_dada_control.udpdb(list(sub_tab.snap_hostname), list(sub_tab.recv_host),
-                list(sub_tab.recv_port), cpu_cores, header_paths, keylist,
+        snap_dada_control.udpdb(snap_names, recv_hosts,
+                recv_ports, cpu_cores, header_paths, keylist,
                 udpdb_logs)
 
     if dbnull:
@@ -421,14 +448,22 @@ def start_recording(antlo_list, tobs, npolout = 2, ics=False,
             raise RuntimeError("ICS mode not fully implemented")
         else:
             dbsigproc_logs = [os.path.join(ATA_CFG['LOGDIR'], "dbsigproc_%s.log")
-                %hostn for hostn in list(sub_tab.snap_hostname)]
+                %hostn for hostn in snap_names]
             snap_dada_control.dbsigproc(keylist, dbsigproc_cores, 
                     dbsigproc_logs, npolout,
                     base_obs, invert_freqs=True, disable_rfi=disable_rfi)
 
 
     logger.info("Recording... waiting for obs finish time")
-    time.sleep(tobs)
+    if windsock:
+        changes = ata_windsock.get_watcher().wait(tobs,
+                abort_on_stow=(windsock == "abort"))
+        if changes:
+            write_windsocking_log(base_obs, changes)
+            if windsock == "abort" and changes[-1][0]:
+                logger.warning("Windsocking, aborting the recording")
+    else:
+        time.sleep(tobs)
 
     logger.info("Stopping obs")
     snap_control.stop_snaps(list(snaps.values()))
@@ -18,15 +18,26 @@ base_name = "frb-snap"
 template_header = "template_header.txt"
 discone_name = 'rfi'
 
-#if 'PSRHOME' in os.environ:
-#    baseshare = os.environ['PSRHOME']
-#elif 'ATASHAREDIR'  in os.environ:
-if 'ATASHAREDIR' in os.environ:
-    baseshare = os.environ['ATASHAREDIR']
-else:
-    raise RuntimeError("Env variable $ATASHAREDIR, is not set, please run: "
-            "'export ATASHAREDIR=\"/opt/mnt\"'")
+def get_baseshare():
+    #if 'PSRHOME' in os.environ:
+    #    return os.environ['PSRHOME']
+    #elif 'ATASHAREDIR'  in os.environ:
+    if 'ATASHAREDIR' in os.environ:
+        return os.environ['ATASHAREDIR']
+    else:
+        raise RuntimeError("Env variable $ATASHAREDIR, is not set, please run: "
+                "'export ATASHAREDIR=\"/opt/mnt\"'")
 
-share_dir = os.path.join(baseshare, 'share')
+def get_share_dir():
+    return os.path.join(get_baseshare(), 'share')
+
+def __getattr__(name):
+    # baseshare and share_dir are only required when used, so that
+    # importing SNAPobs works without $ATASHAREDIR
+    if name == 'baseshare':
+        return get_baseshare()
+    if name == 'share_dir':
+        return get_share_dir()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 redishost='redishost'
@@ -0,0 +1,369 @@
+"""
+Client of the IF gain (attenuator) modules, gain-module1, gain-module2...
+
+The attenuators are set with attenuatorMain.py on the module (see
+12xGainControlModule). Instead of one ssh session per call, the client
+keeps one ssh session per module open, running a shell, and writes the
+attenuatorMain.py commands to it. Every command is followed by an echo
+of a marker with its exit status, which tells where its output ends:
+
+    from SNAPobs import snap_gain_module
+
+    client = snap_gain_module.get_client()
+    client.set(1, [1, 2], [12.0, 13.5])
+    client.get(1, [1, 2])                  # {1: 12.0, 2: 13.5}
+
+    # several modules at once, one round-trip per module
+    client.set_many({1: ([1, 2], [12.0, 13.5]), 2: ([5], [20.0])})
+    client.get_many({1: [1, 2], 2: [5]})
+
+    # or several operations on a module in a single round-trip
+    client.execute(1, [('set', [1, 2], [12.0, 13.5]), ('get', [1, 2])])
+
+The sessions are opened on first use and reopened if they died (ssh
+timeout, module reboot). For tests and benchmarks, the modules can be
+replaced by local stand-ins, see snap_gain_module_mock.
+"""
+
+import atexit
+import queue
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from ATATools import logger_defaults
+
+GAIN_MODULE_HOST = "sonata@gain-module%i"
+ATTENUATOR_COMMAND = "python attenuatorMain.py"
+SSH_OPTIONS = ["-T", "-o", "BatchMode=yes", "-o", "ServerAliveInterval=30",
+        "-o", "ConnectTimeout=10"]
+
+CONNECT_TIMEOUT = 20 #seconds
+COMMAND_TIMEOUT = 30 #seconds, attenuatorMain takes ~0.2 s per channel
+
+
+class GainModuleError(RuntimeError):
+    pass
+
+
+def ssh_command(module):
+    """
+    command starting a shell on gain module number module
+    """
+    return ["ssh"] + SSH_OPTIONS + [GAIN_MODULE_HOST %int(module), "sh"]
+
+
+def set_command(chanlist, attenlist):
+    if len(chanlist) != len(attenlist):
+        raise ValueError("%i channels but %i attenuations"
+                %(len(chanlist), len(attenlist)))
+    return "%s -n %s -a %s" %(ATTENUATOR_COMMAND,
+            " ".join([str(i) for i in chanlist]),
+            " ".join(["%.1f" %float(i) for i in attenlist]))
+
+
+def get_command(chanlist):
+    return "%s -n %s -g" %(ATTENUATOR_COMMAND,
+            " ".join([str(i) for i in chanlist]))
+
+
+def parse_get_output(lines, chanlist):
+    """
+    {channel: attenuation} of the channels in chanlist from the output
+    of attenuatorMain.py -g, either "(1, 13.5)" (python 2) or "1 13.5"
+    (python 3) per line. Unknown channels are -1, as in attenuatorMain
+    """
+    values = {}
+    for line in lines:
+        fields = line.strip().strip("()").replace(",", " ").split()
+        if len(fields) != 2:
+            continue
+        try:
+            values[int(fields[0])] = float(fields[1])
+        except ValueError:
+            continue
+    retdict = {}
+    for ch in chanlist:
+        if int(ch) not in values:
+            raise GainModuleError("No attenuation returned for channel %s: %s"
+                    %(ch, lines))
+        retdict[ch] = values[int(ch)]
+    return retdict
+
+
+class GainModuleConnection:
+    """
+    Persistent shell session on one gain module
+
+    :param module: gain module number
+    :param command: command starting the shell, default ssh_command(module)
+    """
+
+    def __init__(self, module, command=None):
+        self.module = module
+        self.command = command if command is not None else ssh_command(module)
+        self._marker = "__gain_module_done_%s__" %uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._proc = None
+        self._lines = None
+        self.connected_at = None
+        self.round_trips = 0
+
+    def _connect(self):
+        logger = logger_defaults.getModuleLogger(__name__)
+        logger.info("connecting to gain module %s: %s" %(self.module,
+            " ".join(self.command)))
+        proc = subprocess.Popen(self.command, stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                bufsize=0)
+        lines = queue.Queue()
+        reader = threading.Thread(target=self._read, args=(proc, lines),
+                name='gain_module%s_reader' %self.module, daemon=True)
+        reader.start()
+        self._proc = proc
+        self._lines = lines
+        # wait for the shell, so connection errors show up here
+        self._run_locked([":"], CONNECT_TIMEOUT)
+        self.connected_at = time.time()
+
+    @staticmethod
+    def _read(proc, lines):
+        for line in iter(proc.stdout.readline, b""):
+            lines.put(line.decode(errors="replace").rstrip("\n"))
+        lines.put(None)
+
+    def connected(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def close(self):
+        with self._lock:
+            self._close_locked()
+
+    def _close_locked(self):
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+            proc.wait(timeout=2)
+        except (OSError, subprocess.TimeoutExpired):
+            proc.kill()
+            proc.wait()
+
+    def _run_locked(self, commands, timeout):
+        script = "".join("%s </dev/null\necho %s $?\n" %(command, self._marker)
+                for command in commands)
+        try:
+            self._proc.stdin.write(script.encode())
+            self._proc.stdin.flush()
+        except OSError as e:
+            raise ConnectionError("gain module %s: %s" %(self.module, str(e)))
+
+        results = []
+        output = []
+        deadline = time.monotonic() + timeout
+        while len(results) < len(commands):
+            try:
+                line = self._lines.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                raise TimeoutError("gain module %s: no answer in %.0f s"
+                        %(self.module, timeout))
+            if line is None:
+                raise ConnectionError("gain module %s: connection closed: %s"
+                        %(self.module, "\n".join(output)))
+            if line.startswith(self._marker):
+                results.append((int(line.split()[-1]), output))
+                output = []
+            else:
+                output.append(line)
+        self.round_trips += 1
+        return results
+
+    def run(self, commands, timeout=COMMAND_TIMEOUT):
+        """
+        Run the shell commands in one round-trip, reconnecting (once)
+        if the session died
+
+        :returns list of (exit status, [output lines]) of the commands
+        """
+        logger = logger_defaults.getModuleLogger(__name__)
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if not self.connected():
+                        self._close_locked()
+                        self._connect()
+                    return self._run_locked(commands, timeout)
+                except (ConnectionError, TimeoutError) as e:
+                    # the session is in an unknown state, start a new one
+                    self._close_locked()
+                    if attempt:
+                        raise GainModuleError(str(e))
+                    logger.warning("%s, reconnecting" %str(e))
+
+
+def _merge_operations(operations):
+    """
+    attenuatorMain.py commands of the operations, consecutive sets
+    merged into a single command
+    """
+    commands = []
+    last_set = None
+    for operation in operations:
+        if operation[0] == 'set':
+            _, chanlist, attenlist = operation
+            if last_set is None:
+                last_set = ([], [])
+                commands.append(('set', last_set))
+            last_set[0].extend(chanlist)
+            last_set[1].extend(attenlist)
+        elif operation[0] == 'get':
+            last_set = None
+            commands.append(('get', list(operation[1])))
+        else:
+            raise ValueError("Unknown gain module operation: %s" %(operation,))
+    return commands
+
+
+class GainModuleClient:
+    """
+    Gain module sessions, see the module documentation
+
+    :param command: function returning the command starting the shell
+        of a module, default ssh_command
+    :param max_workers: modules driven concurrently
+    """
+
+    def __init__(self, command=ssh_command, max_workers=8):
+        self.command = command
+        self.max_workers = max_workers
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def connection(self, module):
+        module = int(module)
+        with self._lock:
+            if module not in self._connections:
+                self._connections[module] = GainModuleConnection(module,
+                        self.command(module))
+            return self._connections[module]
+
+    def close(self):
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for connection in connections:
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def execute(self, module, operations):
+        """
+        Run operations on module in a single round-trip
+
+        :param operations: list of ('set', chanlist, attenlist) and
+            ('get', chanlist)
+        :returns {channel: attenuation} of the get operations
+        :raises GainModuleError if a command failed
+        """
+        logger = logger_defaults.getModuleLogger(__name__)
+        commands = _merge_operations(operations)
+        if not commands:
+            return {}
+        shell_commands = [set_command(*args) if kind == 'set' else get_command(args)
+                for kind, args in commands]
+        for shell_command in shell_commands:
+            logger.info("gain-module%i: %s" %(int(module), shell_command))
+
+        results = self.connection(module).run(shell_commands)
+
+        retdict = {}
+        for (kind, args), shell_command, (status, output) in zip(commands,
+                shell_commands, results):
+            if status != 0:
+                raise GainModuleError("gain-module%i: '%s' failed (%i): %s"
+                        %(int(module), shell_command, status, "\n".join(output)))
+            if kind == 'get':
+                retdict.update(parse_get_output(output, args))
+        return retdict
+
+    def execute_many(self, module_operations):
+        """
+        execute() on several modules concurrently
+
+        :param module_operations: {module: operations}
+        :returns {module: {channel: attenuation}}
+        :raises GainModuleError if a command failed on any module (the
+            other modules are still done)
+        """
+        if len(module_operations) <= 1:
+            return {module: self.execute(module, operations)
+                    for module, operations in module_operations.items()}
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers,
+                len(module_operations))) as executor:
+            futures = {module: executor.submit(self.execute, module, operations)
+                    for module, operations in module_operations.items()}
+        errors = [str(future.exception()) for future in futures.values()
+                if future.exception() is not None]
+        if errors:
+            raise GainModuleError("; ".join(errors))
+        return {module: future.result() for module, future in futures.items()}
+
+    def set(self, module, chanlist, attenlist):
+        self.execute(module, [('set', chanlist, attenlist)])
+
+    def get(self, module, chanlist):
+        return self.execute(module, [('get', chanlist)])
+
+    def set_many(self, module_settings):
+        """
+        :param module_settings: {module: (chanlist, attenlist)}
+        """
+        self.execute_many({module: [('set', chanlist, attenlist)]
+            for module, (chanlist, attenlist) in module_settings.items()})
+
+    def get_many(self, module_chanlists):
+        """
+        :param module_chanlists: {module: chanlist}
+        :returns {module: {channel: attenuation}}
+        """
+        return self.execute_many({module: [('get', chanlist)]
+            for module, chanlist in module_chanlists.items()})
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """
+    The gain module client shared by the whole process
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GainModuleClient()
+        return _client
+
+def set_client(client):
+    """
+    Replace the shared client (e.g. by one talking to stand-ins),
+    closing the previous one
+    """
+    global _client
+    with _client_lock:
+        previous, _client = _client, client
+    if previous is not None and previous is not client:
+        previous.close()
+
+@atexit.register
+def _close_client():
+    if _client is not None:
+        _client.close()
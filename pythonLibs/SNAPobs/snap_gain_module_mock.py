@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-in for the IF gain modules (gain-module1, gain-module2...)
+
+Each mocked module is a local process that behaves like the shell
+started by "ssh sonata@gain-moduleN sh": it reads command lines on
+stdin, answers "echo" and "python attenuatorMain.py ..." (same
+arguments and output as 12xGainControlModule/attenuatorMain.py) and
+keeps the attenuations in a json file per module, so snap_if and
+snap_gain_module can be exercised and benchmarked without the modules:
+
+    from SNAPobs import snap_gain_module_mock, snap_if
+
+    with snap_gain_module_mock.MockGainModules(connect_time=0.3) as mock:
+        mock.install()  # snap_gain_module.get_client() uses the mock
+        snap_if.setatten({'1aAx': 12.0})
+        print(mock.attenuations(1))
+
+or a single module, as ssh would start it:
+
+    python snap_gain_module_mock.py --module 1 --state-dir /tmp/gm
+    python snap_gain_module_mock.py --module 1 -c "python attenuatorMain.py -n 1 -g"
+
+The attenuators are not simulated beyond their last set value.
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import shlex
+import shutil
+import sys
+import tempfile
+import time
+
+NATTENUATORS = 24
+MAX_ATTENUATION = 31.5
+
+
+class _ModuleState:
+    """
+    Attenuations of one module, in state_dir/gain-module<N>.json,
+    locked like attenuatorMain.py does with /var/lock/attenuator.lock
+    """
+
+    def __init__(self, state_dir, module):
+        self.path = os.path.join(state_dir, "gain-module%i.json" %int(module))
+        self.lock_path = self.path + ".lock"
+
+    def __enter__(self):
+        self._lock = open(self.lock_path, "a")
+        fcntl.flock(self._lock, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self._lock, fcntl.LOCK_UN)
+        self._lock.close()
+        return False
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return {int(ch): value for ch, value in json.load(f).items()}
+
+    def save(self, values):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({str(ch): value for ch, value in values.items()}, f)
+        os.replace(tmp, self.path)
+
+
+def _attenuator_main(argv, state, channel_time, out):
+    """
+    attenuatorMain.py with arguments argv, returns the exit status
+    """
+    parser = argparse.ArgumentParser(prog='attenuatorMain.py', add_help=False)
+    parser.add_argument('-a', '--attenuation', type=float, nargs='+')
+    parser.add_argument('-n', '--number', type=int, nargs='+')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('-g', '--getvalue', action='store_true')
+    parser.add_argument('-i', '--initialize', action='store_true')
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as e:
+        return e.code
+    alist = args.attenuation or []
+    nlist = args.number or []
+    if args.attenuation and args.number and len(alist) != len(nlist):
+        out.write("Number of attenuators selected must match number of "
+                "attenuation level selected\n")
+        return 255
+
+    with state:
+        values = state.load()
+        if args.initialize:
+            time.sleep(channel_time * len(values))
+            return 0
+        if args.getvalue:
+            for n in (nlist if nlist else sorted(values)):
+                out.write("%i %s\n" %(n, values.get(n, -1)))
+            return 0
+
+        if len(nlist) == 1 and nlist[0] == 0:
+            nlist = list(range(1, NATTENUATORS + 1))
+            alist = alist * NATTENUATORS
+        for n, a in zip(nlist, alist):
+            if a > MAX_ATTENUATION or a < 0 or (a/0.5) % 1 != 0:
+                out.write("Illegal input for attenuation, -h for help\n")
+                return 0
+            if not (0 <= n <= NATTENUATORS):
+                out.write("Invalid attenuator selection, -h for help\n")
+                return 0
+            time.sleep(channel_time)
+            values[n] = a
+            state.save(values)
+        if args.verbose:
+            out.write("Successfully attenuated to %s dB\n" %alist)
+    return 0
+
+
+def run_command(line, state, channel_time, status, out):
+    """
+    Run one shell command line, returns its exit status
+    """
+    try:
+        argv = shlex.split(line)
+    except ValueError:
+        out.write("sh: syntax error\n")
+        return 2
+    # stdin redirections are irrelevant here
+    while len(argv) >= 2 and argv[-2] == "<":
+        argv = argv[:-2]
+    argv = [arg for arg in argv if not arg.startswith("</")]
+    if not argv or argv[0] == ":":
+        return 0
+    if argv[0] == "echo":
+        out.write(" ".join(argv[1:]).replace("$?", str(status)) + "\n")
+        return 0
+    if argv[0] == "exit":
+        raise SystemExit(int(argv[1]) if len(argv) > 1 else status)
+    if argv[0].startswith("python") and len(argv) > 1 and \
+            os.path.basename(argv[1]) == "attenuatorMain.py":
+        return _attenuator_main(argv[2:], state, channel_time, out)
+    out.write("sh: 1: %s: not found\n" %argv[0])
+    return 127
+
+
+def serve(module, state_dir, connect_time=0.0, channel_time=0.0,
+        command=None, stdin=sys.stdin, out=sys.stdout):
+    """
+    Answer the shell commands of stdin (or the single command) as
+    gain module number module
+    """
+    state = _ModuleState(state_dir, module)
+    time.sleep(connect_time)
+    if command is not None:
+        return run_command(command, state, channel_time, 0, out)
+    status = 0
+    for line in stdin:
+        status = run_command(line, state, channel_time, status, out)
+        out.flush()
+    return status
+
+
+class MockGainModules:
+    """
+    Stand-ins for the gain modules, see the module documentation
+
+    :param connect_time: time to open a session (the ssh handshake)
+    :param channel_time: time to set one attenuator (attenuatorMain.py
+        takes ~0.2 s per channel)
+    :param state_dir: directory of the module states, default a
+        temporary directory removed by stop()
+    """
+
+    def __init__(self, connect_time=0.3, channel_time=0.01, state_dir=None):
+        self.connect_time = connect_time
+        self.channel_time = channel_time
+        self._tmpdir = None
+        if state_dir is None:
+            state_dir = self._tmpdir = tempfile.mkdtemp(prefix="gain_modules_")
+        self.state_dir = state_dir
+        self._installed = False
+
+    def command(self, module, shell_command=None):
+        """
+        command starting the stand-in of module, in place of
+        snap_gain_module.ssh_command. With shell_command, runs it and
+        exits, like "ssh host shell_command"
+        """
+        command = [sys.executable, os.path.abspath(__file__),
+                "--module", str(int(module)), "--state-dir", self.state_dir,
+                "--connect-time", str(self.connect_time),
+                "--channel-time", str(self.channel_time)]
+        if shell_command is not None:
+            command += ["-c", shell_command]
+        return command
+
+    def client(self, **kwargs):
+        """
+        a snap_gain_module.GainModuleClient talking to the stand-ins
+        """
+        from SNAPobs import snap_gain_module
+        return snap_gain_module.GainModuleClient(command=self.command, **kwargs)
+
+    def install(self):
+        """
+        Make snap_gain_module.get_client() talk to the stand-ins, until
+        uninstall() or stop()
+        """
+        from SNAPobs import snap_gain_module
+        snap_gain_module.set_client(self.client())
+        self._installed = True
+
+    def uninstall(self):
+        if self._installed:
+            from SNAPobs import snap_gain_module
+            # the next get_client() creates a new ssh client
+            snap_gain_module.set_client(None)
+            self._installed = False
+
+    def stop(self):
+        self.uninstall()
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._tmpdir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def attenuations(self, module):
+        """
+        {attenuator: attenuation} last set on module
+        """
+        with _ModuleState(self.state_dir, module) as state:
+            return state.load()
+
+    def set_attenuations(self, module, values):
+        with _ModuleState(self.state_dir, module) as state:
+            current = state.load()
+            current.update(values)
+            state.save(current)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for a gain module shell')
+    parser.add_argument('--module', type=int, required=True,
+            help='gain module number')
+    parser.add_argument('--state-dir', default=tempfile.gettempdir(),
+            help='directory of the attenuation files')
+    parser.add_argument('--connect-time', type=float, default=0.0,
+            help='session start time in seconds (ssh handshake)')
+    parser.add_argument('--channel-time', type=float, default=0.0,
+            help='time to set one attenuator in seconds')
+    parser.add_argument('-c', dest='command',
+            help='run this command and exit, instead of reading stdin')
+    args = parser.parse_args()
+
+    try:
+        status = serve(args.module, args.state_dir, args.connect_time,
+                args.channel_time, args.command)
+    except KeyboardInterrupt:
+        status = 130
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
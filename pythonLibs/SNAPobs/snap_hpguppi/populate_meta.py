@@ -18,8 +18,6 @@ from . import record_in as hpguppi_record_in
 
 from ATATools.ata_rest import ATARestException
 
-ATA_SNAP_TAB = snap_config.get_ata_snap_tab()
-
 def _get_stream_mapping(stream_hosts, ignore_control=False):
     """
     1) Get the centre frequency for each of the stream_hosts
@@ -31,25 +29,19 @@ def _get_stream_mapping(stream_hosts, ignore_control=False):
     """
     if type(stream_hosts) != list:
         raise RuntimeError("Please input a list")
-    if not all(stream in list(ATA_SNAP_TAB.snap_hostname) for stream in stream_hosts):
-        raise RuntimeError("Not all snaps (%s) are provided in the config table (%s)",
-                stream_hosts, ATA_SNAP_TAB.snap_hostname)
-
-    obs_ant_tab = ATA_SNAP_TAB[ATA_SNAP_TAB.snap_hostname.isin(stream_hosts)]
-    los = np.unique(obs_ant_tab.LO)
+    obs_entries = snap_config.get_snap_mapping().select_snaps(stream_hosts)
+    los = np.unique([entry.lo for entry in obs_entries])
 
     retdict_skyfreq = {}
     for lo in los:
-        hostname_sub_list = list(obs_ant_tab[obs_ant_tab.LO == lo].snap_hostname)
         if ignore_control:
             skyfreq = 1400
         else:
-            skyfreq = ata_control.get_sky_freq(lo=lo)
-        tmp_dict = {snap:freq for snap,freq in zip(hostname_sub_list, 
-            [skyfreq]*len(hostname_sub_list))}
-        retdict_skyfreq.update(tmp_dict)
+            skyfreq = ata_control.get_sky_freq(lo=lo, use_cache=False)
+        retdict_skyfreq.update({entry.snap_hostname: skyfreq
+            for entry in obs_entries if entry.lo == lo})
 
-    retdict_antname = {i.snap_hostname:i.ANT_name for i in obs_ant_tab.itertuples()}
+    retdict_antname = {entry.snap_hostname: entry.ant for entry in obs_entries}
     return retdict_skyfreq, retdict_antname
 
 
@@ -74,22 +66,18 @@ def _gather_ants(radec, azel, source):
         obsDict[ant] = obsvals
     return obsDict
 
-def _safe_ata_control_get(antlist, get_func):
-    ret = {}
-    for ant in antlist:
-        try:
-            ret.update(get_func([ant]))
-        except:
-            ret.update({ant: None})
-    return ret
-
 def _get_obs_params(antlo_list):
     ant_list = [ant[:2] for ant in antlo_list]
     ant_list = list(set(ant_list))
 
-    source_s = _safe_ata_control_get(ant_list, ata_control.get_eph_source)
-    radec_s = _safe_ata_control_get(ant_list, ata_control.get_ra_dec)
-    azel_s  = _safe_ata_control_get(ant_list, ata_control.get_az_el)
+    # failed reads are None in the snapshot, per antenna and field
+    snapshots = ata_control.get_antenna_snapshot(ant_list,
+            fields=('source', 'radec', 'azel'))
+    source_s = {ant: snap.source for ant,snap in snapshots.items()}
+    radec_s = {ant: [snap.ra, snap.dec] if 'radec' not in snap.errors else None
+            for ant,snap in snapshots.items()}
+    azel_s  = {ant: [snap.az, snap.el] if 'azel' not in snap.errors else None
+            for ant,snap in snapshots.items()}
 
     radec   = {}
     azel    = {}
@@ -86,13 +86,13 @@ args = parser.parse_args()
 redis_obj = redis.Redis(args.redishost)
 
 if len(args.hostname_groupings) > 0:
-	ATA_SNAP_TAB = snap_config.get_ata_snap_tab()
+	SNAP_MAPPING = snap_config.get_snap_mapping()
 	args.groupings = []
 	for hostname_grouping in args.hostname_groupings:
 		antenna_group = []
 		for hostname_criterion in hostname_grouping.split(','):
 			hostname_pattern = re.compile(hostname_criterion)
-			antenna_group += [row['antlo'] for idx,row in ATA_SNAP_TAB.iterrows() if hostname_pattern.match(row['snap_hostname'])]
+			antenna_group += [entry.antlo for entry in SNAP_MAPPING.entries if hostname_pattern.match(entry.snap_hostname)]
 		args.groupings.append(','.join(antenna_group))
 
 
@@ -39,12 +39,12 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     if len(args.hostnames) > 0:
-        ATA_SNAP_TAB = snap_config.get_ata_snap_tab()
+        SNAP_MAPPING = snap_config.get_snap_mapping()
         args.antlo_stream_list = []
         for hostname in args.hostnames:
             for hostname_criterion in hostname.split(','):
                 hostname_pattern = re.compile(hostname_criterion)
-                args.antlo_stream_list += [row['antlo'] for idx,row in ATA_SNAP_TAB.iterrows() if hostname_pattern.match(row['snap_hostname'])]
+                args.antlo_stream_list += [entry.antlo for entry in SNAP_MAPPING.entries if hostname_pattern.match(entry.snap_hostname)]
 
     feng_objs = collect_feng_obj(args.antlo_stream_list, args.all, True)
     print('Affects the following F-Engine streams:\n', [feng.host for feng in feng_objs])
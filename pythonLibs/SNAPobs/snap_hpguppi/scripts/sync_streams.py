@@ -55,12 +55,12 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     if len(args.hostnames) > 0:
-        ATA_SNAP_TAB = snap_config.get_ata_snap_tab()
+        SNAP_MAPPING = snap_config.get_snap_mapping()
         args.stream_list = []
         for hostname in args.hostnames:
             for hostname_criterion in hostname.split(','):
                 hostname_pattern = re.compile(hostname_criterion)
-                args.stream_list += [row['antlo'] for idx,row in ATA_SNAP_TAB.iterrows() if hostname_pattern.match(row['snap_hostname'])]
+                args.stream_list += [entry.antlo for entry in SNAP_MAPPING.entries if hostname_pattern.match(entry.snap_hostname)]
     
     if args.stream_list is not None and len(args.stream_list) > 0:
         sync(hpguppi_auxillary.get_stream_hostname_per_antenna_names(args.stream_list), publish_global_key=args.publish)
@@ -1,4 +1,4 @@
-import redis
+import threading
 from string import Template
 from SNAPobs import snap_defaults
 from SNAPobs.snap_hpguppi import auxillary as hpguppi_aux
@@ -38,21 +38,37 @@ REDISPOSTPROCHASH = Template('postprocpype://${host}/${inst}/status')
 REDISPOSTPROCHASH_re = r'postprocpype://(?P<host>[^/]+)/(?P<inst>[^/]+)/status'
 REDISPOSTPROCSET = 'postprocpype:///set'
 
-redis_obj = redis.Redis(host=REDISHOST)
+# redis_obj, hashpipe_targets_LoB and hashpipe_targets_LoC are created
+# on first use (see __getattr__): importing this module doesn't need
+# redishost
+_lazy_lock = threading.RLock()
 
-hashpipe_targets_LoB = {
-	'seti-node1': [0],
-	'seti-node2': [0,1],
-	'seti-node3': [0,1],
-	'seti-node4': [0,1],
-}
+def get_redis_obj():
+	global redis_obj
+	with _lazy_lock:
+		if 'redis_obj' not in globals():
+			import redis
+			redis_obj = redis.Redis(host=REDISHOST)
+		return redis_obj
 
-hashpipe_targets_LoC = {
-	'seti-node5': [0,1],
-	'seti-node6': [0,1],
-	'seti-node7': [0,1],
-	'seti-node8': [0],
-}
+def get_hashpipe_targets():
+	"""
+	Return (hashpipe_targets_LoB, hashpipe_targets_LoC), resolved from
+	redis on the first call
+	"""
+	with _lazy_lock:
+		if 'hashpipe_targets_LoB' not in globals():
+			resolve_hashpipe_targets()
+		return hashpipe_targets_LoB, hashpipe_targets_LoC
+
+def __getattr__(name):
+	if name == 'redis_obj':
+		return get_redis_obj()
+	if name == 'hashpipe_targets_LoB':
+		return get_hashpipe_targets()[0]
+	if name == 'hashpipe_targets_LoC':
+		return get_hashpipe_targets()[1]
+	raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 def resolve_hashpipe_targets():
 	global hashpipe_targets_LoB, hashpipe_targets_LoC
@@ -63,8 +79,8 @@ def resolve_hashpipe_targets():
 	]
 	instances = [0, 1]
 
-	hashpipe_targets_LoB = {}
-	hashpipe_targets_LoC = {}
+	targets_LoB = {}
+	targets_LoC = {}
 	for seti_node in seti_nodes:
 		for instance in instances:
 			redis_get_chan = REDISGETGW.substitute(
@@ -72,7 +88,7 @@ def resolve_hashpipe_targets():
 			)
 
 			antenna_list = hpguppi_aux.get_antennae_of_redis_chan(
-				redis_obj,
+				get_redis_obj(),
 				redis_get_chan
 			)
 			if len(antenna_list) == 0:
@@ -81,10 +97,12 @@ def resolve_hashpipe_targets():
 			# print(f"{seti_node}.{instance}: {antenna_list}")
 			lo = antenna_list[0][-1]
 			if lo == "B":
-				hashpipe_targets_LoB[seti_node] = hashpipe_targets_LoB.get(seti_node, [])
-				hashpipe_targets_LoB[seti_node].append(instance)
+				targets_LoB[seti_node] = targets_LoB.get(seti_node, [])
+				targets_LoB[seti_node].append(instance)
 			elif lo == "C":
-				hashpipe_targets_LoC[seti_node] = hashpipe_targets_LoC.get(seti_node, [])
-				hashpipe_targets_LoC[seti_node].append(instance)
+				targets_LoC[seti_node] = targets_LoC.get(seti_node, [])
+				targets_LoC[seti_node].append(instance)
 
-resolve_hashpipe_targets()
\ No newline at end of file
+	# assigned together, once resolved
+	with _lazy_lock:
+		hashpipe_targets_LoB, hashpipe_targets_LoC = targets_LoB, targets_LoC
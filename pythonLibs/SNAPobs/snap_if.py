@@ -1,13 +1,13 @@
 from ata_snap import ata_snap_fengine
-from SNAPobs import snap_defaults, snap_config, snap_control
+from SNAPobs import snap_defaults, snap_config, snap_control, snap_gain_module
+from SNAPobs import snap_if_leveller
 from ATATools import ata_helpers, logger_defaults
-from ATATools.device_lock import set_device_lock, release_device_lock
+from ATATools.device_lock import DeviceLock
 import warnings
 
 import sys,os
 
 import casperfpga
-import subprocess
 import numpy as np
 import pandas as pd
 
@@ -18,10 +18,20 @@ TARGET_RMS = 17
 MAX_ATT = 31.5
 MIN_ATT = 0.0
 
+LOCK_TIMEOUT = 30 #seconds
 
-ATA_CFG      = snap_config.get_ata_cfg()
-ATA_SNAP_IF  = snap_config.get_ata_snap_if() 
-ATA_SNAP_TAB = snap_config.get_ata_snap_tab()
+
+# the configuration is read on first use, see snap_config
+_LAZY_CONFIG = {
+    'ATA_CFG': snap_config.get_ata_cfg,
+    'ATA_SNAP_IF': snap_config.get_ata_snap_if,
+    'ATA_SNAP_TAB': snap_config.get_ata_snap_tab,
+}
+
+def __getattr__(name):
+    if name in _LAZY_CONFIG:
+        return _LAZY_CONFIG[name]()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 
 def round50th(list_n):
@@ -45,71 +55,57 @@ def setatten(antpol_dict):
     """
 
     logger = logger_defaults.getModuleLogger(__name__)
-    antlo_list = []
-    for antpol, attenval in antpol_dict.items():
+    for antpol in antpol_dict:
         if not (antpol.endswith("x") or antpol.endswith("y")):
             raise RuntimeError("Antpol (%s) doesn't end with 'x' or 'y'"
                     %(antpol))
-        ant = antpol[:-1]
-        antlo_list.append(ant)
-
-    antlo_list = list(set(antlo_list))
-
-    obs_ant_tab = ATA_SNAP_TAB[ATA_SNAP_TAB.antlo.isin(antlo_list)]
-    attemp_modules = set(ATA_SNAP_IF.module.tolist())
 
+    mapping = snap_config.get_snap_mapping()
 
-    for att_mod in attemp_modules:
-        ata_snap_if_this_attmod  = ATA_SNAP_IF[ATA_SNAP_IF.module == att_mod]
-
-        if_channels = []
-        atten_values = []
-        for antpol, attenval in antpol_dict.items():
-            antlo = antpol[:-1]
-            pol = antpol[-1]
-            if antlo not in list(ATA_SNAP_TAB.antlo):
-                raise RuntimeError("Antenna (%s) not in antenna list: %s"
-                        %(ant, list(ATA_SNAP_TAB.antlo)))
-            snap_hostname = ATA_SNAP_TAB[ATA_SNAP_TAB.antlo == antlo].snap_hostname.values[0]
-            if not snap_hostname in list(ata_snap_if_this_attmod.snap_hostname):
-                continue
-            snap_if_entry = ATA_SNAP_IF[ATA_SNAP_IF.snap_hostname == snap_hostname]
-
-            if_ch = snap_if_entry['ch'+pol].values[0]
-
-            if_channels.append(if_ch)
-            atten_values.append(attenval)
-
-        if not if_channels:
+    # {module: ([if channels], [attenuations])}
+    module_settings = {}
+    for antpol, attenval in antpol_dict.items():
+        antlo = antpol[:-1]
+        pol = antpol[-1]
+        if antlo not in mapping.antlo_to_snap:
+            raise RuntimeError("Antenna (%s) not in antenna list: %s"
+                    %(antlo, list(mapping.antlo_to_snap)))
+        snap_if = mapping.snap_to_if.get(mapping.antlo_to_snap[antlo])
+        if snap_if is None:
             continue
 
-        _setatten(if_channels, atten_values, att_mod)
+        if_channels, atten_values = module_settings.setdefault(
+                snap_if.module, ([], []))
+        if_channels.append(getattr(snap_if, 'ch'+pol))
+        atten_values.append(attenval)
+
+    # all the modules at once, over the persistent gain module sessions
+    snap_gain_module.get_client().set_many(module_settings)
 
 
 def _setatten(chanlist, attenlist, module=0):
-    logger = logger_defaults.getModuleLogger(__name__)
-    command = "ssh sonata@gain-module%i "%int(module)
-    command += "'python attenuatorMain.py"
-    command += " -n "
-    command += " ".join([str(i) for i in chanlist])
-    command += " -a "
-    command += " ".join(["%.1f"%i for i in attenlist])
-    command += "'"
+    snap_gain_module.get_client().set(module, list(chanlist), list(attenlist))
 
-    logger.info(command)
-    print(command)
-    process = subprocess.Popen(command, stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE, shell=True)
 
-    stdout, stderr = process.communicate()
-    #print(stdout)
-    #print(stderr)
 
+def _lock_name(snap_name):
+    if snap_name.lower().startswith('rfsoc'):
+        # e.g. snap_name "rfsoc2-ctrl-3"
+        # so lock_name = "rfsoc2"
+        return snap_name[:6]
+    return snap_name
 
 
-def tune_if(snap_hosts):
+def tune_if(snap_hosts, tolerance=snap_if_leveller.TOLERANCE,
+        max_iterations=snap_if_leveller.MAX_ITERATIONS, start_attn=START_ATTN):
     """
-    Function to tune the IF
+    Function to tune the IF: the attenuators of all the snap_hosts are
+    adjusted together until the ADC RMS of every channel is within
+    tolerance dB of its target, see snap_if_leveller.level_if
+
+    :param start_attn: initial attenuation, None to start from the
+        current attenuator values (faster if the levels are close)
+    :returns the per channel report of snap_if_leveller.level_if
     """
     logger = logger_defaults.getModuleLogger(__name__)
     logger.info("IF tuner entered")
@@ -125,90 +121,34 @@ def tune_if(snap_hosts):
 
     snap_control.get_system_information(list(snaps_dict.values()))
 
-    snap_names = list(snaps_dict.keys())
-
-    if_tab = ATA_SNAP_IF[ATA_SNAP_IF.snap_hostname.isin(snap_names)]
-    #ant_ch = if_tab.values[:,1:].flatten()
-    att_numbs = if_tab.module.unique()
-    for att_num in att_numbs:
-        #print(if_tab)
-        #print(att_num)
-        if_tab_sub = if_tab[if_tab.module == att_num]
-        #print(if_tab_sub)
-        ant_ch = if_tab_sub[['chx', 'chy']].values.flatten()
-
-        logger.info("Tuning: %s" %if_tab.snap_hostname)
-        logger.info("Attemp chans: %s" %ant_ch)
-
-        prev_attn = np.array([START_ATTN]*len(ant_ch))
-        target_rms = []
-        for host_name in if_tab_sub.snap_hostname:
-            #print(host_name)
-            if host_name.startswith("frb-snap"):
-                target_rms.append(17) #X pol
-                target_rms.append(17) #Y pol
-            elif host_name.startswith("rfsoc"):
-                target_rms.append(1024) #X pol
-                target_rms.append(1024) #Y pol
-            else:
-                print("Something is wrong")
-                sys.exit(-1)
-        target_rms = np.array(target_rms)
-
-        for i in range(3):
-            if np.any(prev_attn > MAX_ATT):
-                warn_ant_ch = ant_ch[prev_attn > MAX_ATT]
-                warn_prev_attn = prev_attn[prev_attn > MAX_ATT]
-                warnings.warn("Trying to set attenuator on channels %s to values %s, which is more than max [%i]"
-                        %(list(warn_ant_ch), list(warn_prev_attn), MAX_ATT))
-                prev_attn[prev_attn > MAX_ATT] = MAX_ATT
-            if np.any(prev_attn < MIN_ATT):
-                warn_ant_ch = ant_ch[prev_attn < MIN_ATT]
-                warn_prev_attn = prev_attn[prev_attn < MIN_ATT]
-                warnings.warn("Trying to set attenuator on channels %s to values %s, which is less than min [%i]"
-                        %(list(warn_ant_ch), list(warn_prev_attn), MIN_ATT))
-                prev_attn[prev_attn < MIN_ATT] = MIN_ATT
-
-            _setatten(ant_ch, prev_attn, att_num)
-            rms = []
-            for snap_name in list(if_tab_sub.snap_hostname.values):
-                snap = snaps_dict[snap_name]
-
-                x, y = (), ()
-
-                if snap_name.lower().startswith('rfsoc'):
-                    # e.g. snap_name "rfsoc2-ctrl-3"
-                    # so lock_name = "rfsoc2"
-                    lock_name = snap_name[:6]
-                else:
-                    lock_name = snap_name
-
-                set_device_lock(lock_name)
-                for i in range(5):
-                    tmpx, tmpy = snap.adc_get_samples()
-                    x += tmpx
-                    y += tmpy
-                release_device_lock(lock_name)
-
-                x = np.array(x)
-                y = np.array(y)
-                print(np.std(x),np.std(y))
-
-                rms.append(x.std())
-                rms.append(y.std())
-
-            rms = np.array(rms)
-            d_attn = 20*np.log10(rms/target_rms)
-            prev_attn = round50th(prev_attn + d_attn)
-    snap_control.disconnect_snaps(snaps)
+    def sample(snap_name):
+        # the pipelines of an rfsoc share its lock, so they are sampled
+        # in turn: wait longer than the default lock timeout
+        with DeviceLock(_lock_name(snap_name), timeout=LOCK_TIMEOUT):
+            return snaps_dict[snap_name].adc_get_samples()
+
+    try:
+        report = snap_if_leveller.level_if(list(snaps_dict.keys()), sample,
+                tolerance=tolerance, max_iterations=max_iterations,
+                start_attn=start_attn)
+    finally:
+        snap_control.disconnect_snaps(snaps)
+
+    for antpol, result in report.items():
+        logger.info("%s (%s): %.1f dB, rms %s (target %s), %s after %i "
+                "iterations, %.1f s" %(antpol, result['snap'],
+                    result['attenuation'], result['rms'], result['target_rms'],
+                    result['status'], result['iterations'], result['time']))
     logger.info("IF tuner ended")
+    return report
 
 
 def tune_if_ants(ant_list, target_rms=TARGET_RMS):
     assert type(ant_list) == list
 
-    obs_ant_tab = ATA_SNAP_TAB[ATA_SNAP_TAB.ANT_name.isin(ant_list)]
-    snap_hosts = list(obs_ant_tab.snap_hostname.values)
+    ant_entries = snap_config.get_snap_mapping().ant_to_entries
+    snap_hosts = [entry.snap_hostname for ant in ant_list
+            for entry in ant_entries.get(ant, ())]
     #print("snap_hosts:")
     #print(snap_hosts)
     tune_if(snap_hosts)
@@ -217,64 +157,15 @@ def tune_if_ants(ant_list, target_rms=TARGET_RMS):
 def tune_if_antslo(antlo_list):
     assert type(antlo_list) == list
 
-    obs_ant_tab = ATA_SNAP_TAB[ATA_SNAP_TAB.antlo.isin(antlo_list)]
-    snap_hosts = list(obs_ant_tab.snap_hostname.values)
+    antlo_to_snap = snap_config.get_snap_mapping().antlo_to_snap
+    snap_hosts = [antlo_to_snap[antlo] for antlo in antlo_list
+            if antlo in antlo_to_snap]
     #print("snap_hosts:")
     #print(snap_hosts)
     tune_if(snap_hosts)
 
 
 
-"""
-def getatten(ant_list):
-    logger = logger_defaults.getModuleLogger(__name__)
-    assert type(ant_list) == list
-    obs_ant_tab = ATA_SNAP_TAB[ATA_SNAP_TAB.ANT_name.isin(ant_list)]
-
-    attemp_modules = set(ATA_SNAP_IF.module.tolist())
-
-    retdict = {}
-
-    for att_mod in attemp_modules:
-        antchnumber = []
-        ata_snap_if_this_attmod = ATA_SNAP_IF[ATA_SNAP_IF.module == att_mod]
-
-        for _, row in obs_ant_tab.iterrows():
-            this_snap_if = ata_snap_if_this_attmod[ata_snap_if_this_attmod.snap_hostname \
-                    == row.snap_hostname]
-            if this_snap_if.shape[0] == 0:
-                continue
-            antchnumber.append(this_snap_if['chx'].values[0]) #yuck
-            antchnumber.append(this_snap_if['chy'].values[0])
-
-        if (len(antchnumber) == 0): #nothing on current module
-            continue 
-
-        command = "ssh sonata@gain-module%i " %(int(att_mod))
-        command += "'python attenuatorMain.py"
-        command += " -n "
-        command += " ".join(antchnumber)
-        command += " -g "
-        command += "'"
-        logger.info(command)
-
-        process = subprocess.Popen(command, stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE, shell=True)
-
-        stdout, stderr = process.communicate()
-        ch_if_attn = _translate_if_output(stdout)
-
-        for _, row in obs_ant_tab.iterrows():
-            this_snap_if = ata_snap_if_this_attmod[
-                    ata_snap_if_this_attmod.snap_hostname == row.snap_hostname]
-            if this_snap_if.shape[0] == 0:
-                continue
-            retdict[row.ANT_name+"x"] = float(ch_if_attn[this_snap_if['chx'].values[0]])
-            retdict[row.ANT_name+"y"] = float(ch_if_attn[this_snap_if['chy'].values[0]])
-
-    return retdict
-"""
-
 def getatten(antlo_list):
     """
     antlo_list: list if ant_los similar to:
@@ -290,66 +181,24 @@ def getatten(antlo_list):
     logger = logger_defaults.getModuleLogger(__name__)
     assert type(antlo_list) == list
 
-    obs_ant_tab = ATA_SNAP_TAB[ATA_SNAP_TAB.antlo.isin(antlo_list)]
-
-    assert len(obs_ant_tab) == len(antlo_list)
-
-    ata_snap_if = ATA_SNAP_IF[
-            ATA_SNAP_IF.snap_hostname.isin(obs_ant_tab.snap_hostname)]
+    mapping = snap_config.get_snap_mapping()
+    assert all(antlo in mapping.antlo_to_snap for antlo in antlo_list)
 
-    att_modules = ata_snap_if.module.unique()
+    snap_antlo = {mapping.antlo_to_snap[antlo]: antlo for antlo in antlo_list}
 
     retdict = {}
 
-    for att_mod in att_modules:
-        this_snap_if = ata_snap_if[ata_snap_if.module == att_mod]
-
-        antchnumber = []
-        for _,row in this_snap_if.iterrows():
-            antchnumber.append(row.chx)
-            antchnumber.append(row.chy)
-
-        command = "ssh sonata@gain-module%i " %(int(att_mod))
-        command += "'python attenuatorMain.py"
-        command += " -n "
-        command += " ".join(antchnumber)
-        command += " -g "
-        command += "'"
-
-        logger.info(command)
-
-        process = subprocess.Popen(command, stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE, shell=True)
-
-        stdout, stderr = process.communicate()
-        ch_if_attn = _translate_if_output(stdout)
+    modules = mapping.if_modules(snap_antlo)
+    # all the modules at once, over the persistent gain module sessions
+    module_attn = snap_gain_module.get_client().get_many({att_mod:
+        [ch for _, snap_if in snap_ifs for ch in (snap_if.chx, snap_if.chy)]
+        for att_mod, snap_ifs in modules.items()})
 
-        for _, row in this_snap_if.iterrows():
-            antlo = obs_ant_tab[obs_ant_tab.snap_hostname == row.snap_hostname].antlo.values[0]
-            retdict[antlo+"x"] = float(ch_if_attn[row['chx']])
-            retdict[antlo+"y"] = float(ch_if_attn[row['chy']])
-
-    return retdict
-
-
-
-def _translate_if_output(stdout):
-    # python 2 output
-    # stdout of shape: '(1, 13.5)\n(2, 14.0)\n(9, 7.5)\n(10, 0.5)\n(13, 5.5)\n(14, 3.5)
-    # python 3 output
-    # stdout of shape: 1 15.0\n2 15.0\n11 15.0\n12 15.0\n
-
-    ret = stdout.decode().strip()
-
-    pairs = ret.split("\n")
-    retdict = {}
-    for i in pairs:
-        if i.startswith("("):
-            tmp = i.strip("(").strip(")")
-            tmp = tmp.replace(" ","").split(",")
-        else:
-            tmp = i.split(" ")
+    for att_mod, snap_ifs in modules.items():
+        ch_if_attn = module_attn[att_mod]
+        for snap_hostname, snap_if in snap_ifs:
+            antlo = snap_antlo[snap_hostname]
+            retdict[antlo+"x"] = float(ch_if_attn[snap_if.chx])
+            retdict[antlo+"y"] = float(ch_if_attn[snap_if.chy])
 
-        retdict[tmp[0]] = tmp[1]
-    #print(retdict)
     return retdict
@@ -0,0 +1,295 @@
+"""
+Closed-loop IF level adjustment of the snaps/rfsocs with the gain
+module attenuators (used by snap_if.tune_if)
+
+All the channels are adjusted together: in every iteration the new
+attenuations are set on all the gain modules at once, then all the
+snaps are sampled in parallel and every channel gets its correction
+
+    d_attn = 20*log10(rms/target_rms)
+
+A channel is done when |d_attn| < tolerance (or when the attenuator is
+at its limit), it is then neither set nor sampled any more; a snap is
+only sampled while one of its channels is not done. The ADC RMS is
+estimated from successive adc_get_samples() calls, until it is known
+to better than RMS_PRECISION_DB:
+
+    from SNAPobs import snap_if_leveller
+
+    report = snap_if_leveller.level_if(snap_names, sample)
+
+where sample(snap_name) returns the (x, y) ADC samples of one
+adc_get_samples() call. See level_if for the report.
+
+This module doesn't talk to the snaps itself, so it can be run against
+simulated snaps and snap_gain_module_mock.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ATATools import logger_defaults
+from SNAPobs import snap_config, snap_gain_module
+
+START_ATTN = 27
+MAX_ATT = 31.5
+MIN_ATT = 0.0
+
+SNAP_TARGET_RMS = 17
+RFSOC_TARGET_RMS = 1024
+
+TOLERANCE = 0.5 #dB, the attenuator step
+MAX_ITERATIONS = 8
+MAX_SAMPLE_CALLS = 5 #adc_get_samples() calls per snap and iteration
+RMS_PRECISION_DB = 0.1
+MAX_WORKERS = 16
+
+POLS = ('x', 'y')
+
+
+def target_rms_for(snap_hostname):
+    if snap_hostname.startswith("frb-snap"):
+        return SNAP_TARGET_RMS
+    elif snap_hostname.startswith("rfsoc"):
+        return RFSOC_TARGET_RMS
+    raise RuntimeError("No target RMS for %s" %snap_hostname)
+
+
+def round50th(attn):
+    """
+    attn rounded to the 0.5 dB attenuator steps
+    """
+    return np.round(np.asarray(attn, dtype=float) * 2) / 2.
+
+
+class RunningRMS:
+    """
+    RMS (standard deviation) of a stream of samples
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+
+    def add(self, samples):
+        samples = np.asarray(samples, dtype=float)
+        self.n += samples.size
+        self.sum += samples.sum()
+        self.sumsq += np.square(samples).sum()
+
+    def rms(self):
+        if self.n == 0:
+            return float('nan')
+        mean = self.sum / self.n
+        return float(np.sqrt(max(self.sumsq / self.n - mean * mean, 0.0)))
+
+    def precision_db(self):
+        """
+        standard error of the RMS estimate in dB (gaussian samples)
+        """
+        if self.n < 2:
+            return float('inf')
+        return float(20 * np.log10(1 + 1 / np.sqrt(2. * self.n)))
+
+
+def measure_rms(sample, snap_hostname, pols=POLS,
+        precision_db=RMS_PRECISION_DB, max_calls=MAX_SAMPLE_CALLS):
+    """
+    RMS of the x and y ADC samples of a snap, sampled until the RMS of
+    pols is known to precision_db, or max_calls calls
+
+    :returns ({'x': rms, 'y': rms}, number of sample calls)
+    """
+    estimates = {pol: RunningRMS() for pol in POLS}
+    ncalls = 0
+    while ncalls < max_calls:
+        x, y = sample(snap_hostname)
+        estimates['x'].add(x)
+        estimates['y'].add(y)
+        ncalls += 1
+        if all(estimates[pol].precision_db() < precision_db for pol in pols):
+            break
+    return {pol: estimates[pol].rms() for pol in POLS}, ncalls
+
+
+class _Channel:
+    """
+    State of one IF channel (one polarisation of a snap) being levelled
+    """
+
+    def __init__(self, snap_hostname, pol, module, channel, attn, target_rms):
+        self.snap_hostname = snap_hostname
+        self.pol = pol
+        self.module = module
+        self.channel = channel
+        self.attn = attn
+        self.target_rms = target_rms
+        self.applied = None
+        self.rms = None
+        self.delta_db = None
+        self.iterations = 0
+        self.status = None
+        self.time = None
+
+    def report(self):
+        return {'snap': self.snap_hostname, 'pol': self.pol,
+                'module': self.module, 'channel': self.channel,
+                'attenuation': float(self.applied) if self.applied is not None
+                    else None,
+                'rms': self.rms, 'target_rms': self.target_rms,
+                'delta_db': self.delta_db, 'iterations': self.iterations,
+                'converged': self.status == 'converged',
+                'status': self.status, 'time': self.time}
+
+
+def _apply(client, channels):
+    """
+    set the attenuation of the channels whose value changed, all
+    the modules at once
+    """
+    module_settings = {}
+    for chan in channels:
+        if chan.attn != chan.applied:
+            chanlist, attenlist = module_settings.setdefault(chan.module, ([], []))
+            chanlist.append(chan.channel)
+            attenlist.append(chan.attn)
+    if module_settings:
+        client.set_many(module_settings)
+    for chan in channels:
+        chan.applied = chan.attn
+
+
+def level_if(snap_hostnames, sample, target_rms=None, tolerance=TOLERANCE,
+        max_iterations=MAX_ITERATIONS, start_attn=START_ATTN,
+        precision_db=RMS_PRECISION_DB, max_sample_calls=MAX_SAMPLE_CALLS,
+        client=None, mapping=None, max_workers=MAX_WORKERS):
+    """
+    Adjust the IF attenuators of snap_hostnames until the ADC RMS of
+    every channel is within tolerance dB of its target, see the module
+    documentation
+
+    :param sample: function returning the (x, y) ADC samples of a snap
+        (one adc_get_samples() call, taking the device lock if needed);
+        called from several threads
+    :param target_rms: target ADC RMS, default target_rms_for(snap)
+    :param start_attn: initial attenuation, None to start from the
+        current values of the gain modules
+    :param client: snap_gain_module client, default get_client()
+    :param mapping: snap_config.SnapMapping, default get_snap_mapping()
+    :returns dictionary with a result per channel, keyed by antlo+pol
+        (snap_hostname+pol if the snap has no antlo), e.g.
+        {'1aAx': {'snap': 'frb-snap1-pi', 'pol': 'x', 'module': '1',
+                  'channel': '3', 'attenuation': 12.5, 'rms': 17.2,
+                  'target_rms': 17, 'delta_db': 0.1, 'iterations': 2,
+                  'converged': True, 'status': 'converged', 'time': 1.4}}
+        where rms and delta_db are the last measurement, at the final
+        attenuation if converged, time is the seconds until the channel
+        was done and status one of:
+            converged       |delta_db| < tolerance
+            limited         the attenuator is at MIN_ATT/MAX_ATT
+            no_signal       the RMS is 0
+            max_iterations  not converged in max_iterations (the last
+                            correction is still applied)
+    """
+    logger = logger_defaults.getModuleLogger(__name__)
+    t_start = time.time()
+    client = client if client is not None else snap_gain_module.get_client()
+    mapping = mapping if mapping is not None else snap_config.get_snap_mapping()
+
+    channels = {}
+    for module, snap_ifs in mapping.if_modules(snap_hostnames).items():
+        for snap_hostname, snap_if in snap_ifs:
+            target = target_rms if target_rms is not None else \
+                    target_rms_for(snap_hostname)
+            entry = mapping.snap_to_entry.get(snap_hostname)
+            for pol in POLS:
+                key = (entry.antlo if entry is not None else snap_hostname) + pol
+                channels[key] = _Channel(snap_hostname, pol, module,
+                        getattr(snap_if, 'ch'+pol), start_attn, target)
+    missing = set(snap_hostnames).difference(
+            chan.snap_hostname for chan in channels.values())
+    if missing:
+        logger.warning("No IF channels for %s in the configuration"
+                %sorted(missing))
+    if not channels:
+        return {}
+
+    if start_attn is None:
+        current = client.get_many({module: [chan.channel for chan in
+            channels.values() if chan.module == module]
+            for module in set(chan.module for chan in channels.values())})
+        for chan in channels.values():
+            chan.applied = float(current[chan.module][chan.channel])
+            # -1 if never set
+            chan.attn = chan.applied if chan.applied >= MIN_ATT else START_ATTN
+    for chan in channels.values():
+        chan.attn = float(round50th(np.clip(chan.attn, MIN_ATT, MAX_ATT)))
+
+    logger.info("levelling %i IF channels of %i snaps on modules %s"
+            %(len(channels), len(set(chan.snap_hostname for chan in
+                channels.values())), sorted(set(chan.module for chan in
+                    channels.values()))))
+
+    nworkers = max(1, min(max_workers, len(channels)))
+    with ThreadPoolExecutor(max_workers=nworkers) as executor:
+        for iteration in range(max_iterations):
+            active = [chan for chan in channels.values() if chan.status is None]
+            if not active:
+                break
+            _apply(client, active)
+
+            # the snaps with channels still to level, and their pols
+            snap_pols = {}
+            for chan in active:
+                snap_pols.setdefault(chan.snap_hostname, []).append(chan.pol)
+            futures = {snap_hostname: executor.submit(measure_rms, sample,
+                snap_hostname, pols, precision_db, max_sample_calls)
+                for snap_hostname, pols in snap_pols.items()}
+            measured = {snap_hostname: future.result()[0]
+                    for snap_hostname, future in futures.items()}
+
+            t_now = time.time() - t_start
+            for chan in active:
+                chan.iterations += 1
+                chan.rms = measured[chan.snap_hostname][chan.pol]
+                if not chan.rms > 0:
+                    chan.delta_db = None
+                    chan.status, chan.time = 'no_signal', t_now
+                    continue
+                chan.delta_db = float(20 * np.log10(chan.rms / chan.target_rms))
+                if abs(chan.delta_db) < tolerance:
+                    chan.status, chan.time = 'converged', t_now
+                    continue
+                new_attn = float(round50th(np.clip(chan.attn + chan.delta_db,
+                    MIN_ATT, MAX_ATT)))
+                if new_attn == chan.attn:
+                    # can't get closer: at a limit, or below the step
+                    at_limit = new_attn in (MIN_ATT, MAX_ATT)
+                    chan.status = 'limited' if at_limit else 'converged'
+                    chan.time = t_now
+                    if at_limit:
+                        logger.warning("IF of %s %s needs %+.1f dB more than "
+                                "the attenuator limit (%.1f dB)"
+                                %(chan.snap_hostname, chan.pol, chan.delta_db,
+                                    new_attn))
+                    continue
+                chan.attn = new_attn
+
+            logger.info("IF levelling iteration %i: %i/%i channels done"
+                    %(iteration + 1, sum(chan.status is not None for chan in
+                        channels.values()), len(channels)))
+
+    unfinished = [chan for chan in channels.values() if chan.status is None]
+    if unfinished:
+        _apply(client, unfinished)
+        t_now = time.time() - t_start
+        for chan in unfinished:
+            chan.status, chan.time = 'max_iterations', t_now
+        logger.warning("IF levelling of %s did not converge in %i iterations"
+                %(["%s%s" %(chan.snap_hostname, chan.pol) for chan in unfinished],
+                    max_iterations))
+
+    return {key: chan.report() for key, chan in channels.items()}
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+benchmarking the IF gain module commands against local stand-ins of
+the modules (SNAPobs.snap_gain_module_mock), one ssh session per
+command (as snap_if did) vs the persistent sessions of
+SNAPobs.snap_gain_module.
+
+The scenario is the attenuator traffic of snap_if.tune_if: for every
+iteration all the channels of every module are set, then read back
+with getatten, e.g.
+
+    python gainModuleBenchmark.py --modules 4 --channels 12
+    python gainModuleBenchmark.py --connect-time 0.5 --iterations 5 --json out.json
+"""
+
+import sys
+
+sys.path.append("..")
+
+import argparse
+import json
+import random
+import subprocess
+import time
+
+from SNAPobs import snap_gain_module, snap_gain_module_mock
+
+
+def make_settings(nmodules, nchannels):
+    """
+    {module: (chanlist, attenlist)} of random attenuations
+    """
+    return {module: (list(range(1, nchannels + 1)),
+        [random.randint(0, 63) / 2. for i in range(nchannels)])
+        for module in range(1, nmodules + 1)}
+
+
+def run_per_call(mock, settings_list):
+    """
+    one "ssh" process per command, one module after the other
+    """
+    retvals = []
+    for settings in settings_list:
+        for module, (chanlist, attenlist) in settings.items():
+            subprocess.run(mock.command(module,
+                snap_gain_module.set_command(chanlist, attenlist)),
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        retval = {}
+        for module, (chanlist, attenlist) in settings.items():
+            proc = subprocess.run(mock.command(module,
+                snap_gain_module.get_command(chanlist)),
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+            retval[module] = snap_gain_module.parse_get_output(
+                    proc.stdout.decode().splitlines(), chanlist)
+        retvals.append(retval)
+    return retvals
+
+
+def run_persistent(client, settings_list):
+    """
+    the persistent sessions, all the modules at once
+    """
+    retvals = []
+    for settings in settings_list:
+        client.set_many(settings)
+        retvals.append(client.get_many({module: chanlist
+            for module, (chanlist, attenlist) in settings.items()}))
+    return retvals
+
+
+def check(settings_list, retvals):
+    for settings, retval in zip(settings_list, retvals):
+        for module, (chanlist, attenlist) in settings.items():
+            assert [retval[module][ch] for ch in chanlist] == attenlist,\
+                    "wrong attenuations read back from module %i" %module
+
+
+def main():
+    parser = argparse.ArgumentParser(description='gain module command benchmark')
+    parser.add_argument('--modules', type=int, default=4,
+            help='number of gain modules')
+    parser.add_argument('--channels', type=int, default=12,
+            help='attenuators set per module')
+    parser.add_argument('--iterations', type=int, default=3,
+            help='set/get rounds (tune_if does 3)')
+    parser.add_argument('--connect-time', type=float, default=0.3,
+            help='session start time of a module (ssh handshake), seconds')
+    parser.add_argument('--channel-time', type=float, default=0.01,
+            help='time to set one attenuator, seconds')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    settings_list = [make_settings(args.modules, args.channels)
+            for i in range(args.iterations)]
+
+    results = {}
+    with snap_gain_module_mock.MockGainModules(args.connect_time,
+            args.channel_time) as mock:
+        t0 = time.time()
+        retvals = run_per_call(mock, settings_list)
+        results['per_call'] = {'time': time.time() - t0,
+                'sessions': 2 * args.modules * args.iterations}
+        check(settings_list, retvals)
+
+        with mock.client() as client:
+            t0 = time.time()
+            retvals = run_persistent(client, settings_list)
+            results['persistent'] = {'time': time.time() - t0,
+                    'sessions': args.modules}
+            check(settings_list, retvals)
+
+            # the sessions are open now
+            t0 = time.time()
+            run_persistent(client, settings_list)
+            results['persistent_warm'] = {'time': time.time() - t0,
+                    'sessions': 0}
+
+    print("%d modules x %d channels, %d iterations, connect %.2f s, "
+            "%.3f s per channel" %(args.modules, args.channels,
+                args.iterations, args.connect_time, args.channel_time))
+    for name, result in results.items():
+        print("%-16s %8.2f s  %4d sessions" %(name, result['time'],
+            result['sessions']))
+    print("speed-up: %.1fx (%.1fx warm)" %(
+        results['per_call']['time'] / results['persistent']['time'],
+        results['per_call']['time'] / results['persistent_warm']['time']))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({'time': time.time(), 'args': vars(args),
+                'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+benchmarking the IF levelling (SNAPobs.snap_if_leveller, used by
+snap_if.tune_if) against simulated snaps/rfsocs and the gain module
+stand-ins (SNAPobs.snap_gain_module_mock), compared to the previous
+tune_if: one module after the other, 3 fixed iterations, 5 serial
+adc_get_samples() calls per snap and one ssh session per command.
+
+The simulated ADC RMS of every channel is its input level attenuated
+by the value set on the stand-in gain module, plus gaussian noise, e.g.
+
+    python ifLevellerBenchmark.py
+    python ifLevellerBenchmark.py --snaps 12 --rfsocs 4 --sample-time 0.2
+    python ifLevellerBenchmark.py --skip-sequential --json out.json
+"""
+
+import sys
+
+sys.path.append("..")
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from SNAPobs import snap_config, snap_gain_module, snap_gain_module_mock
+from SNAPobs import snap_if_leveller
+
+ANTS = ["1a", "1c", "1e", "1f", "1g", "1h", "1k", "2a", "2b", "2c", "2e",
+        "2h", "2j", "2k", "2l", "2m", "3c", "3d", "3e", "3f", "3g", "3h",
+        "3j", "3l", "4e", "4f", "4g", "4j", "4k", "4l", "5b", "5c", "5e",
+        "5g", "5h"]
+CHANNELS_PER_MODULE = 24
+
+
+def write_config(share_dir, nsnaps, nrfsocs):
+    """
+    ata_snap.tab and ata_if.cfg of nsnaps snaps and nrfsocs rfsoc
+    boards (4 pipelines each), 24 IF channels per gain module
+
+    :returns the snap hostnames
+    """
+    hostnames = ["frb-snap%i-pi" %(i + 1) for i in range(nsnaps)]
+    hostnames += ["rfsoc%i-ctrl-%i" %(i + 1, j + 1) for i in range(nrfsocs)
+            for j in range(4)]
+    if len(hostnames) > len(ANTS):
+        raise ValueError("at most %i snaps" %len(ANTS))
+    os.makedirs(share_dir, exist_ok=True)
+    with open(os.path.join(share_dir, "ata_snap.tab"), "w") as f:
+        f.write("# ANT_name LO snap_hostname recv_host recv_port\n")
+        for ant, hostname in zip(ANTS, hostnames):
+            f.write("%s a %s 10.11.1.1 4015\n" %(ant, hostname))
+    with open(os.path.join(share_dir, "ata_if.cfg"), "w") as f:
+        f.write("# snap_hostname module chx chy\n")
+        for i, hostname in enumerate(hostnames):
+            module = 2*i // CHANNELS_PER_MODULE + 1
+            chx = 2*i % CHANNELS_PER_MODULE + 1
+            f.write("%s %i %i %i\n" %(hostname, module, chx, chx + 1))
+    return hostnames
+
+
+class SimulatedSnaps:
+    """
+    adc_get_samples() of the snaps: gaussian noise, with an RMS of the
+    input level of the channel attenuated by its gain module setting
+    """
+
+    def __init__(self, mock, mapping, hostnames, sample_time, nsamples, seed=1):
+        rng = np.random.default_rng(seed)
+        self.mock = mock
+        self.mapping = mapping
+        self.sample_time = sample_time
+        self.nsamples = nsamples
+        self.calls = 0
+        self._calls_lock = threading.Lock()
+        # input RMS (at 0 dB attenuation) per (snap, pol): what would
+        # need 5 to 30 dB of attenuation
+        self.input_rms = {(hostname, pol):
+                snap_if_leveller.target_rms_for(hostname) *
+                10**(rng.uniform(5, 30) / 20.)
+                for hostname in hostnames for pol in snap_if_leveller.POLS}
+        # the pipelines of an rfsoc board share its device lock
+        self._locks = {}
+        for hostname in hostnames:
+            self._locks.setdefault(self.lock_name(hostname), threading.Lock())
+
+    @staticmethod
+    def lock_name(hostname):
+        return hostname[:6] if hostname.startswith("rfsoc") else hostname
+
+    def rms(self, hostname, pol):
+        snap_if = self.mapping.snap_to_if[hostname]
+        attn = self.mock.attenuations(snap_if.module).get(
+                int(getattr(snap_if, 'ch'+pol)), snap_if_leveller.START_ATTN)
+        return self.input_rms[(hostname, pol)] * 10**(-attn / 20.)
+
+    def sample(self, hostname):
+        with self._locks[self.lock_name(hostname)]:
+            with self._calls_lock:
+                self.calls += 1
+            time.sleep(self.sample_time)
+            rng = np.random.default_rng()
+            return tuple(np.round(rng.normal(0, self.rms(hostname, pol),
+                self.nsamples)) for pol in snap_if_leveller.POLS)
+
+    def errors_db(self, hostnames):
+        """
+        final |20 log10(rms/target)| of every channel
+        """
+        return np.array([abs(20 * np.log10(self.rms(hostname, pol) /
+            snap_if_leveller.target_rms_for(hostname)))
+            for hostname in hostnames for pol in snap_if_leveller.POLS])
+
+
+def sequential_tune_if(mock, mapping, snaps, hostnames):
+    """
+    the previous snap_if.tune_if
+    """
+    for att_num, snap_ifs in mapping.if_modules(hostnames).items():
+        module_snap_names = [snap_name for snap_name, _ in snap_ifs]
+        ant_ch = [ch for _, snap_if in snap_ifs for ch in (snap_if.chx, snap_if.chy)]
+        prev_attn = np.array([snap_if_leveller.START_ATTN]*len(ant_ch), dtype=float)
+        target_rms = np.array([snap_if_leveller.target_rms_for(snap_name)
+            for snap_name in module_snap_names for pol in snap_if_leveller.POLS])
+        for i in range(3):
+            prev_attn = np.clip(prev_attn, snap_if_leveller.MIN_ATT,
+                    snap_if_leveller.MAX_ATT)
+            subprocess.run(mock.command(att_num, snap_gain_module.set_command(
+                ant_ch, prev_attn)), stdout=subprocess.PIPE, check=True)
+            rms = []
+            for snap_name in module_snap_names:
+                x, y = [], []
+                for j in range(5):
+                    tmpx, tmpy = snaps.sample(snap_name)
+                    x.extend(tmpx)
+                    y.extend(tmpy)
+                rms.append(np.std(x))
+                rms.append(np.std(y))
+            d_attn = 20*np.log10(np.array(rms)/target_rms)
+            prev_attn = snap_if_leveller.round50th(prev_attn + d_attn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IF levelling benchmark')
+    parser.add_argument('--snaps', type=int, default=12, help='number of snaps')
+    parser.add_argument('--rfsocs', type=int, default=4,
+            help='number of rfsoc boards (4 pipelines each)')
+    parser.add_argument('--sample-time', type=float, default=0.1,
+            help='duration of an adc_get_samples() call, seconds')
+    parser.add_argument('--nsamples', type=int, default=4096,
+            help='samples per adc_get_samples() call and polarisation')
+    parser.add_argument('--connect-time', type=float, default=0.3,
+            help='gain module session start time (ssh handshake), seconds')
+    parser.add_argument('--channel-time', type=float, default=0.01,
+            help='time to set one attenuator, seconds')
+    parser.add_argument('--tolerance', type=float, default=snap_if_leveller.TOLERANCE,
+            help='levelling tolerance, dB')
+    parser.add_argument('--skip-sequential', action='store_true',
+            help="don't run the previous tune_if")
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="if_leveller_")
+    os.environ['ATASHAREDIR'] = tmpdir
+    results = {}
+    try:
+        hostnames = write_config(snap_config.get_ata_share_dir(),
+                args.snaps, args.rfsocs)
+        mapping = snap_config.get_snap_mapping()
+
+        with snap_gain_module_mock.MockGainModules(args.connect_time,
+                args.channel_time) as mock:
+            if not args.skip_sequential:
+                snaps = SimulatedSnaps(mock, mapping, hostnames,
+                        args.sample_time, args.nsamples)
+                t0 = time.time()
+                sequential_tune_if(mock, mapping, snaps, hostnames)
+                errors = snaps.errors_db(hostnames)
+                results['sequential'] = {'time': time.time() - t0,
+                        'sample_calls': snaps.calls,
+                        'max_error_db': float(errors.max()),
+                        'mean_error_db': float(errors.mean())}
+
+            for module in mapping.module_to_snaps:
+                mock.set_attenuations(module, {})
+            snaps = SimulatedSnaps(mock, mapping, hostnames,
+                    args.sample_time, args.nsamples)
+            with mock.client() as client:
+                t0 = time.time()
+                report = snap_if_leveller.level_if(hostnames, snaps.sample,
+                        tolerance=args.tolerance, client=client, mapping=mapping)
+                errors = snaps.errors_db(hostnames)
+                results['leveller'] = {'time': time.time() - t0,
+                        'sample_calls': snaps.calls,
+                        'max_error_db': float(errors.max()),
+                        'mean_error_db': float(errors.mean()),
+                        'max_iterations': max(r['iterations'] for r in report.values()),
+                        'statuses': {status: sum(r['status'] == status
+                            for r in report.values()) for status in
+                            set(r['status'] for r in report.values())}}
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    print("%d snaps + %d rfsoc pipelines, %d IF channels, %.2f s per "
+            "adc_get_samples()" %(args.snaps, 4*args.rfsocs, len(hostnames)*2,
+                args.sample_time))
+    for name, result in results.items():
+        print("%-12s %7.2f s  %4d sample calls  |error| mean %.2f dB, max %.2f dB"
+                %(name, result['time'], result['sample_calls'],
+                    result['mean_error_db'], result['max_error_db']))
+    print("leveller: %s, at most %d iterations" %(results['leveller']['statuses'],
+        results['leveller']['max_iterations']))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({'time': time.time(), 'args': vars(args),
+                'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
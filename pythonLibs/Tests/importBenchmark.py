@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+import time of the ATATools / SNAPobs modules, so regressions in the
+startup latency of the command line tools are caught.
+
+Every module is imported in a fresh interpreter with
+"python -X importtime", several times (the best run is kept), with an
+audit hook reporting the network connections and the data files
+opened during the import (importing a library should do neither,
+the configuration and the redis / REST connections are made on first
+use). e.g.
+
+    python importBenchmark.py
+    python importBenchmark.py --module ATATools.ata_control --top 10
+    python importBenchmark.py --json baseline.json
+    python importBenchmark.py --baseline baseline.json --tolerance 0.3
+
+The exit status is 1 if a module does I/O at import time, exceeds
+--budget, or is slower than --baseline by more than --tolerance.
+Modules that can't be imported here (missing optional dependencies,
+e.g. casperfpga) are reported and skipped.
+"""
+
+import sys
+
+sys.path.append("..")
+
+import argparse
+import json
+import os
+import subprocess
+import time
+
+LIBS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+MODULES = [
+    "ATATools.ata_rest",
+    "ATATools.ata_control",
+    "ATATools.ata_ephem",
+    "ATATools.ata_pointing",
+    "ATATools.ata_positions",
+    "ATATools.ata_catalog",
+    "ATATools.ata_coords",
+    "ATATools.ata_windsock",
+    "ATATools.device_lock",
+    "SNAPobs",
+    "SNAPobs.snap_defaults",
+    "SNAPobs.snap_config",
+    "SNAPobs.snap_gain_module",
+    "SNAPobs.snap_if_leveller",
+    "SNAPobs.snap_if",
+    "SNAPobs.snap_dada.snap_dada",
+    "SNAPobs.snap_hpguppi.snap_hpguppi_defaults",
+]
+
+# run in the child interpreter before the import: records the socket
+# connections and the files opened that are not python code
+_AUDIT_CODE = """
+import sys
+_io_events = []
+_code_ext = ('.py', '.pyc', '.so', '.pth', '.typed')
+_prefixes = tuple(set([sys.prefix, sys.base_prefix, sys.exec_prefix]))
+def _hook(event, args):
+    if event == 'socket.connect':
+        _io_events.append('connect %s' %(args[1],))
+    elif event == 'open' and isinstance(args[0], str):
+        path = args[0]
+        if not path.endswith(_code_ext) and not path.startswith(_prefixes) \\
+                and not path.startswith('/proc') and '__pycache__' not in path:
+            _io_events.append('open %s' %path)
+sys.addaudithook(_hook)
+"""
+
+_REPORT_CODE = """
+import json
+sys.stdout.write('IO_EVENTS ' + json.dumps(_io_events) + '\\n')
+"""
+
+
+def parse_importtime(stderr):
+    """
+    list of (self_us, cumulative_us, module) of the -X importtime report
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        rows.append((int(fields[0]), int(fields[1]), fields[2].rstrip()))
+    return rows
+
+
+def time_import(module, env):
+    """
+    :returns dictionary with the import time of module (ms), the
+        slowest nested imports and the I/O events, or the error
+    """
+    t0 = time.time()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c",
+        _AUDIT_CODE + "import " + module + _REPORT_CODE], cwd=LIBS_DIR, env=env,
+        capture_output=True, text=True)
+    wall = time.time() - t0
+    if proc.returncode != 0:
+        error = [line for line in proc.stderr.splitlines()
+                if not line.startswith("import time:")]
+        return {'module': module, 'error': error[-1] if error else 'failed'}
+
+    rows = parse_importtime(proc.stderr)
+    total = [row for row in rows if row[2].strip() == module]
+    io_events = []
+    for line in proc.stdout.splitlines():
+        if line.startswith("IO_EVENTS "):
+            io_events = json.loads(line[len("IO_EVENTS "):])
+    return {'module': module,
+            'import_ms': total[-1][1] / 1000. if total else sum(r[0] for r in rows) / 1000.,
+            'process_ms': wall * 1000.,
+            'slowest': sorted(((r[0] / 1000., r[2].strip()) for r in rows), reverse=True),
+            'io_events': io_events}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='import time benchmark of pythonLibs')
+    parser.add_argument('--module', action='append',
+            help='module to time (default: all of MODULES), can be repeated')
+    parser.add_argument('--repeat', type=int, default=3,
+            help='imports per module, the fastest is reported')
+    parser.add_argument('--top', type=int, default=5,
+            help='number of slowest nested imports to show')
+    parser.add_argument('--budget', type=float,
+            help='maximum import time of every module, ms')
+    parser.add_argument('--baseline', help='json file of a previous run to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+            help='allowed slowdown relative to --baseline (0.5: +50%%)')
+    parser.add_argument('--keep-env', action='store_true',
+            help="don't unset ATASHAREDIR (by default the imports must "
+                 "work without the configuration files)")
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if not args.keep_env:
+        env.pop('ATASHAREDIR', None)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {r['module']: r for r in json.load(f)['results']
+                    if 'import_ms' in r}
+
+    results = []
+    failed = False
+    for module in args.module or MODULES:
+        runs = [time_import(module, env) for i in range(max(args.repeat, 1))]
+        if 'error' in runs[0]:
+            print("%-44s not importable here: %s" %(module, runs[0]['error']))
+            results.append(runs[0])
+            continue
+        best = min(runs, key=lambda r: r['import_ms'])
+        results.append(best)
+
+        problems = []
+        if best['io_events']:
+            problems.append("I/O at import: " + ", ".join(best['io_events'][:5]))
+        if args.budget is not None and best['import_ms'] > args.budget:
+            problems.append("over budget (%.0f ms)" %args.budget)
+        if module in baseline:
+            reference = baseline[module]['import_ms']
+            if best['import_ms'] > reference * (1 + args.tolerance):
+                problems.append("slower than baseline (%.1f ms)" %reference)
+        failed |= bool(problems)
+
+        print("%-44s %8.1f ms %s" %(module, best['import_ms'],
+            "  <-- " + "; ".join(problems) if problems else ""))
+        for self_ms, name in best['slowest'][:args.top]:
+            print("    %8.1f ms  %s" %(self_ms, name))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({'time': time.time(), 'python': sys.version,
+                'results': [{k: v for k, v in r.items() if k != 'slowest'}
+                    for r in results]}, f, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+benchmarking the REST calls of typical observing scripts against
+the local REST gateway stand-in (ATATools.ata_rest_mock), so changes
+to the control layer can be measured without the telescope.
+
+Every scenario replays the control calls of a script and reports
+the number of REST calls and the wall time, e.g.
+
+    python restBenchmark.py --latency 0.05 --slew-time 0.5
+    python restBenchmark.py --scenario start_recording --json out.json
+"""
+
+import sys
+
+sys.path.append("..")
+
+import argparse
+import json
+import logging
+import time
+
+from ATATools import ata_control, ata_pointing, ata_sources, ata_cache
+from ATATools import ata_rest_metrics, ata_rest_mock, logger_defaults
+
+ANT_LIST = ["1c", "1e", "1g", "1h", "1k", "2a", "2b", "2c",
+        "2h", "2j", "2k", "2l", "2m", "3c", "3d",
+        "3l", "4j", "5b", "4g"]
+LO = "b"
+FREQ = 1575
+
+
+def atapointer_cross_scan(ant_list):
+    """
+    the control calls of one satellite cross scan of
+    ObservationScripts/atapointer_multi_final_rfsoc_xypol.py
+    (without the recordings)
+    """
+    pms = ata_pointing.PointingModelSet(ant_list)
+    ata_control.reserve_antennas(ant_list)
+    try:
+        pams = {ant+pol:27 for ant in ant_list for pol in ["x","y"]}
+        ata_control.set_pams(pams)
+        ata_control.set_freq([FREQ]*len(ant_list), ant_list, lo=LO)
+
+        pbfwhm = (3.5 / FREQ * 1000.0)
+        delta = pbfwhm / 2.0
+        offsets = [[0., 4*delta], [0., delta], [0., 0.], [0., -delta],
+                [0., -4*delta], [-4*delta, 0.], [-delta, 0.], [0., 0.],
+                [delta, 0.], [4*delta, 0.]]
+
+        sats = ata_sources.get_sats()['GPS']
+        name = sats[0]['name']
+        ephem = ata_control.create_ephem_points(name, **{'duration': 2, 'interval': 1})
+
+        for offset in offsets:
+            ata_control.track_and_offset(name, ant_list, xoffset=offset)
+            for ant in ant_list:
+                az_el = ata_control.get_az_el(ant_list)[ant]
+    finally:
+        ata_control.release_antennas(ant_list, False)
+
+
+def start_recording_sequential(ant_list):
+    """
+    the control-system reads of snap_dada.start_recording as they
+    were done one after the other (get_obs_params before the snapshot)
+    """
+    source = ata_control.get_eph_source(ant_list)
+    radec = ata_control.get_ra_dec(ant_list)
+    azel = ata_control.get_az_el(ant_list)
+    skyfreq = ata_control.get_freq(ant_list, lo=LO)
+    pamvals = ata_control.get_pams(ant_list)
+    detvals = ata_control.get_dets(ant_list)
+
+
+def start_recording(ant_list):
+    """
+    the control-system reads of snap_dada.start_recording
+    (snap_dada.get_obs_params without the IF attenuators)
+    """
+    snapshots = ata_control.get_antenna_snapshot(ant_list, los=[LO])
+    failed = [ant for ant, snap in snapshots.items() if not snap.ok]
+    if failed:
+        raise RuntimeError("snapshot failed for %s" %failed)
+
+
+SCENARIOS = {
+    'atapointer_cross_scan': atapointer_cross_scan,
+    'start_recording_sequential': start_recording_sequential,
+    'start_recording': start_recording,
+}
+
+
+def run_scenario(name, gw, ant_list, repeat):
+    results = []
+    for i in range(repeat):
+        ata_cache.set_enabled(False)
+        gw.reset_calls()
+        with ata_rest_metrics.profile(name) as prof:
+            SCENARIOS[name](ant_list)
+        ata_cache.set_enabled(True)
+        results.append(prof)
+
+    walls = [prof.wall_time for prof in results]
+    summary = {'scenario': name, 'repeat': repeat,
+            'calls': results[-1].metrics.total_calls(),
+            'server_calls': gw.total_calls(),
+            'wall_time_min': min(walls),
+            'wall_time_mean': sum(walls) / len(walls),
+            'wall_time_max': max(walls),
+            'rest_time_mean': sum(prof.rest_time for prof in results) / len(results),
+            'endpoints': results[-1].metrics.snapshot()}
+    return summary, results[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='REST call benchmark of the ATA control scripts')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+            help='scenario to run (default: all), can be repeated')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--nants', type=int, default=len(ANT_LIST),
+            help='number of antennas to use')
+    parser.add_argument('--latency', type=float, default=0.03,
+            help='mean REST gateway latency in seconds')
+    parser.add_argument('--per-antenna-latency', type=float, default=0.002,
+            help='additional latency per antenna in seconds')
+    parser.add_argument('--slew-time', type=float, default=0.2,
+            help='duration of the calls waiting for the antennas in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+            help='fraction of requests failing with a 503')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logger_defaults.getProgramLogger("restBenchmark",
+            loglevel=logging.INFO if args.verbose else logging.WARNING)
+
+    ant_list = ANT_LIST[:args.nants]
+    scenarios = args.scenario or sorted(SCENARIOS)
+
+    summaries = []
+    with ata_rest_mock.MockRestGateway(latency=args.latency,
+            per_antenna_latency=args.per_antenna_latency,
+            slew_time=args.slew_time, error_rate=args.error_rate) as gw:
+        gw.install()
+        for name in scenarios:
+            summary, prof = run_scenario(name, gw, ant_list, args.repeat)
+            summaries.append(summary)
+            print(prof.report())
+            print("  wall time min/mean/max: %.3f/%.3f/%.3f s over %d runs\n" %(
+                summary['wall_time_min'], summary['wall_time_mean'],
+                summary['wall_time_max'], args.repeat))
+
+    print("%-28s %8s %12s" %("scenario", "calls", "wall [s]"))
+    for summary in summaries:
+        print("%-28s %8d %12.3f" %(summary['scenario'], summary['calls'],
+            summary['wall_time_mean']))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({'args': vars(args), 'time': time.time(),
+                'results': summaries}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()